@@ -1,23 +1,148 @@
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Dict
+import numpy as np
+from core.settings import settings
 from utils.singleton import Singleton
+from utils.frame_cache import FrameCache
 from rag.langchain_agent import LangChanAgent
-from db.models_crud import AgentCRUD, ActiveAgentCRUD, ChatCRUD
+from rag.numpy_store import NumpyVectorStore
+from rag.bm25 import BM25Index
+from rag.hybrid_retriever import HybridRetriever
+from db.models_crud import AgentCRUD
+
+
+@dataclass
+class LoadedAgent:
+    """Loaded agent with its load statistics."""
+    agent: LangChanAgent
+    load_time: float
+    memory_bytes: int
+    uses: int = 0
+
+
+def agent_memory(agent: LangChanAgent) -> int:
+    """
+    Estimated resident size of an agent, the size of its index data held in memory.
+    Memory-mapped vectors of the numpy store stay on disk and are not counted,
+    chroma holds its HNSW index files in memory, the document database stays on disk
+    """
+    if not agent.agent_dir:
+        return 0
+    vectorstore_dir = agent.agent_dir / LangChanAgent.vectorstore_path
+    store = agent.vector_store
+    if isinstance(store, NumpyVectorStore):
+        arrays = [store.vectors, store.scales, store.rescore_vectors]
+        size = sum(array.nbytes for array in arrays if array is not None and not isinstance(array, np.memmap))
+        # Documents are loaded from the json sidecar
+        size += (vectorstore_dir / NumpyVectorStore.documents_file).stat().st_size
+    else:
+        size = sum(path.stat().st_size for path in vectorstore_dir.rglob('*.bin') if path.is_file())
+
+    bm25_path = vectorstore_dir / BM25Index.file_name
+    if isinstance(agent.retriever, HybridRetriever) and bm25_path.exists():
+        size += bm25_path.stat().st_size
+    return size
+
 
 class AgentManager(metaclass=Singleton):
-    """Agent manager class."""
-    def __init__(self):
-        self.agents = {}
+    """
+    Process-resident pool of loaded agents.
+    Agents are loaded lazily on first use, least recently used agents are evicted
+    when the pool exceeds max_agents or max_memory, the chroma clients of evicted agents are released.
+    """
+    def __init__(self, max_agents: int = None, max_memory: int = None):
+        self.max_agents = max_agents or settings.agent_pool_size
+        self.max_memory = max_memory or settings.agent_pool_max_memory
+        self.agents: OrderedDict[str, LoadedAgent] = OrderedDict()
+        self.lock = threading.Lock()
+        # One lock per agent being loaded, so the same agent is never loaded twice
+        # and loading does not block access to other agents
+        self.loading: Dict[str, threading.Lock] = {}
+        # Frames are cached once for all agents of the process
+        self.frame_cache = FrameCache()
 
-    def add(self, agent_id: str, agent: LangChanAgent):
+    def add(self, agent_id: str, agent: LangChanAgent, load_time: float = 0.0):
         """Add agent."""
-        self.agents[agent_id] = agent
+        memory_bytes = agent_memory(agent)
+        with self.lock:
+            self.agents[agent_id] = LoadedAgent(agent=agent, load_time=load_time, memory_bytes=memory_bytes)
+            self.agents.move_to_end(agent_id)
+            self._evict()
 
     def get(self, agent_id) -> LangChanAgent:
-        """Get agent."""
-        if agent_id not in self.agents:
-            agent_db = AgentCRUD().read(agent_id)
-            if not agent_db:
-                raise ValueError(f"Agent {agent_id} not found.")
-            self.add(agent_db.id, LangChanAgent.load(Path(agent_db.agent_dir)))
-
-        return self.agents.get(agent_id)
\ No newline at end of file
+        """Get agent, loading it if needed."""
+        with self.lock:
+            loaded = self._touch(agent_id)
+            if loaded:
+                return loaded.agent
+            agent_lock = self.loading.setdefault(agent_id, threading.Lock())
+
+        with agent_lock:
+            with self.lock:
+                loaded = self._touch(agent_id)
+                if loaded:
+                    return loaded.agent
+            try:
+                agent = self._load(agent_id)
+            finally:
+                with self.lock:
+                    self.loading.pop(agent_id, None)
+            return agent
+
+    def prefetch(self, agent_id):
+        """Load agent in the background, e.g. when it is selected."""
+        with self.lock:
+            if agent_id in self.agents or agent_id in self.loading:
+                return
+        threading.Thread(target=self.get, args=(agent_id,), daemon=True).start()
+
+    def evict(self, agent_id) -> bool:
+        """Remove agent from the pool."""
+        with self.lock:
+            loaded = self.agents.pop(agent_id, None)
+        if loaded is None:
+            return False
+        loaded.agent.release()
+        return True
+
+    def stats(self) -> Dict[str, dict]:
+        """Load time in seconds, estimated resident size in bytes and number of uses per agent."""
+        with self.lock:
+            return {
+                agent_id: {
+                    'name': loaded.agent.name,
+                    'load_time': loaded.load_time,
+                    'memory_bytes': loaded.memory_bytes,
+                    'uses': loaded.uses,
+                } for agent_id, loaded in self.agents.items()
+            }
+
+    def _touch(self, agent_id) -> LoadedAgent | None:
+        loaded = self.agents.get(agent_id)
+        if loaded:
+            self.agents.move_to_end(agent_id)
+            loaded.uses += 1
+        return loaded
+
+    def _load(self, agent_id) -> LangChanAgent:
+        agent_db = AgentCRUD().read(agent_id)
+        if not agent_db:
+            raise ValueError(f"Agent {agent_id} not found.")
+
+        start = time.perf_counter()
+        agent = LangChanAgent.load(Path(agent_db.agent_dir))
+        self.add(agent_id, agent, time.perf_counter() - start)
+        return agent
+
+    def _evict(self):
+        # The most recently used agent is always kept, even if it alone exceeds the memory budget
+        while len(self.agents) > 1 and (
+                len(self.agents) > self.max_agents
+                or sum(loaded.memory_bytes for loaded in self.agents.values()) > self.max_memory
+        ):
+            _, loaded = self.agents.popitem(last=False)
+            loaded.agent.release()
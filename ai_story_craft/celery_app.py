@@ -1,12 +1,50 @@
 import time
-from integrations.messenger_sender import messenger_factory
+import threading
+from integrations.messenger_sender import messenger_factory, BaseMessageSender
 from pathlib import Path
-from celery import Celery
+from typing import Callable, List
+from celery import Celery, chain
+from celery.signals import worker_process_init
 from story_craft import StoryCraft
 from core.settings import settings
+from whisper_pool import WhisperModelPool
+from utils.single_flight import SingleFlight
 from video_processing.youtube_video_processor import YoutubeVideoProcessor
+from db.models_crud import VideoCRUD, AgentCRUD
+from db.models import Video, IngestionStage
 
 celery_app = Celery("worker", broker=settings.CELERY_BACKEND_URL,  backend=settings.CELERY_BACKEND_URL)
+# Route ingestion stages to their queues, stages without configured queue go to the default one
+celery_app.conf.task_routes = {
+    f"celery_app.{stage}_stage": {"queue": queue} for stage, queue in settings.ingestion_queues.items()
+}
+
+@worker_process_init.connect
+def preload_whisper_model(**kwargs):
+    """Load local whisper model once per worker process, so tasks don't pay the load time"""
+    if settings.whisper_use_api:
+        return
+    WhisperModelPool().preload(settings.whisper_model)
+
+
+def download_progress(update_sender, interval: float = 5.0):
+    """Create download progress callback, updating the message not more often than once in interval seconds"""
+    last_update = [0.0]
+    # callback is called from several download threads
+    lock = threading.Lock()
+
+    def callback(downloaded: int, total: int, throughput: float):
+        with lock:
+            now = time.monotonic()
+            if now - last_update[0] < interval and downloaded < total:
+                return
+            last_update[0] = now
+            update_sender.update_message(
+                f"Downloading: {downloaded * 100 // max(total, 1)}% ({throughput / 1024 / 1024:.1f} MB/s)"
+            )
+
+    return callback
+
 
 def check_celery_worker() -> bool:
     try:
@@ -18,35 +56,191 @@ def check_celery_worker() -> bool:
     except Exception:
         return False
 
-@celery_app.task
-def process_youtube_video(youtube_url: str, update_sender):
-    update_sender = messenger_factory(update_sender)
-    update_sender.update_message("Processing video...")
-        
+class IngestionProgress:
+    """
+    Sends ingestion progress to the chat which started the ingestion
+    and to all chats which submitted the same video while it was running
+    """
+
+    def __init__(self, flight_key: str, update_sender: dict):
+        self.flight_key = flight_key
+        self.update_sender = update_sender
+
+    def senders(self) -> List[BaseMessageSender]:
+        subscribers = SingleFlight().subscribers(self.flight_key)
+        return [messenger_factory(sender) for sender in [self.update_sender] + subscribers]
+
+    def update_message(self, text: str):
+        for sender in self.senders():
+            sender.update_message(text)
+
+
+@celery_app.task(bind=True)
+def process_youtube_video(self, youtube_url: str, update_sender):
+    """
+    Start the video ingestion pipeline. Every stage is a separate task, which can be routed to its own queue,
+    a failed stage is retried without redoing the completed ones.
+    If the same video is already being processed, the chat is attached to the running ingestion instead.
+    """
+    sender = messenger_factory(update_sender)
+    sender.update_message("Processing video...")
+
     if not Path(settings.working_directory).exists():
-        if update_sender:
-            update_sender.update_message(f"Working directory not found: {settings.working_directory}")
+        sender.update_message(f"Working directory not found: {settings.working_directory}")
         raise FileNotFoundError(f"Working directory not found: {settings.working_directory}")
 
-    video_processor = YoutubeVideoProcessor.from_url(youtube_url)
-    if update_sender:
-        update_sender.update_message("Downloading video...")
-    video_db = video_processor.process()
+    flight_key = YoutubeVideoProcessor.hash_url(youtube_url)
+    if not SingleFlight().join(flight_key, owner=self.request.id, subscriber=update_sender):
+        sender.update_message("This video is already being processed, progress will be shown here.")
+        return
+
+    try:
+        video_processor = YoutubeVideoProcessor.from_url(youtube_url)
+    except Exception:
+        ingestion_failed(flight_key, update_sender)
+        raise
+    video_id = video_processor.video_record.id
 
-    if update_sender:
-        update_sender.update_message("Extracting subtitles...")
+    chain(
+        download_stage.si(video_id, flight_key, update_sender),
+        audio_extract_stage.si(video_id, flight_key, update_sender),
+        transcribe_stage.si(video_id, flight_key, update_sender),
+        index_stage.si(video_id, flight_key, update_sender),
+        describe_stage.si(video_id, flight_key, update_sender),
+    ).on_error(ingestion_failed.si(flight_key, update_sender)).apply_async()
 
-    StoryCraft(
-        work_directory=Path(settings.working_directory) / video_processor.video_record.hash_sum,
+
+def run_stage(video_id: int, flight_key: str | None, stage: IngestionStage, func: Callable[[Video], None]) -> Video:
+    """
+    Run ingestion stage if it is not completed yet and save the checkpoint with the stage duration
+    :param video_id:
+    :param flight_key: single-flight key of the ingestion, None for stages run after the ingestion lock is released
+    :param stage:
+    :param func: stage implementation, receives the video record
+    :return: updated video record
+    """
+    video_db = VideoCRUD().read(video_id)
+    if video_db is None:
+        raise ValueError(f"Video {video_id} not found.")
+    if VideoCRUD.is_stage_completed(video_db, stage):
+        return video_db
+
+    if flight_key:
+        SingleFlight().refresh(flight_key)
+    start = time.perf_counter()
+    func(video_db)
+    return VideoCRUD().complete_stage(video_id, stage, time.perf_counter() - start)
+
+
+def get_story_craft(video_db: Video) -> StoryCraft:
+    return StoryCraft(
+        work_directory=Path(settings.working_directory) / video_db.hash_sum,
         video_db=video_db
-    ).evaluate(
-        external_chat_id=update_sender.external_chat_id,
-        assistant_name=video_processor.video_record.title,
-        overwrite=True,
     )
 
-    if update_sender:
-        update_sender.update_message("Video processed successfully.")
+
+stage_task = celery_app.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=settings.ingestion_stage_retries
+)
+
+
+@stage_task
+def download_stage(video_id: int, flight_key: str, update_sender: dict):
+    progress = IngestionProgress(flight_key, update_sender)
+
+    def download(video_db: Video):
+        video_processor = YoutubeVideoProcessor(video_db, download_progress(progress))
+        if settings.audio_first_ingestion:
+            progress.update_message("Downloading audio...")
+            video_processor.process_audio()
+        else:
+            progress.update_message("Downloading video...")
+            video_processor.process()
+
+    run_stage(video_id, flight_key, IngestionStage.download, download)
+
+
+@stage_task
+def audio_extract_stage(video_id: int, flight_key: str, update_sender: dict):
+    IngestionProgress(flight_key, update_sender).update_message("Extracting audio...")
+    run_stage(
+        video_id, flight_key, IngestionStage.audio_extract,
+        lambda video_db: get_story_craft(video_db).extract_audio()
+    )
+
+
+@stage_task
+def transcribe_stage(video_id: int, flight_key: str, update_sender: dict):
+    IngestionProgress(flight_key, update_sender).update_message("Extracting subtitles...")
+    run_stage(
+        video_id, flight_key, IngestionStage.transcribe,
+        lambda video_db: get_story_craft(video_db).transcribe()
+    )
+
+
+@stage_task
+def index_stage(video_id: int, flight_key: str, update_sender: dict):
+    IngestionProgress(flight_key, update_sender).update_message("Indexing subtitles...")
+    run_stage(
+        video_id, flight_key, IngestionStage.index,
+        lambda video_db: get_story_craft(video_db).index(overwrite=True)
+    )
+
+
+@stage_task
+def describe_stage(video_id: int, flight_key: str, update_sender: dict):
+    IngestionProgress(flight_key, update_sender).update_message("Generating description...")
+    video_db = run_stage(
+        video_id, flight_key, IngestionStage.describe,
+        lambda video_db: get_story_craft(video_db).describe(video_db.title)
+    )
+
+    # Release the lock and deliver the result to every chat attached to this ingestion.
+    # Access is granted even if the video was ingested before for another chat
+    agent = AgentCRUD().get_by_name(video_db.title)
+    for sender_dict in [update_sender] + SingleFlight().finish(flight_key):
+        sender = messenger_factory(sender_dict)
+        StoryCraft.grant_access(sender.external_chat_id, agent)
+        sender.update_message("Video processed successfully.")
+
+    if settings.audio_first_ingestion:
+        chain(download_video.si(video_id, wait=True), keyframes_stage.si(video_id)).apply_async()
+    else:
+        keyframes_stage.delay(video_id)
+
+
+@stage_task
+def keyframes_stage(video_id: int):
+    """Extract scene change keyframes once the video is downloaded"""
+    # The ingestion lock is already released, it may be held by another ingestion of the video now
+    run_stage(
+        video_id, None, IngestionStage.keyframes,
+        lambda video_db: get_story_craft(video_db).extract_keyframes()
+    )
+
+
+@celery_app.task
+def ingestion_failed(flight_key: str, update_sender: dict):
+    """Release the single-flight lock of a failed ingestion and notify attached chats"""
+    for sender_dict in [update_sender] + SingleFlight().finish(flight_key):
+        messenger_factory(sender_dict).update_message("Video processing failed.")
+
+
+@celery_app.task
+def download_video(video_id: int, wait: bool = False):
+    """
+    Download the video stream in background after the agent was built from the audio
+    :param video_id:
+    :param wait: wait for a download running in another task, screenshot requests enqueue the download
+        repeatedly and don't wait, the keyframes stage needs the video
+    :return:
+    """
+    video_db = VideoCRUD().read(video_id)
+    if video_db is None:
+        raise ValueError(f"Video {video_id} not found.")
+    YoutubeVideoProcessor(video_db).process_video(wait=wait)
 
 @celery_app.task
 def wait(update_sender: dict):
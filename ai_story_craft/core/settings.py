@@ -6,25 +6,106 @@ class Settings(BaseSettings):
     whisper_model: str = 'turbo'
     whisper_use_api: bool = True
     whisper_api_model: str = 'whisper-1'  # only one model is supported for now
+    whisper_api_chunked: bool = False
+    whisper_api_chunk_duration: int = 600  # max chunk length in seconds
+    whisper_api_max_workers: int = 4
+    whisper_pool_size: int = 1  # number of local whisper models kept in memory per process
+    silence_threshold_db: int = -35
+    silence_min_duration: float = 0.5
+    remove_silence: bool = False  # cut silent parts from audio before transcription
+    silence_padding: float = 0.2  # seconds of silence kept around speech
+    audio_speedup: float = 1.0  # speed up audio before transcription
+    audio_streaming: bool = False  # pipe decoded audio to transcription without temp files
+
+    use_youtube_captions: bool = True  # try existing YouTube captions before whisper
+    captions_allow_generated: bool = True
+    # preferred caption languages in order, empty to use the spoken language detected by YouTube
+    captions_languages: list[str] = []
+    captions_min_coverage: float = 0.5  # min share of the video duration covered by captions
+    captions_max_noise_ratio: float = 0.3  # max share of non-speech entries like [Music]
 
     assistant_model: str = 'gpt-4o'
+    agent_pool_size: int = 32  # agents kept loaded per bot process
+    agent_pool_max_memory: int = 1024 * 1024 * 1024  # estimated bytes of loaded agents
+    embedding_model: str = 'text-embedding-ada-002'
+    embedding_cache: str = 'disk'  # disk, redis or none
+    embedding_cache_path: str | None = None  # defaults to <working_directory>/embeddings.db
+    embedding_cache_max_entries: int = 200_000
+    embedding_api_base: str | None = None  # e.g. a local fake server for benchmarks
+    embedding_batch_tokens: int = 8000  # tokens per embedding request
+    embedding_batch_size: int = 512  # texts per embedding request
+    embedding_max_workers: int = 4
+    embedding_requests_per_minute: int = 3000
+    embedding_tokens_per_minute: int = 1_000_000
+    embedding_max_retries: int = 6
+    embedding_retry_backoff: float = 1.0  # seconds, doubled on every retry
+    vector_store: str = 'chroma'  # chroma or numpy, existing agents are opened in their own format
+    vector_store_dtype: str = 'float32'  # float32, float16 or int8, numpy vector store only
+    vector_store_dimensions: int | None = None  # reduced dimensions, text-embedding-3 models only
+    vector_store_rescore: bool = False  # keep float32 vectors to rescore the best candidates
+    vector_store_rescore_candidates: int = 4  # candidates rescored per retrieved document
+    retrieval_mode: str = 'vector'  # vector, hybrid or lexical, lexical retrieval makes no network calls
+    retrieval_k: int = 4  # chunks retrieved per question
+    retrieval_lexical_weight: float = 0.5  # weight of BM25 scores in hybrid retrieval
+    answer_cache: bool = True  # share answers to similar questions about the same agent
+    answer_cache_similarity: float = 0.95  # min cosine similarity of questions
+    answer_cache_ttl: int = 7 * 24 * 3600
+    answer_cache_max_entries: int = 256  # per agent
+    answer_cache_timeout: float = 0.5  # seconds, Redis errors and timeouts are treated as a miss
+    chunk_max_tokens: int = 256  # subtitle tokens per indexed chunk
+    chunk_overlap_tokens: int = 48  # tokens repeated between consecutive chunks
     OPENAI_API_KEY: str
 
     telegram_bot_token: str
+    telegram_concurrent_updates: int = 64  # updates handled at once, handlers don't block the event loop
     discord_bot_token: str
     new_session_timeout: int = 3600
 
     working_directory: str
     videos_directory: str
 
+    content_cache: bool = True  # reuse transcripts and embeddings of the same audio
+    content_cache_directory: str | None = None  # defaults to <working_directory>/cache
+    content_cache_max_size: int = 5 * 1024 ** 3  # bytes
+    fingerprint_min_duration: int = 30  # seconds, shorter audio is not cached
+    fingerprint_min_dynamics_db: float = 3.0  # min loudness deviation, silent or flat audio is not cached
+    fingerprint_tolerance_db: float = 1.5  # max mean loudness difference of envelopes of the same audio
+    fingerprint_max_offset: int = 2  # max shift in seconds between envelopes of the same audio
+
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
 
     CELERY_BROKER_URL: str = 'pyamqp://'
     CELERY_BACKEND_URL: str = 'redis://localhost'
+    REDIS_URL: str = 'redis://localhost'
+    single_flight_ttl: int = 3 * 3600  # seconds until the lock of a crashed ingestion expires
 
     max_video_duration: int = 3600
+    download_workers: int = 4  # concurrent range requests per download
+    download_chunk_size: int = 8 * 1024 * 1024
+    max_video_resolution: int = 1080  # highest downloaded video resolution, 0 to disable the cap
+    screenshot_proxy: bool = True  # create low resolution proxy used for keyframes, and for screenshots if the full video is removed
+    proxy_resolution: int = 480
+    proxy_keyframe_interval: float = 1.0  # seconds between keyframes in the proxy
+    keep_full_video: bool = True  # remove the downloaded video once the proxy is created if False
+    # ingestion stage name -> celery queue, e.g. {"download": "io", "transcribe": "gpu"}
+    ingestion_queues: dict[str, str] = {}
+    ingestion_stage_retries: int = 3
+    screenshot_format: str = 'png'  # png, jpeg or webp
+    screenshot_max_width: int = 0  # downscale wider screenshots, 0 to keep the original size
+    max_screenshots: int = 10  # max screenshots per batch request
+    frame_cache_max_size: int = 256 * 1024 ** 2  # bytes of frames kept in memory
+    frame_cache_disk_max_size: int = 1024 ** 3  # bytes of frames spilled to agent directories, 0 to disable
+    frame_cache_quantum: float = 0.5  # screenshot timestamps are rounded to this step in seconds
+    screenshot_use_llm: bool = False  # pick screenshot timestamp with LLM instead of local segment ranking
+    screenshot_llm_fallback: bool = False  # use LLM if no segments with timestamps were retrieved
+    keyframe_scene_threshold: float = 0.3  # scene change score to extract a keyframe, 0-1
+    keyframe_max_interval: float = 10.0  # extract a keyframe at least every N seconds
+    keyframe_max_distance: float = 1.0  # use stored keyframe if it is not older than N seconds
+    audio_first_ingestion: bool = False  # build agent from audio, download video in background
+    video_download_wait_timeout: int = 600  # seconds to wait for a video downloaded by another process
+    video_download_claim_ttl: int = 60  # seconds until the download claim of a crashed process expires
 
     # LANGFUSE_HOST: str = 'http://localhost:3000'
     # LANGFUSE_PUBLIC_KEY: str
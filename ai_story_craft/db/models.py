@@ -1,5 +1,5 @@
 from enum import Enum as PyEnum
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Enum, Boolean, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
@@ -11,6 +11,32 @@ class VideoType(str, PyEnum):
     file: str = 'file'
 
 
+class SubtitlesSource(str, PyEnum):
+    youtube_captions: str = 'youtube_captions'
+    whisper_api: str = 'whisper_api'
+    whisper_local: str = 'whisper_local'
+
+
+class DownloadStatus(str, PyEnum):
+    pending: str = 'pending'
+    downloading: str = 'downloading'
+    downloaded: str = 'downloaded'
+    failed: str = 'failed'
+
+
+class IngestionStage(str, PyEnum):
+    """Ingestion stages in the order they are executed"""
+    download: str = 'download'
+    audio_extract: str = 'audio_extract'
+    transcribe: str = 'transcribe'
+    index: str = 'index'
+    describe: str = 'describe'
+    keyframes: str = 'keyframes'
+
+
+INGESTION_STAGES = list(IngestionStage)
+
+
 class Chat(Base):
     __tablename__ = 'chats'
 
@@ -33,8 +59,17 @@ class Video(Base):
     video_path = Column(String, nullable=False)
     has_audio = Column(Boolean, default=True)
     audio_path = Column(String, nullable=True)
+    proxy_path = Column(String, nullable=True)
     url = Column(String, nullable=True)
     is_downloaded = Column(Boolean, default=False)
+    audio_status = Column(Enum(DownloadStatus, name='download_statuses'), default=DownloadStatus.pending)
+    video_status = Column(Enum(DownloadStatus, name='download_statuses'), default=DownloadStatus.pending)
+    subtitles_source = Column(Enum(SubtitlesSource, name='subtitles_sources'), nullable=True)
+    extracted_audio_path = Column(String, nullable=True)
+    audio_fingerprint = Column(String, nullable=True)
+    # last completed ingestion stage and duration of each stage in seconds
+    ingestion_stage = Column(Enum(IngestionStage, name='ingestion_stages'), nullable=True)
+    stage_durations = Column(JSON, default=dict)
 
 
 class Agent(Base):
@@ -1,7 +1,8 @@
 from db.base_crud import CRUD, engine
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
-from db.models import Chat, Agent, ActiveAgent, Message, Video, AgentAccess
+from db.models import Chat, Agent, ActiveAgent, Message, Video, AgentAccess, IngestionStage, INGESTION_STAGES
 
 
 def now():
@@ -26,6 +27,30 @@ class VideoCRUD(CRUD):
             instance = session.query(self.model).filter_by(hash_sum=hash_sum).first()
         return instance
 
+    def get_by_video_path(self, video_path: str) -> Video | None:
+        with self.scoped_session() as session:
+            instance = session.query(self.model).filter_by(video_path=video_path).first()
+        return instance
+
+    @staticmethod
+    def is_stage_completed(video: Video, stage: IngestionStage) -> bool:
+        if video.ingestion_stage is None:
+            return False
+        return INGESTION_STAGES.index(video.ingestion_stage) >= INGESTION_STAGES.index(stage)
+
+    def complete_stage(self, id, stage: IngestionStage, duration: float) -> Video | None:
+        with self.scoped_session() as session:
+            instance = session.query(self.model).filter_by(id=id).first()
+            if instance:
+                # JSON column changes are tracked only on reassignment
+                instance.stage_durations = {**(instance.stage_durations or {}), stage.value: duration}
+                if not self.is_stage_completed(instance, stage):
+                    instance.ingestion_stage = stage
+                session.commit()
+                session.refresh(instance)
+                return instance
+        return None
+
 
 class AgentCRUD(CRUD):
     def __init__(self):
@@ -41,6 +66,20 @@ class AgentCRUD(CRUD):
             instance = session.query(self.model).filter_by(name=name).first()
         return instance
 
+    def get_or_create(self, name: str, **kwargs) -> Agent:
+        """
+        Create agent or get the agent with the same name created concurrently
+        :param name: unique agent name
+        :param kwargs: other agent fields
+        :return:
+        """
+        try:
+            return self.create(name=name, **kwargs)
+        except IntegrityError:
+            # The failed flush leaves the scoped session unusable until it is rolled back
+            self.scoped_session.rollback()
+            return self.get_by_name(name)
+
 
 class ActiveAgentCRUD(CRUD):
     def __init__(self):
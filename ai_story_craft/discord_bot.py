@@ -1,7 +1,8 @@
+import asyncio
 from core.settings import settings
 import discord
 from discord import Message, Client, app_commands
-from typing import Union
+from typing import Union, Literal
 import openai
 import io
 from collections import deque, defaultdict
@@ -10,6 +11,7 @@ from agent_manager import AgentManager
 from rag.langchain_agent import LangChanAgent
 from celery_app import process_youtube_video, check_celery_worker
 from video_processing.youtube_video_processor import YoutubeVideoProcessor
+from integrations.screenshots import screenshot_error
 from integrations.messenger_sender import DiscordMessageSender
 
 intents = discord.Intents.default()
@@ -17,6 +19,9 @@ intents.message_content = True
 
 # bot = commands.Bot(command_prefix='$', intents=intents)
 
+# Max files of a discord message
+MAX_MESSAGE_FILES = 10
+
 # Conversation history dictionary
 conversation_history = defaultdict(lambda: deque(maxlen=10))
 openai.api_key = settings.OPENAI_API_KEY
@@ -47,7 +52,7 @@ async def on_message(message: Message):
 
     question = message.content
 
-    reply = agent.answer(question, conversation_history[message.channel.id])
+    reply = await agent.aanswer(question, conversation_history[message.channel.id])
     update_conversation_history(message.channel.id, question, reply)
 
     await message.channel.send(reply)
@@ -65,7 +70,8 @@ async def retrieve_active_agent(interaction: Union[discord.Interaction, discord.
         await interaction.followup.send("No video is currently selected. Please select a video first.")
         return
 
-    agent = AgentManager().get(active_agent.agent_id)
+    # Loading an agent reads its index from disk, keep the event loop free meanwhile
+    agent = await asyncio.to_thread(AgentManager().get, active_agent.agent_id)
     return agent
 
 
@@ -80,13 +86,57 @@ async def screenshot(interaction: discord.Interaction, description: str):
         await interaction.followup.send("Please provide Screenshot description")
         return
 
-    image_bytes, image_name, readable_timestamp = agent.get_image(description)
+    try:
+        image_bytes, image_name, readable_timestamp = await agent.aget_image(description)
+    except ValueError as e:
+        await interaction.followup.send(screenshot_error(e))
+        return
+
     await interaction.followup.send(
         f"Timestamp: {readable_timestamp}",
         file=discord.File(io.BytesIO(image_bytes), filename=image_name)
     )
 
 
+@tree.command(name='screenshots', description='Get several screenshots, separated by ";"')
+async def screenshots(
+        interaction: discord.Interaction,
+        descriptions: str,
+        image_format: Literal['png', 'jpeg', 'webp'] = None,
+        max_width: int = None
+):
+    await interaction.response.defer()  # noqa
+
+    agent = await retrieve_active_agent(interaction)
+    if agent is None:
+        return
+
+    requests = [request.strip() for request in descriptions.split(';') if request.strip()]
+    if not requests:
+        await interaction.followup.send("Please provide Screenshot descriptions separated by ';'")
+        return
+    if len(requests) > settings.max_screenshots:
+        await interaction.followup.send(f"Maximum {settings.max_screenshots} screenshots per request")
+        return
+
+    try:
+        images = await agent.aget_images(requests, image_format, max_width)
+    except ValueError as e:
+        await interaction.followup.send(screenshot_error(e))
+        return
+
+    # A message holds at most 10 files
+    for start in range(0, len(images), MAX_MESSAGE_FILES):
+        group = images[start:start + MAX_MESSAGE_FILES]
+        await interaction.followup.send(
+            "\n".join(f"{image_name}: {readable_timestamp}" for _, image_name, readable_timestamp in group),
+            files=[
+                discord.File(io.BytesIO(image_bytes), filename=image_name)
+                for image_bytes, image_name, _ in group
+            ]
+        )
+
+
 @tree.command(name='videos', description='List available videos')
 async def get_agents(interaction: discord.Interaction):
     await interaction.response.defer()  # noqa
@@ -135,6 +185,8 @@ async def activate_agent(interaction: discord.Interaction, agent_name: str):
     active_agent = ActiveAgentCRUD().activate_agent(chat.id, agent.id)
 
     if active_agent:
+        # Agents are loaded lazily, start loading while the user types the first question
+        AgentManager().prefetch(agent.agent_id)
         await interaction.followup.send(f"Video {agent_name} Selected.")
     else:
         await interaction.followup.send(f"Error activating video {agent_name}.")
@@ -148,9 +200,9 @@ async def story_map(interaction: discord.Interaction):
     if agent is None:
         return
 
-    story_map = agent.create_user_story_map()
+    story_map = await agent.acreate_user_story_map()
     update_conversation_history(interaction.channel_id, "User story map", story_map)
-    story_map_chunks = agent.apply_discord_formating(story_map)
+    story_map_chunks = await agent.aapply_discord_formating(story_map)
     for chunk in story_map_chunks:
         await interaction.followup.send(chunk)
 
@@ -194,6 +246,7 @@ async def help_command(interaction: discord.Interaction):
         "/story_map - Generate story map\n"
         "/add_video <youtube_url> - Add video\n"
         "/screenshot <description> - Get screenshot\n"
+        "/screenshots <description>; <timestamp>; ... - Get several screenshots\n"
         "/help - Get help"
     )
 
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+# (downloaded bytes, total bytes, throughput in bytes per second)
+ProgressCallback = Callable[[int, int, float], None]
+
+
+class RangeDownloader:
+    """
+    Downloads a file with several concurrent HTTP range requests.
+    Data is written into a .part file, finished ranges are recorded in a journal next to it,
+    so an interrupted download resumes from the journal. The .part file is renamed to the
+    output path only when all ranges are downloaded.
+    """
+
+    part_suffix: str = '.part'
+    journal_suffix: str = '.part.json'
+    read_size: int = 64 * 1024
+
+    def __init__(
+            self,
+            url: str,
+            output_path: Path,
+            size: int = None,
+            workers: int = 4,
+            chunk_size: int = 8 * 1024 * 1024,
+            retries: int = 3,
+            progress_callback: Optional[ProgressCallback] = None
+    ):
+        self.url = url
+        self.output_path = output_path
+        self.part_path = output_path.with_name(output_path.name + self.part_suffix)
+        self.journal_path = output_path.with_name(output_path.name + self.journal_suffix)
+        self.size = size
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.progress_callback = progress_callback
+
+        self.lock = threading.Lock()
+        self.completed: set = set()
+        self.downloaded = 0
+        self.session_downloaded = 0
+        self.started_at = None
+
+    def download(self) -> Path:
+        """
+        Download the file, resuming a previous attempt if its journal exists
+        :return: output path
+        :raises FileExistsError: if output file already exists
+        """
+        if self.output_path.exists():
+            raise FileExistsError(f"File already exists: {self.output_path}")
+
+        if self.size is None:
+            self.size = self._fetch_size()
+
+        ranges = self._ranges()
+        self._load_journal()
+        if not self.part_path.exists() or self.part_path.stat().st_size != self.size:
+            self.completed = set()
+            with open(self.part_path, 'wb') as f:
+                f.truncate(self.size)
+
+        self.downloaded = sum(end - start + 1 for i, (start, end) in enumerate(ranges) if i in self.completed)
+        self.started_at = time.monotonic()
+
+        pending = [(i, start, end) for i, (start, end) in enumerate(ranges) if i not in self.completed]
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self._download_range, *item) for item in pending]
+            for future in futures:
+                future.result()
+
+        os.replace(self.part_path, self.output_path)
+        self.journal_path.unlink(missing_ok=True)
+        return self.output_path
+
+    def _ranges(self) -> List[Tuple[int, int]]:
+        return [
+            (start, min(start + self.chunk_size, self.size) - 1)
+            for start in range(0, self.size, self.chunk_size)
+        ]
+
+    def _fetch_size(self) -> int:
+        request = urllib.request.Request(self.url, method='HEAD')
+        with urllib.request.urlopen(request) as response:
+            size = response.headers.get('Content-Length')
+        if size is None:
+            raise ValueError(f"Unable to get file size: {self.url}")
+        return int(size)
+
+    def _load_journal(self):
+        if not self.journal_path.exists():
+            return
+        with open(self.journal_path, 'r') as f:
+            journal = json.load(f)
+        # Journal of a different file or chunking can't be reused
+        if journal.get('size') == self.size and journal.get('chunk_size') == self.chunk_size:
+            self.completed = set(journal['completed'])
+
+    def _save_journal(self):
+        temp_path = self.journal_path.with_name(self.journal_path.name + '.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'url': self.url,
+                'size': self.size,
+                'chunk_size': self.chunk_size,
+                'completed': sorted(self.completed)
+            }, f)
+        os.replace(temp_path, self.journal_path)
+
+    def _download_range(self, index: int, start: int, end: int):
+        for attempt in range(self.retries + 1):
+            written = 0
+            try:
+                request = urllib.request.Request(self.url, headers={'Range': f'bytes={start}-{end}'})
+                with urllib.request.urlopen(request) as response, open(self.part_path, 'r+b') as f:
+                    if response.status != 206:
+                        raise ValueError(f"Server doesn't support range requests: {self.url}")
+                    f.seek(start)
+                    while True:
+                        data = response.read(self.read_size)
+                        if not data:
+                            break
+                        f.write(data)
+                        written += len(data)
+                        self._report(len(data))
+                if written != end - start + 1:
+                    raise IOError(f"Incomplete range {start}-{end}: got {written} bytes")
+                break
+            except Exception:
+                self._report(-written)
+                if attempt == self.retries:
+                    raise
+                time.sleep(2 ** attempt)
+
+        with self.lock:
+            self.completed.add(index)
+            self._save_journal()
+
+    def _report(self, size: int):
+        with self.lock:
+            self.downloaded += size
+            self.session_downloaded += size
+            downloaded = self.downloaded
+            elapsed = time.monotonic() - self.started_at
+            throughput = self.session_downloaded / elapsed if elapsed > 0 else 0.0
+        if self.progress_callback:
+            self.progress_callback(downloaded, self.size, throughput)
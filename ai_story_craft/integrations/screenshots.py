@@ -0,0 +1,10 @@
+"""Replies to screenshot requests shared by the bots."""
+from celery_app import download_video
+from video_processing.youtube_video_processor import VideoNotReadyError
+
+
+def screenshot_error(error: ValueError) -> str:
+    """Reply to a failed screenshot request, a video which is not downloaded yet is fetched in background"""
+    if isinstance(error, VideoNotReadyError):
+        download_video.delay(error.video_id)
+    return str(error)
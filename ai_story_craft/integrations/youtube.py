@@ -1,5 +1,13 @@
+import re
+import logging
 import pytubefix
 from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+from youtube_transcript_api import YouTubeTranscriptApi, CouldNotRetrieveTranscript
+from core.settings import settings
+from integrations.range_downloader import RangeDownloader, ProgressCallback
+
+logger = logging.getLogger(__name__)
 
 
 def parse_resolution(stream):
@@ -9,11 +17,55 @@ def parse_resolution(stream):
         return 0
 
 
-def download_video(video_url: Path, output_path: Path) -> bool:
+def download_stream(stream, output_path: Path, progress_callback: ProgressCallback = None) -> Path:
+    """
+    Download stream with concurrent range requests, resuming interrupted download if any
+    :param stream: pytubefix stream
+    :param output_path:
+    :param progress_callback: called with downloaded bytes, total bytes and throughput in bytes per second
+    :return:
+    """
+    return RangeDownloader(
+        url=stream.url,
+        output_path=output_path,
+        size=stream.filesize,
+        workers=settings.download_workers,
+        chunk_size=settings.download_chunk_size,
+        progress_callback=progress_callback
+    ).download()
+
+
+def select_video_stream(video_streams, max_resolution: int = 0):
+    """
+    Select the stream with the highest resolution not exceeding max_resolution.
+    If all streams exceed it, the stream with the lowest resolution is selected
+    :param video_streams:
+    :param max_resolution: resolution cap, 0 to disable
+    :return:
+    """
+    video_streams = sorted(video_streams, key=parse_resolution, reverse=True)
+
+    if len(video_streams) == 0:
+        raise ValueError("No video streams found")
+
+    if max_resolution:
+        capped_streams = [stream for stream in video_streams if parse_resolution(stream) <= max_resolution]
+        return capped_streams[0] if capped_streams else video_streams[-1]
+    return video_streams[0]
+
+
+def download_video(
+        video_url: Path,
+        output_path: Path,
+        max_resolution: int = 0,
+        progress_callback: ProgressCallback = None
+) -> bool:
     """
 
     :param video_url:
     :param output_path: Path to save video
+    :param max_resolution: highest resolution to download, 0 to download the highest available
+    :param progress_callback: download progress callback
     :return: True if audio stream is included in the video stream, False otherwise
     """
     if output_path.exists():
@@ -21,22 +73,18 @@ def download_video(video_url: Path, output_path: Path) -> bool:
     yt = pytubefix.YouTube(str(video_url))
 
     video_streams = yt.streams.filter(only_video=True, mime_type="video/mp4")
-    video_streams = sorted(video_streams, key=parse_resolution, reverse=True)
-
-    if len(video_streams) == 0:
-        raise ValueError("No video streams found")
-
-    highest_resolution_stream = video_streams[0]
-    highest_resolution_stream.download(output_path.parent, filename=output_path.name)
+    stream = select_video_stream(video_streams, max_resolution)
+    download_stream(stream, output_path, progress_callback)
 
     # Sometimes the audio stream is not included in the video stream, needed to be downloaded separately
-    return bool(highest_resolution_stream.audio_codec)
+    return bool(stream.audio_codec)
 
-def download_audio(audio_url: Path, output_path: Path):
+def download_audio(audio_url: Path, output_path: Path, progress_callback: ProgressCallback = None):
     """
 
     :param audio_url:
     :param output_path: Path to save audio
+    :param progress_callback: download progress callback
     :return:
     """
     if output_path.exists():
@@ -48,4 +96,104 @@ def download_audio(audio_url: Path, output_path: Path):
     if len(audio_streams) == 0:
         raise ValueError("No audio streams found")
 
-    audio_streams[0].download(output_path.parent, filename=output_path.name)
\ No newline at end of file
+    # Prefer AAC in mp4 container, it can be sent to transcription as is, without re-encoding
+    audio_streams = sorted(audio_streams, key=lambda stream: stream.mime_type != "audio/mp4")
+    download_stream(audio_streams[0], output_path, progress_callback)
+
+
+VIDEO_ID_RE = re.compile(r'^[A-Za-z0-9_-]{11}$')
+YOUTUBE_HOSTS = {'youtube.com', 'm.youtube.com', 'music.youtube.com', 'youtube-nocookie.com'}
+# path prefixes which are followed by the video id, e.g. youtube.com/shorts/<id>
+VIDEO_ID_PATH_PREFIXES = ('embed', 'shorts', 'live', 'v', 'e')
+
+
+def get_video_id(video_url: str) -> str:
+    """
+    Extract YouTube video id from the url.
+    Supports watch, youtu.be, mobile, music, embed, shorts and live urls
+    :param video_url:
+    :return:
+    :raises ValueError: if url doesn't contain video id
+    """
+    parsed_url = urlparse(video_url.strip() if '://' in video_url else f'https://{video_url.strip()}')
+    host = (parsed_url.hostname or '').lower().removeprefix('www.')
+    path = [part for part in parsed_url.path.split('/') if part]
+
+    video_id = None
+    if host == 'youtu.be' and path:
+        video_id = path[0]
+    elif host in YOUTUBE_HOSTS:
+        if len(path) >= 2 and path[0] in VIDEO_ID_PATH_PREFIXES:
+            video_id = path[1]
+        else:
+            video_id = parse_qs(parsed_url.query).get('v', [None])[0]
+
+    if not video_id or not VIDEO_ID_RE.match(video_id):
+        raise ValueError("Invalid YouTube URL: missing video ID")
+    return video_id
+
+
+def canonical_url(video_url: str) -> str:
+    """
+    Normalize YouTube url, all urls of the same video give the same result
+    :param video_url:
+    :return:
+    :raises ValueError: if url doesn't contain video id
+    """
+    return f"https://www.youtube.com/watch?v={get_video_id(video_url)}"
+
+
+def select_transcript(transcripts: list, languages: list[str] = None, allow_generated: bool = True):
+    """
+    Choose the caption track, manually created captions are preferred over generated ones of the same language.
+    Without configured languages the spoken language is taken from the generated track,
+    manual tracks in other languages are usually translations and are skipped
+    :param transcripts: youtube_transcript_api transcripts
+    :param languages: preferred language codes in order
+    :param allow_generated: use automatically generated captions if there are no manual ones
+    :return: transcript or None
+    """
+    manual = {transcript.language_code: transcript for transcript in transcripts if not transcript.is_generated}
+    generated = {transcript.language_code: transcript for transcript in transcripts if transcript.is_generated}
+
+    if not languages:
+        if not generated:
+            # Spoken language is unknown, any manual track is the best guess
+            return next(iter(manual.values()), None)
+        languages = list(generated)
+
+    for language in languages:
+        if language in manual:
+            return manual[language]
+        if allow_generated and language in generated:
+            return generated[language]
+    return None
+
+
+def fetch_captions(video_url: str, allow_generated: bool = True, languages: list[str] = None) -> dict | None:
+    """
+    Fetch existing YouTube captions in the spoken or in a preferred language
+    :param video_url:
+    :param allow_generated: use automatically generated captions if there are no manual ones
+    :param languages: preferred language codes in order, None to use the spoken language
+    :return: dict with caption entries (text, start, duration), language and is_generated flag,
+        None if captions are not available or can't be fetched, whisper is used then
+    """
+    try:
+        transcripts = list(YouTubeTranscriptApi.list_transcripts(get_video_id(video_url)))
+        transcript = select_transcript(transcripts, languages, allow_generated)
+        if transcript is None:
+            return None
+        entries = transcript.fetch()
+    except CouldNotRetrieveTranscript:
+        return None
+    except Exception:
+        # Network and parsing errors of the unofficial API, captions are only a shortcut
+        logger.warning("Failed to fetch captions of %s", video_url, exc_info=True)
+        return None
+
+    return {
+        'language': transcript.language_code,
+        'is_generated': transcript.is_generated,
+        'entries': entries,
+    }
@@ -0,0 +1,200 @@
+import re
+import json
+import logging
+import base64
+import time
+import hashlib
+import numpy as np
+import redis
+from typing import List, Optional
+from core.settings import settings
+from utils.singleton import Singleton
+
+
+logger = logging.getLogger(__name__)
+
+WORD_RE = re.compile(r"[a-z0-9']+")
+# Follow-ups which only make sense after the previous answer
+FOLLOW_UP_RE = re.compile(
+    r"^\s*(and|but|so|then|what about|how about)\b"
+    r"|\b(tell me more|more details|what else|you (said|mentioned)|as (before|above)|the previous|the last one)\b",
+    re.IGNORECASE
+)
+# Pronouns standing for something mentioned earlier
+PRONOUNS = {'it', 'its', 'they', 'them', 'their', 'he', 'she', 'him', 'her', 'one', 'ones'}
+DEMONSTRATIVES = {'this', 'that', 'these', 'those'}
+# Words which carry no topic of their own
+FUNCTION_WORDS = PRONOUNS | DEMONSTRATIVES | {
+    'a', 'an', 'the', 'is', 'are', 'was', 'were', 'be', 'been', 'do', 'does', 'did', 'can', 'could', 'should',
+    'would', 'will', 'what', "what's", 'how', 'why', 'when', 'where', 'who', 'which', 'much', 'many', 'of', 'to',
+    'in', 'on', 'for', 'with', 'about', 'and', 'or', 'i', 'you', 'me', 'we', 'there', 'not', 'so', 'then',
+    'mean', 'means', 'work', 'works', 'cost', 'costs', 'have', 'has', 'include', 'includes', 'look', 'like',
+    'again', 'more', 'else', 'also', 'same', 'please', 'tell', 'explain',
+}
+
+
+def is_history_dependent(question: str, message_history=None) -> bool:
+    """
+    Question refers to the conversation, the cached answer of a similar question may not fit it.
+    Demonstratives count only when they stand for a noun, "what does this do" depends on the history,
+    "what does this product do" does not
+    :param question:
+    :param message_history:
+    :return:
+    """
+    if not message_history:
+        return False
+    if FOLLOW_UP_RE.search(question):
+        return True
+
+    words = WORD_RE.findall(question.lower())
+    if not any(word not in FUNCTION_WORDS for word in words):
+        return True
+    for i, word in enumerate(words):
+        if word in PRONOUNS:
+            return True
+        if word in DEMONSTRATIVES:
+            previous_word = words[i - 1] if i > 0 else None
+            next_word = words[i + 1] if i + 1 < len(words) else None
+            if (previous_word is None or previous_word in FUNCTION_WORDS) and (
+                    next_word is None or next_word in FUNCTION_WORDS
+            ):
+                return True
+    return False
+
+
+class AnswerCache(metaclass=Singleton):
+    """
+    Redis backed semantic answer cache shared by all bot replicas.
+    Answers are stored per agent namespace with the question embedding, a question gets the cached answer
+    of the most similar cached question if the cosine similarity reaches the threshold.
+    Entries expire after ttl, least recently used entries are evicted above max_entries per namespace.
+    """
+
+    def __init__(
+            self,
+            client: redis.Redis = None,
+            prefix: str = 'answer_cache',
+            similarity_threshold: float = None,
+            ttl: int = None,
+            max_entries: int = None
+    ):
+        # Short timeouts, an unreachable Redis must not delay answers
+        self.client = client or redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.answer_cache_timeout,
+            socket_connect_timeout=settings.answer_cache_timeout
+        )
+        self.prefix = prefix
+        self.similarity_threshold = similarity_threshold or settings.answer_cache_similarity
+        self.ttl = ttl or settings.answer_cache_ttl
+        self.max_entries = max_entries or settings.answer_cache_max_entries
+        self.stats_key = f"{prefix}:stats"
+
+    def _lru_key(self, namespace: str) -> str:
+        return f"{self.prefix}:{namespace}:lru"
+
+    def _entry_key(self, namespace: str, entry_id: str) -> str:
+        return f"{self.prefix}:{namespace}:{entry_id}"
+
+    def count(self, agent_name: str, event: str):
+        """Count cache event, one of hits, misses or bypassed"""
+        try:
+            self.client.hincrby(self.stats_key, f"{agent_name}:{event}", 1)
+        except redis.RedisError as e:
+            logger.warning(f"Answer cache statistics are not updated: {e}")
+
+    def get(self, namespace: str, agent_name: str, vector: List[float]) -> Optional[str]:
+        """
+        Get answer of the most similar cached question, Redis errors are treated as a miss
+        :param namespace: agent cache namespace
+        :param agent_name: agent name for the statistics
+        :param vector: question embedding
+        :return: cached answer or None
+        """
+        try:
+            return self._get(namespace, agent_name, vector)
+        except redis.RedisError as e:
+            logger.warning(f"Answer cache lookup failed: {e}")
+            return None
+
+    def _get(self, namespace: str, agent_name: str, vector: List[float]) -> Optional[str]:
+        entry_ids = [entry_id.decode() for entry_id in self.client.zrange(self._lru_key(namespace), 0, -1)]
+        values = self.client.mget([self._entry_key(namespace, entry_id) for entry_id in entry_ids]) if entry_ids else []
+
+        expired = [entry_id for entry_id, value in zip(entry_ids, values) if value is None]
+        if expired:
+            self.client.zrem(self._lru_key(namespace), *expired)
+
+        entries = [(entry_id, json.loads(value)) for entry_id, value in zip(entry_ids, values) if value is not None]
+        if not entries:
+            self.count(agent_name, 'misses')
+            return None
+
+        query = np.asarray(vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        vectors = np.stack([
+            np.frombuffer(base64.b64decode(entry['vector']), dtype=np.float16) for _, entry in entries
+        ]).astype(np.float32)
+        similarities = vectors @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            self.count(agent_name, 'misses')
+            return None
+
+        entry_id, entry = entries[best]
+        self.client.zadd(self._lru_key(namespace), {entry_id: time.time()})
+        self.count(agent_name, 'hits')
+        return entry['answer']
+
+    def put(self, namespace: str, question: str, vector: List[float], answer: str):
+        """
+        Cache answer, Redis errors are logged and ignored
+        :param namespace: agent cache namespace
+        :param question:
+        :param vector: question embedding
+        :param answer:
+        :return:
+        """
+        try:
+            self._put(namespace, question, vector, answer)
+        except redis.RedisError as e:
+            logger.warning(f"Answer is not cached: {e}")
+
+    def _put(self, namespace: str, question: str, vector: List[float], answer: str):
+        vector = np.asarray(vector, dtype=np.float32)
+        vector /= np.linalg.norm(vector) or 1
+        entry_id = hashlib.sha256(question.encode('utf-8')).hexdigest()[:16]
+        # float16 keeps lookups cheap, all entries of the namespace are fetched on every lookup
+        entry = {
+            'question': question,
+            'answer': answer,
+            'vector': base64.b64encode(vector.astype(np.float16).tobytes()).decode()
+        }
+
+        pipeline = self.client.pipeline()
+        pipeline.set(self._entry_key(namespace, entry_id), json.dumps(entry), ex=self.ttl)
+        pipeline.zadd(self._lru_key(namespace), {entry_id: time.time()})
+        pipeline.expire(self._lru_key(namespace), self.ttl)
+        pipeline.zcard(self._lru_key(namespace))
+        size = pipeline.execute()[-1]
+
+        if size > self.max_entries:
+            popped = self.client.zpopmin(self._lru_key(namespace), size - self.max_entries)
+            evicted = [entry_id.decode() for entry_id, _ in popped]
+            if evicted:
+                self.client.delete(*[self._entry_key(namespace, entry_id) for entry_id in evicted])
+
+    def stats(self, agent_name: str) -> dict:
+        """Hits, misses, bypassed questions and hit rate of an agent, empty if Redis is unavailable"""
+        try:
+            counters = {
+                event: int(self.client.hget(self.stats_key, f"{agent_name}:{event}") or 0)
+                for event in ('hits', 'misses', 'bypassed')
+            }
+        except redis.RedisError as e:
+            logger.warning(f"Answer cache statistics are not available: {e}")
+            return {}
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = counters['hits'] / lookups if lookups else 0.0
+        return counters
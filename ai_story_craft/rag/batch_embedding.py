@@ -0,0 +1,142 @@
+import time
+import logging
+import threading
+from collections import deque
+from typing import List, Callable
+from concurrent.futures import ThreadPoolExecutor
+from openai import RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from langchain_core.embeddings import Embeddings
+from core.settings import settings
+from rag.chunking import token_counter
+
+
+logger = logging.getLogger(__name__)
+
+# The client does not retry on its own, transient errors are retried here with backoff
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+
+class RateLimiter:
+    """Sliding one minute window limiting both requests and tokens per minute."""
+
+    window: float = 60.0
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.condition = threading.Condition()
+        self.history = deque()  # (time, tokens)
+        self.tokens = 0
+
+    def _expire(self, now: float):
+        while self.history and self.history[0][0] <= now - self.window:
+            _, tokens = self.history.popleft()
+            self.tokens -= tokens
+
+    def acquire(self, tokens: int):
+        """
+        Block until a request of the given size fits into the budget
+        :param tokens: request size, a request larger than the whole budget waits for an empty window
+        :return:
+        """
+        with self.condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                fits_requests = len(self.history) < self.requests_per_minute
+                fits_tokens = not self.history or self.tokens + tokens <= self.tokens_per_minute
+                if fits_requests and fits_tokens:
+                    self.history.append((now, tokens))
+                    self.tokens += tokens
+                    return
+                self.condition.wait(self.history[0][0] + self.window - now)
+
+
+def token_batches(
+        texts: List[str],
+        max_tokens: int,
+        max_size: int,
+        count_tokens: Callable[[str], int]
+) -> List[List[int]]:
+    """
+    Pack consecutive texts into batches of up to max_tokens tokens and max_size texts
+    :param texts:
+    :param max_tokens: token budget of a batch, a longer text makes a batch on its own
+    :param max_size: max texts per batch
+    :param count_tokens:
+    :return: batches of text indexes
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if batch and (batch_tokens + tokens > max_tokens or len(batch) >= max_size):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class BatchedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper sending token-budgeted batches concurrently under a requests and tokens per minute budget.
+    Rate limited requests, timeouts, connection and server errors are retried with exponential backoff.
+    The limiter is shared by all threads of the process, as the budget is per API key.
+    """
+
+    _limiter: RateLimiter = None
+    _limiter_lock = threading.Lock()
+
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            batch_tokens: int = None,
+            batch_size: int = None,
+            max_workers: int = None,
+            max_retries: int = None
+    ):
+        self.embeddings = embeddings
+        self.batch_tokens = batch_tokens or settings.embedding_batch_tokens
+        self.batch_size = batch_size or settings.embedding_batch_size
+        self.max_workers = max_workers or settings.embedding_max_workers
+        self.max_retries = settings.embedding_max_retries if max_retries is None else max_retries
+        self.count_tokens = token_counter()
+
+    @classmethod
+    def limiter(cls) -> RateLimiter:
+        with cls._limiter_lock:
+            if cls._limiter is None:
+                cls._limiter = RateLimiter(settings.embedding_requests_per_minute, settings.embedding_tokens_per_minute)
+            return cls._limiter
+
+    def _call(self, func: Callable, argument, tokens: int):
+        for attempt in range(self.max_retries + 1):
+            self.limiter().acquire(tokens)
+            try:
+                return func(argument)
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = settings.embedding_retry_backoff * 2 ** attempt
+                logger.warning(f"Embedding request failed: {e.__class__.__name__}, retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = token_batches(texts, self.batch_tokens, self.batch_size, self.count_tokens)
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(batches))) as executor:
+            results = executor.map(
+                lambda batch: self._call(
+                    self.embeddings.embed_documents,
+                    [texts[i] for i in batch],
+                    sum(self.count_tokens(texts[i]) for i in batch)
+                ),
+                batches
+            )
+            return [vector for batch_vectors in results for vector in batch_vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(self.embeddings.embed_query, text, self.count_tokens(text))
@@ -0,0 +1,83 @@
+import re
+import json
+import math
+from collections import Counter
+from pathlib import Path
+from typing import List, Tuple, Dict
+from langchain_core.documents.base import Document
+
+
+TOKEN_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+class BM25Index:
+    """
+    In-memory inverted index with Okapi BM25 ranking.
+    Built from the indexed chunks, so lexical search returns the same documents as the vector store.
+    """
+
+    file_name: str = 'bm25.json'
+    k1: float = 1.5
+    b: float = 0.75
+
+    def __init__(self, documents: List[Document], postings: Dict[str, Dict[int, int]] = None):
+        """
+        :param documents:
+        :param postings: term -> {document index: term frequency}, built from documents if not provided
+        """
+        self.documents = documents
+        self.lengths = [len(tokenize(document.page_content)) for document in documents]
+        self.average_length = sum(self.lengths) / len(self.lengths) if self.lengths else 0.0
+        if postings is None:
+            postings = {}
+            for i, document in enumerate(documents):
+                for term, frequency in Counter(tokenize(document.page_content)).items():
+                    postings.setdefault(term, {})[i] = frequency
+        self.postings = postings
+
+    def idf(self, term: str) -> float:
+        frequency = len(self.postings.get(term, {}))
+        return math.log(1 + (len(self.documents) - frequency + 0.5) / (frequency + 0.5))
+
+    def search(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
+        """
+        :param query:
+        :param k:
+        :return: documents containing query terms with BM25 scores, best first
+        """
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf(term)
+            for i, frequency in self.postings.get(term, {}).items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / self.average_length)
+                scores[i] = scores.get(i, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [(self.documents[i], score) for i, score in best]
+
+    def save(self, path: Path):
+        temp_path = path.with_name(f"{path.name}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump({
+                'documents': [
+                    {'id': document.id, 'page_content': document.page_content, 'metadata': document.metadata}
+                    for document in self.documents
+                ],
+                'postings': self.postings
+            }, f)
+        temp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> 'BM25Index':
+        with open(path, 'r') as f:
+            data = json.load(f)
+        documents = [Document(**document) for document in data['documents']]
+        # json keys are strings
+        postings = {
+            term: {int(i): frequency for i, frequency in documents_frequencies.items()}
+            for term, documents_frequencies in data['postings'].items()
+        }
+        return cls(documents, postings)
@@ -0,0 +1,84 @@
+import json
+import hashlib
+from typing import List, Callable
+import tiktoken
+from langchain_core.documents.base import Document
+
+
+def token_counter(encoding_name: str = 'cl100k_base') -> Callable[[str], int]:
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda text: len(encoding.encode(text))
+
+
+def chunk_id(text: str, metadata: dict) -> str:
+    """Content hash of a chunk, chunks with the same text and timestamps get the same id"""
+    content = json.dumps({'text': text, 'metadata': metadata}, sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def segment_offsets(segments: List[dict]) -> str:
+    """
+    Timestamps of the segments joined into a chunk and their positions in the chunk text.
+    Serialized to json, vector store metadata values must be scalars
+    :param segments: consecutive whisper segments
+    :return: json list of [id, start, end, text offset]
+    """
+    offsets, offset = [], 0
+    for segment in segments:
+        offsets.append([segment['id'], round(float(segment['start']), 2), round(float(segment['end']), 2), offset])
+        offset += len(segment['text'].strip()) + 1
+    return json.dumps(offsets)
+
+
+def chunk_segments(
+        segments: List[dict],
+        max_tokens: int,
+        overlap_tokens: int,
+        count_tokens: Callable[[str], int] = None
+) -> List[Document]:
+    """
+    Group consecutive whisper segments into token-budgeted chunks.
+    The chunk text is the plain subtitles text, segment timestamps and ids are stored in the metadata.
+    Consecutive chunks share trailing segments of up to overlap_tokens tokens.
+    A segment longer than max_tokens makes a chunk on its own.
+    :param segments: whisper segments with id, start, end and text
+    :param max_tokens: max tokens per chunk
+    :param overlap_tokens: max tokens repeated from the previous chunk
+    :param count_tokens: token counting function, cl100k_base encoding is used by default
+    :return: documents with content hash ids and start, end, first_segment_id, last_segment_id
+        and segments (see segment_offsets) metadata
+    """
+    count_tokens = count_tokens or token_counter()
+    segments = [segment for segment in segments if segment['text'].strip()]
+    sizes = [count_tokens(segment['text']) for segment in segments]
+
+    docs = []
+    start = 0
+    while start < len(segments):
+        end = start
+        tokens = 0
+        while end < len(segments) and (end == start or tokens + sizes[end] <= max_tokens):
+            tokens += sizes[end]
+            end += 1
+
+        window = segments[start:end]
+        text = ' '.join(segment['text'].strip() for segment in window)
+        metadata = {
+            'start': round(float(window[0]['start']), 2),
+            'end': round(float(window[-1]['end']), 2),
+            'first_segment_id': window[0]['id'],
+            'last_segment_id': window[-1]['id'],
+            'segments': segment_offsets(window),
+        }
+        docs.append(Document(id=chunk_id(text, metadata), page_content=text, metadata=metadata))
+        if end == len(segments):
+            break
+
+        # Step back over trailing segments to overlap with the next chunk, always moving forward
+        next_start = end
+        overlap = 0
+        while next_start - 1 > start and overlap + sizes[next_start - 1] <= overlap_tokens:
+            next_start -= 1
+            overlap += sizes[next_start]
+        start = next_start
+    return docs
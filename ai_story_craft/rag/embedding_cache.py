@@ -0,0 +1,204 @@
+import time
+from abc import ABC, abstractmethod
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+import redis
+from pathlib import Path
+from typing import List, Dict
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+from core.settings import settings
+from rag.batch_embedding import BatchedEmbeddings
+from utils.singleton import AbstractSingleton
+
+
+class EmbeddingStore(ABC):
+    """Key-value store of embedding vectors with LRU eviction by number of entries."""
+
+    @abstractmethod
+    def mget(self, keys: List[str]) -> List[bytes | None]:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def mset(self, items: Dict[str, bytes]):
+        raise NotImplementedError()
+
+    @abstractmethod
+    def stats(self) -> dict:
+        raise NotImplementedError()
+
+
+class DiskEmbeddingStore(EmbeddingStore, metaclass=AbstractSingleton):
+    """SQLite backed store, shared by all processes on the host."""
+
+    def __init__(self, path: Path = None, max_entries: int = None):
+        self.path = Path(path or settings.embedding_cache_path or Path(settings.working_directory) / 'embeddings.db')
+        self.max_entries = max_entries or settings.embedding_cache_max_entries
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30)
+        with self.lock, self.connection:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB, accessed REAL)'
+            )
+            self.connection.execute('CREATE INDEX IF NOT EXISTS embeddings_accessed ON embeddings (accessed)')
+
+    def mget(self, keys: List[str]) -> List[bytes | None]:
+        if not keys:
+            return []
+        placeholders = ','.join('?' * len(keys))
+        with self.lock, self.connection:
+            rows = dict(self.connection.execute(
+                f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})', keys
+            ).fetchall())
+            self.connection.execute(
+                f'UPDATE embeddings SET accessed = ? WHERE key IN ({placeholders})', [time.time(), *keys]
+            )
+        return [rows.get(key) for key in keys]
+
+    def mset(self, items: Dict[str, bytes]):
+        now = time.time()
+        with self.lock, self.connection:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO embeddings (key, vector, accessed) VALUES (?, ?, ?)',
+                [(key, value, now) for key, value in items.items()]
+            )
+            count = self.connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            if count > self.max_entries:
+                self.connection.execute(
+                    'DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY accessed LIMIT ?)',
+                    (count - self.max_entries,)
+                )
+
+    def stats(self) -> dict:
+        with self.lock:
+            count = self.connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+        return {'entries': count, 'max_entries': self.max_entries}
+
+
+class RedisEmbeddingStore(EmbeddingStore, metaclass=AbstractSingleton):
+    """Redis backed store, shared by all processes and hosts."""
+
+    def __init__(self, client: redis.Redis = None, prefix: str = 'embeddings', max_entries: int = None):
+        self.client = client or redis.Redis.from_url(settings.REDIS_URL)
+        self.prefix = prefix
+        self.max_entries = max_entries or settings.embedding_cache_max_entries
+        self.lru_key = f'{prefix}:lru'
+
+    def _key(self, key: str) -> str:
+        return f'{self.prefix}:{key}'
+
+    def mget(self, keys: List[str]) -> List[bytes | None]:
+        if not keys:
+            return []
+        values = self.client.mget([self._key(key) for key in keys])
+        found = {key: time.time() for key, value in zip(keys, values) if value is not None}
+        if found:
+            self.client.zadd(self.lru_key, found)
+        return values
+
+    def mset(self, items: Dict[str, bytes]):
+        if not items:
+            return
+        pipeline = self.client.pipeline()
+        pipeline.mset({self._key(key): value for key, value in items.items()})
+        pipeline.zadd(self.lru_key, {key: time.time() for key in items})
+        pipeline.zcard(self.lru_key)
+        count = pipeline.execute()[-1]
+
+        if count > self.max_entries:
+            evicted = [key.decode() for key, _ in self.client.zpopmin(self.lru_key, count - self.max_entries)]
+            if evicted:
+                self.client.delete(*[self._key(key) for key in evicted])
+
+    def stats(self) -> dict:
+        return {'entries': self.client.zcard(self.lru_key), 'max_entries': self.max_entries}
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper caching vectors by content hash.
+    Keys are namespaced by the model name, so vectors of different models never mix.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, store: EmbeddingStore):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+        self.lock = threading.Lock()
+        self.counters = {'document_hits': 0, 'document_misses': 0, 'query_hits': 0, 'query_misses': 0}
+
+    def _key(self, text: str) -> str:
+        return f"{self.model_name}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _count(self, kind: str, hits: int, misses: int):
+        with self.lock:
+            self.counters[f'{kind}_hits'] += hits
+            self.counters[f'{kind}_misses'] += misses
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self.store.mget(keys)
+
+        missing = [i for i, value in enumerate(cached) if value is None]
+        self._count('document', len(texts) - len(missing), len(missing))
+
+        vectors = [np.frombuffer(value, dtype=np.float32).tolist() if value is not None else None for value in cached]
+        if missing:
+            # Same text may appear several times in one batch, embed it once
+            unique_texts = list(dict.fromkeys(texts[i] for i in missing))
+            embedded = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            for i in missing:
+                vectors[i] = embedded[texts[i]]
+            self.store.mset({
+                self._key(text): np.asarray(vector, dtype=np.float32).tobytes() for text, vector in embedded.items()
+            })
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        value = self.store.mget([key])[0]
+        if value is not None:
+            self._count('query', 1, 0)
+            return np.frombuffer(value, dtype=np.float32).tolist()
+
+        self._count('query', 0, 1)
+        vector = self.embeddings.embed_query(text)
+        self.store.mset({key: np.asarray(vector, dtype=np.float32).tobytes()})
+        return vector
+
+    def stats(self) -> dict:
+        with self.lock:
+            counters = dict(self.counters)
+        for kind in ('document', 'query'):
+            total = counters[f'{kind}_hits'] + counters[f'{kind}_misses']
+            counters[f'{kind}_hit_rate'] = counters[f'{kind}_hits'] / total if total else 0.0
+        return {**counters, **self.store.stats()}
+
+
+_embeddings = None
+
+
+def get_embeddings() -> Embeddings:
+    """
+    Embeddings used by all agents of the process, cached according to settings.embedding_cache
+    :return:
+    """
+    global _embeddings
+    if _embeddings is None:
+        # Rate limits and transient errors are retried by BatchedEmbeddings, the client must not retry on its own
+        embeddings = BatchedEmbeddings(OpenAIEmbeddings(
+            model=settings.embedding_model,
+            openai_api_key=settings.OPENAI_API_KEY,
+            openai_api_base=settings.embedding_api_base,
+            max_retries=0
+        ))
+        if settings.embedding_cache == 'redis':
+            _embeddings = CachedEmbeddings(embeddings, settings.embedding_model, RedisEmbeddingStore())
+        elif settings.embedding_cache == 'disk':
+            _embeddings = CachedEmbeddings(embeddings, settings.embedding_model, DiskEmbeddingStore())
+        else:
+            _embeddings = embeddings
+    return _embeddings
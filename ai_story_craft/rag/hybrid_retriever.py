@@ -0,0 +1,61 @@
+from typing import List, Tuple, Dict, Optional
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents.base import Document
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStore
+from rag.bm25 import BM25Index
+
+
+RETRIEVAL_MODES = ('vector', 'hybrid', 'lexical')
+
+
+def _normalize_scores(results: List[Tuple[Document, float]]) -> Dict[tuple, Tuple[Document, float]]:
+    """Min-max normalize scores to [0, 1], keyed by chunk content and start"""
+    if not results:
+        return {}
+    scores = [score for _, score in results]
+    low, high = min(scores), max(scores)
+    return {
+        (document.page_content, document.metadata.get('start')): (document, (score - low) / (high - low) if high > low else 1.0)
+        for document, score in results
+    }
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Retriever fusing BM25 and vector similarity scores.
+    In lexical mode only the local BM25 index is used and retrieval makes no network calls.
+    """
+
+    vector_store: Optional[VectorStore] = None
+    bm25: Optional[BM25Index] = None
+    mode: str = 'hybrid'
+    k: int = 4
+    lexical_weight: float = 0.5
+    # Candidates taken from each index before fusion
+    fetch_k: int = 20
+
+    def _get_relevant_documents(
+            self,
+            query: str,
+            *,
+            run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.mode == 'lexical' or self.vector_store is None:
+            return [document for document, _ in self.bm25.search(query, self.k)]
+        if self.mode == 'vector' or self.bm25 is None:
+            return self.vector_store.similarity_search(query, k=self.k)
+
+        lexical = _normalize_scores(self.bm25.search(query, self.fetch_k))
+        semantic = _normalize_scores(self.vector_store.similarity_search_with_relevance_scores(query, k=self.fetch_k))
+
+        fused = {}
+        for key in lexical.keys() | semantic.keys():
+            document = (semantic.get(key) or lexical.get(key))[0]
+            score = (
+                    self.lexical_weight * lexical.get(key, (None, 0.0))[1]
+                    + (1 - self.lexical_weight) * semantic.get(key, (None, 0.0))[1]
+            )
+            fused[key] = (document, score)
+        best = sorted(fused.values(), key=lambda item: item[1], reverse=True)[:self.k]
+        return [document for document, _ in best]
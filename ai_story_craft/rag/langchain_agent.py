@@ -1,29 +1,48 @@
+import os
+import re
+import asyncio
 import json
-import ffmpeg
+import hashlib
+import uuid
 import shutil
+import weakref
 from typing import Tuple, List
 from pathlib import Path
 from langchain_chroma import Chroma
 from langchain.vectorstores import VectorStore
-from langchain_openai import OpenAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import ChatOpenAI
 from langchain_core.runnables import RunnablePassthrough
 from langchain_core.prompts.chat import ChatPromptTemplate, HumanMessagePromptTemplate, PromptTemplate
 from langchain_core.documents.base import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_core.output_parsers import StrOutputParser, JsonOutputParser
 from core.settings import settings
 from rag.agents import ProductManager, Formatter
+from rag.chunking import chunk_segments
+from rag.embedding_cache import get_embeddings
+from rag.bm25 import BM25Index
+from rag.answer_cache import AnswerCache, is_history_dependent
+from rag.hybrid_retriever import HybridRetriever, RETRIEVAL_MODES
+from rag.numpy_store import NumpyVectorStore
+from rag.segments import segments_from_documents, rank_segments, slugify, parse_timestamp
+from video_processing.youtube_video_processor import YoutubeVideoProcessor
+from video_processing.keyframes import KeyframeIndex
+from video_processing.frames import extract_frames, aextract_frames, image_extension
+from utils.frame_cache import FrameCache
 from langfuse.openai import openai
 
 
 openai.api_key = settings.OPENAI_API_KEY
 
+NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
 
 class LangChanAgent:
     metadata_path: str = "description.txt"
     vectorstore_path: str = "vectorstore"
+    index_config_path: str = "index_config.json"
     subtitle_raw_text_path: str = 'subtitles.txt'
+    keyframes_path: str = 'keyframes'
+    frame_cache_path: str = 'frame_cache'
     screenshot_extension: str = "png"
 
     def __init__(
@@ -32,12 +51,15 @@ class LangChanAgent:
             vector_store: VectorStore,
             video_path: Path,
             description: str,
-            raw_text_path: Path
+            raw_text_path: Path,
+            agent_dir: Path = None
     ):
         self.name = name
+        self.agent_dir = agent_dir
+        self.keyframes = KeyframeIndex(agent_dir / self.keyframes_path) if agent_dir else None
         self.llm = ChatOpenAI(model=settings.assistant_model, openai_api_key=settings.OPENAI_API_KEY)
         self.vector_store = vector_store
-        self.retriever = self.vector_store.as_retriever()
+        self.retriever = self._create_retriever()
         self.video_path = video_path
         self.description = description
         self.raw_text_path = raw_text_path
@@ -48,13 +70,52 @@ class LangChanAgent:
             ))]
         )
 
-    @staticmethod
-    def _format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
+    def _create_retriever(self) -> BaseRetriever:
+        """Retriever of the configured retrieval mode, lexical index is built from the vector store if missing"""
+        if settings.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unsupported retrieval mode: {settings.retrieval_mode}")
+        if settings.retrieval_mode == 'vector' or not self.agent_dir:
+            return self.vector_store.as_retriever(search_kwargs={'k': settings.retrieval_k})
+
+        bm25_path = self.agent_dir / self.vectorstore_path / BM25Index.file_name
+        if bm25_path.exists():
+            bm25 = BM25Index.load(bm25_path)
+        else:
+            bm25 = BM25Index(self.stored_documents(self.vector_store))
+            bm25.save(bm25_path)
+
+        return HybridRetriever(
+            vector_store=self.vector_store,
+            bm25=bm25,
+            mode=settings.retrieval_mode,
+            k=settings.retrieval_k,
+            lexical_weight=settings.retrieval_lexical_weight
+        )
 
-    def _contextualize(self, question: str, message_history) -> str:
+    def release(self):
+        """
+        Close the chroma client of an agent dropped from the pool once the agent is garbage collected,
+        so requests still using the agent finish first. Chroma keeps one client per persist directory
+        for the whole process, the client is stopped when its last user is closed.
+        Chroma versions without Client.close keep the client until the process exits
+        :return:
+        """
+        if isinstance(self.vector_store, Chroma) and hasattr(self.vector_store._client, 'close'):
+            weakref.finalize(self, self.vector_store._client.close)
 
-        rag_chain = (
+    @classmethod
+    def _format_docs(cls, docs):
+        return "\n\n".join(cls._format_doc(doc) for doc in docs)
+
+    @classmethod
+    def _format_doc(cls, doc: Document) -> str:
+        if 'start' not in doc.metadata:
+            return doc.page_content
+        start, end = cls.readable_timestamp(doc.metadata['start']), cls.readable_timestamp(doc.metadata['end'])
+        return f"[{start} - {end}] {doc.page_content}"
+
+    def _contextualize_chain(self, message_history):
+        return (
                 {"history": lambda x: str(list(message_history)), "question": RunnablePassthrough()}
                 | ChatPromptTemplate(
                     messages=[HumanMessagePromptTemplate(prompt=PromptTemplate(
@@ -64,55 +125,223 @@ class LangChanAgent:
                 | self.llm
         )
 
-        return rag_chain.invoke(question).content
+    def _contextualize(self, question: str, message_history) -> str:
+        return self._contextualize_chain(message_history).invoke(question).content
 
-    def answer(self, question: str, message_history = None) -> str:
+    async def _acontextualize(self, question: str, message_history) -> str:
+        return (await self._contextualize_chain(message_history).ainvoke(question)).content
 
-        if message_history:
-            question = self._contextualize(question, message_history)
+    @property
+    def answer_cache_namespace(self) -> str:
+        """Agent name and index version, answers of the previous index are not reused after re-indexing"""
+        if not self.agent_dir:
+            return self.name
+        return f"{self.name}:{(self.agent_dir / self.vectorstore_path).resolve().name}"
 
-        rag_chain = (
+    def _answer_chain(self):
+        return (
                 {"context": self.retriever | self._format_docs, "question": RunnablePassthrough()}
                 | self.prompt
                 | self.llm
         )
 
-        return rag_chain.invoke(question).content
+    @property
+    def _answer_cache_enabled(self) -> bool:
+        # The cache is looked up by the question embedding, lexical mode must stay free of network calls
+        return settings.answer_cache and settings.retrieval_mode != 'lexical'
 
-    def create_user_story_map(self) -> str:
+    def answer(self, question: str, message_history = None) -> str:
+
+        cacheable = self._answer_cache_enabled and not is_history_dependent(question, message_history)
+        if cacheable:
+            question_vector = get_embeddings().embed_query(question)
+            cached_answer = AnswerCache().get(self.answer_cache_namespace, self.name, question_vector)
+            if cached_answer is not None:
+                return cached_answer
+        elif self._answer_cache_enabled:
+            AnswerCache().count(self.name, 'bypassed')
 
+        original_question = question
+        if message_history:
+            question = self._contextualize(question, message_history)
+
+        answer = self._answer_chain().invoke(question).content
+        if cacheable:
+            AnswerCache().put(self.answer_cache_namespace, original_question, question_vector, answer)
+        return answer
+
+    async def aanswer(self, question: str, message_history = None) -> str:
+        """Async version of answer, LLM and embedding calls don't block the event loop"""
+
+        cacheable = self._answer_cache_enabled and not is_history_dependent(question, message_history)
+        if cacheable:
+            question_vector = await get_embeddings().aembed_query(question)
+            cached_answer = await asyncio.to_thread(
+                AnswerCache().get, self.answer_cache_namespace, self.name, question_vector
+            )
+            if cached_answer is not None:
+                return cached_answer
+        elif self._answer_cache_enabled:
+            await asyncio.to_thread(AnswerCache().count, self.name, 'bypassed')
+
+        original_question = question
+        if message_history:
+            question = await self._acontextualize(question, message_history)
+
+        answer = (await self._answer_chain().ainvoke(question)).content
+        if cacheable:
+            await asyncio.to_thread(
+                AnswerCache().put, self.answer_cache_namespace, original_question, question_vector, answer
+            )
+        return answer
+
+    def _user_story_map_chain(self):
+        return ChatPromptTemplate.from_template(ProductManager.user_story_mapping) | self.llm | StrOutputParser()
+
+    def _read_subtitles(self) -> str:
         with open(self.raw_text_path, 'r') as f:
-            subtitles = f.read()
+            return f.read()
 
-        rag_chain = (
-            ChatPromptTemplate.from_template(ProductManager.user_story_mapping) | self.llm | StrOutputParser()
-        )
+    def create_user_story_map(self) -> str:
+        return self._user_story_map_chain().invoke({"subtitles": self._read_subtitles()})
+
+    async def acreate_user_story_map(self) -> str:
+        return await self._user_story_map_chain().ainvoke({"subtitles": self._read_subtitles()})
 
-        return rag_chain.invoke({"subtitles": subtitles})
+    def _telegram_formatting_chain(self):
+        return ChatPromptTemplate.from_template(Formatter.telegram_formatting) | self.llm | StrOutputParser()
 
     def apply_telegram_formating(self, text: str):
-        rag_chain = (
-                ChatPromptTemplate.from_template(Formatter.telegram_formatting) | self.llm | StrOutputParser()
-        )
-        return rag_chain.invoke({"text": text})
+        return self._telegram_formatting_chain().invoke({"text": text})
 
-    def apply_discord_formating(self, text: str) -> List[str]:
+    async def aapply_telegram_formating(self, text: str):
+        return await self._telegram_formatting_chain().ainvoke({"text": text})
 
+    def _discord_formatting_chain(self):
         parser = JsonOutputParser()
-        rag_chain = (
+        return (
                 ChatPromptTemplate.from_template(
                     Formatter.discord_formatting,
                     partial_variables={"format_instructions": parser.get_format_instructions()}
                 ) | self.llm | parser
         )
-        return rag_chain.invoke({"text": text})
 
-    def get_image(self, description: str) -> Tuple[bytes, str, str]:
+    def apply_discord_formating(self, text: str) -> List[str]:
+        return self._discord_formatting_chain().invoke({"text": text})
+
+    async def aapply_discord_formating(self, text: str) -> List[str]:
+        return await self._discord_formatting_chain().ainvoke({"text": text})
+
+    def get_image(
+            self,
+            description: str,
+            image_format: str = None,
+            max_width: int = None
+    ) -> Tuple[bytes, str, str]:
         """
         Get image from video based on description
-        :param description: screenshot description
+        :param description: screenshot description or timestamp
+        :param image_format: png, jpeg or webp, defaults to settings.screenshot_format
+        :param max_width: downscale wider images, defaults to settings.screenshot_max_width
         :return: [image_bytes, image_name, readable_timestamp]
         """
+        return self.get_images([description], image_format, max_width)[0]
+
+    def get_images(
+            self,
+            requests: List[str],
+            image_format: str = None,
+            max_width: int = None
+    ) -> List[Tuple[bytes, str, str]]:
+        """
+        Get several images from video, all frames are extracted in one ffmpeg invocation
+        :param requests: screenshot descriptions or timestamps (seconds, mm:ss or hh:mm:ss)
+        :param image_format: png, jpeg or webp, defaults to settings.screenshot_format
+        :param max_width: downscale wider images, defaults to settings.screenshot_max_width
+        :return: list of [image_bytes, image_name, readable_timestamp] in the order of requests
+        """
+        image_format = image_format or settings.screenshot_format
+        max_width = settings.screenshot_max_width if max_width is None else max_width
+        extension = image_extension(image_format)
+
+        resolved = [self._resolve_request(request) for request in requests]
+        images, timestamps = self._extract_frames([timestamp for timestamp, _ in resolved], image_format, max_width)
+
+        return [
+            (image_bytes, f"{image_name}.{extension}", self.readable_timestamp(timestamp))
+            for image_bytes, timestamp, (_, image_name) in zip(images, timestamps, resolved)
+        ]
+
+    async def aget_image(
+            self,
+            description: str,
+            image_format: str = None,
+            max_width: int = None
+    ) -> Tuple[bytes, str, str]:
+        """Async version of get_image"""
+        return (await self.aget_images([description], image_format, max_width))[0]
+
+    async def aget_images(
+            self,
+            requests: List[str],
+            image_format: str = None,
+            max_width: int = None
+    ) -> List[Tuple[bytes, str, str]]:
+        """
+        Async version of get_images, requests are resolved concurrently and frames are extracted
+        by an ffmpeg subprocess awaited on the event loop
+        """
+        image_format = image_format or settings.screenshot_format
+        max_width = settings.screenshot_max_width if max_width is None else max_width
+        extension = image_extension(image_format)
+
+        resolved = await asyncio.gather(*[asyncio.to_thread(self._resolve_request, request) for request in requests])
+        images, timestamps = await self._aextract_frames(
+            [timestamp for timestamp, _ in resolved], image_format, max_width
+        )
+
+        return [
+            (image_bytes, f"{image_name}.{extension}", self.readable_timestamp(timestamp))
+            for image_bytes, timestamp, (_, image_name) in zip(images, timestamps, resolved)
+        ]
+
+    def _resolve_request(self, request: str) -> Tuple[float, str]:
+        timestamp = parse_timestamp(request)
+        if timestamp is not None:
+            return timestamp, f"frame_{self.readable_timestamp(timestamp).replace(':', '_')}"
+        if settings.screenshot_use_llm:
+            return self._resolve_screenshot_llm(request)
+        return self._resolve_screenshot(request)
+
+    @staticmethod
+    def readable_timestamp(timestamp: float) -> str:
+        minutes = int(timestamp) // 60
+        seconds = int(timestamp) % 60
+        return f"{minutes:02d}:{seconds:02d}"
+
+    def _resolve_screenshot(self, description: str) -> Tuple[float, str]:
+        """
+        Find screenshot timestamp without LLM calls: retrieved segments are ranked locally
+        and the timestamp is taken from the best segment
+        :param description: screenshot description
+        :return: timestamp in seconds, image name without extension
+        """
+        segments = segments_from_documents(self.retriever.invoke(description))
+        if not segments:
+            if settings.screenshot_llm_fallback:
+                return self._resolve_screenshot_llm(description)
+            raise ValueError(f"No subtitles found for the description: {description}")
+
+        best_segment = rank_segments(description, segments)[0]
+        image_timestamp = (best_segment['start'] + best_segment['end']) / 2
+        return image_timestamp, slugify(description)
+
+    def _resolve_screenshot_llm(self, description: str) -> Tuple[float, str]:
+        """
+        Find screenshot timestamp and image name with LLM
+        :param description: screenshot description
+        :return: timestamp in seconds, image name without extension
+        """
         docs = self.retriever.invoke(description)
         prompt = ChatPromptTemplate(
             messages=[HumanMessagePromptTemplate(prompt=PromptTemplate(
@@ -127,13 +356,16 @@ class LangChanAgent:
         )
 
         image_timestamp = rag_chain.invoke(
-            description + ", Subtitles: " + "\n\n".join(doc.page_content for doc in docs)
+            description + ", Subtitles: " + "\n\n".join(
+                f"[{doc.metadata['start']} - {doc.metadata['end']}] {doc.page_content}"
+                if 'start' in doc.metadata else doc.page_content
+                for doc in docs
+            )
         ).content
-
-        # Convert timestamp to readable format
-        minutes = int(float(image_timestamp)) // 60
-        seconds = int(float(image_timestamp)) % 60
-        readable_timestamp = f"{minutes:02d}:{seconds:02d}"
+        # The model sometimes adds text around the number
+        timestamp_match = NUMBER_RE.search(image_timestamp)
+        if timestamp_match is None:
+            raise ValueError(f"Unable to parse timestamp: {image_timestamp}")
 
         prompt = ChatPromptTemplate(
             messages=[HumanMessagePromptTemplate(prompt=PromptTemplate(
@@ -146,17 +378,93 @@ class LangChanAgent:
                 | prompt
                 | self.llm
         )
-        image_file_name = rag_chain.invoke(description).content + f".{self.screenshot_extension}"
+        image_name = slugify(rag_chain.invoke(description).content)
 
-        process =(
-            ffmpeg
-            .input(self.video_path, ss=image_timestamp)
-            .output('pipe:', vframes=1, format='image2', vcodec='png')
-            .run_async(pipe_stdout=True, pipe_stderr=True)
-        )
-        image_bytes, _ = process.communicate()
+        return float(timestamp_match.group()), image_name
 
-        return image_bytes, image_file_name, readable_timestamp
+    def _extract_frames(
+            self,
+            timestamps: List[float],
+            image_format: str,
+            max_width: int
+    ) -> Tuple[List[bytes], List[float]]:
+        """
+        Get video frames at the timestamps.
+        Timestamps are quantized and frames are taken from the shared frame cache if possible.
+        Stored keyframes are used if they are close enough, other frames are extracted in one ffmpeg invocation
+        :param timestamps: seconds
+        :param image_format: png, jpeg or webp
+        :param max_width: downscale wider images, 0 to keep the original size
+        :return: images in the order of timestamps and timestamps of the images, a keyframe may be a bit earlier
+        """
+        keys, images, frame_timestamps = self._stored_frames(timestamps, image_format, max_width)
+        missing = sorted((key[1], i) for i, key in enumerate(keys) if images[i] is None)
+        if missing:
+            # Delivered frames are taken from the full resolution video if it was kept, not from the proxy
+            seek_path = YoutubeVideoProcessor.ensure_video(self.video_path)
+            frames = extract_frames(seek_path, [timestamp for timestamp, _ in missing], image_format, max_width)
+            self._store_extracted_frames(keys, images, missing, frames)
+        return images, frame_timestamps
+
+    async def _aextract_frames(
+            self,
+            timestamps: List[float],
+            image_format: str,
+            max_width: int
+    ) -> Tuple[List[bytes], List[float]]:
+        """Async version of _extract_frames"""
+        keys, images, frame_timestamps = self._stored_frames(timestamps, image_format, max_width)
+        missing = sorted((key[1], i) for i, key in enumerate(keys) if images[i] is None)
+        if missing:
+            seek_path = await asyncio.to_thread(YoutubeVideoProcessor.ensure_video, self.video_path)
+            frames = await aextract_frames(seek_path, [timestamp for timestamp, _ in missing], image_format, max_width)
+            self._store_extracted_frames(keys, images, missing, frames)
+        return images, frame_timestamps
+
+    @property
+    def _frame_spill_dir(self) -> Path | None:
+        return self.agent_dir / self.frame_cache_path if self.agent_dir else None
+
+    def _stored_frames(
+            self,
+            timestamps: List[float],
+            image_format: str,
+            max_width: int
+    ) -> Tuple[List[tuple], List[bytes | None], List[float]]:
+        """
+        Frames available without ffmpeg, from the frame cache or stored keyframes
+        :return: frame cache keys with quantized timestamps, images or None for missing frames
+            and timestamps of the images, the timestamp of a keyframe is shown instead of the requested one
+        """
+        frame_cache = FrameCache()
+        keys = [
+            frame_cache.key(self.video_path.stem, timestamp, image_format, max_width) for timestamp in timestamps
+        ]
+        images = [frame_cache.get(key, self._frame_spill_dir) for key in keys]
+        frame_timestamps = list(timestamps)
+
+        # Stored keyframes can be used only as they are
+        if self.keyframes and image_format == self.screenshot_extension and not max_width:
+            for i, (_, timestamp, _, _) in enumerate(keys):
+                if images[i] is not None:
+                    continue
+                keyframe = self.keyframes.find(timestamp, settings.keyframe_max_distance)
+                if keyframe:
+                    keyframe_path, frame_timestamps[i] = keyframe
+                    images[i] = keyframe_path.read_bytes()
+        return keys, images, frame_timestamps
+
+    def _store_extracted_frames(
+            self,
+            keys: List[tuple],
+            images: List[bytes | None],
+            missing: List[Tuple[float, int]],
+            frames: List[bytes]
+    ):
+        frame_cache = FrameCache()
+        for (_, i), frame in zip(missing, frames):
+            images[i] = frame
+            frame_cache.put(keys[i], frame, self._frame_spill_dir)
 
     @classmethod
     def create(
@@ -167,33 +475,196 @@ class LangChanAgent:
             agent_dir: Path,
             overwrite: bool = False
     ):
+        cls.build_index(subtitle_file_path, agent_dir, overwrite)
+        return cls.describe(name, video_path, agent_dir)
+
+    @classmethod
+    def build_index(
+            cls,
+            subtitle_file_path: Path,
+            agent_dir: Path,
+            overwrite: bool = False
+    ) -> VectorStore:
+        """
+        Create vector store and raw subtitles text in the agent directory.
+        An existing index is updated in place of rebuilding: only new chunks are embedded and inserted
+        and only vanished chunks are deleted, the updated store is swapped in when it is complete.
+        An index built with another embedding model, store type, dtype, dimensions or chunking is rebuilt
+        :param subtitle_file_path: whisper verbose_json subtitles
+        :param agent_dir:
+        :param overwrite: update existing index
+        :return:
+        :raises ValueError: if the subtitles contain no text
+        """
         if not subtitle_file_path.exists():
             raise FileNotFoundError(f"Subtitle file not found: {subtitle_file_path}")
-        if agent_dir.exists():
-            if overwrite:
-                shutil.rmtree(agent_dir)
-            else:
-                raise FileExistsError(f"Agent folder already exists: {agent_dir}")
-        agent_dir.mkdir(parents=True)
+        vectorstore_path = agent_dir / cls.vectorstore_path
+        if vectorstore_path.exists() and not overwrite:
+            raise FileExistsError(f"Agent folder already exists: {agent_dir}")
+        agent_dir.mkdir(parents=True, exist_ok=True)
 
         with open(subtitle_file_path, 'r') as f:
             subtitles = json.load(f)
 
-        segments = [{
-            'id': entry['id'],
-            'start': round(entry['start']),
-            'end': round(entry['end']),
-            'text': entry['text']} for entry in subtitles['segments']]
+        splits = chunk_segments(
+            subtitles['segments'],
+            max_tokens=settings.chunk_max_tokens,
+            overlap_tokens=settings.chunk_overlap_tokens
+        )
+        if not splits:
+            # Stores can't be built from no documents, an agent without an index could not be loaded
+            raise ValueError(f"No speech found in the subtitles, nothing to index: {subtitle_file_path}")
+
+        # Build next to the live store, agents loaded elsewhere never see a half-built store
+        staging_path = cls.staging_directory(vectorstore_path)
+        try:
+            if vectorstore_path.exists() and cls._is_configured_store(vectorstore_path):
+                shutil.copytree(vectorstore_path, staging_path)
+                cls.update_vector_store(cls.open_vector_store(staging_path), splits)
+            else:
+                # All chunks are embedded in one embed_documents call, batched and dispatched concurrently,
+                # then inserted into the store at once
+                cls.create_vector_store(splits, staging_path)
+            # Lexical index is rebuilt from all chunks, it is cheap compared to embedding
+            BM25Index(splits).save(staging_path / BM25Index.file_name)
+            cls.write_index_config(staging_path, cls.index_config())
+        except Exception:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        cls.swap_directory(staging_path, vectorstore_path)
+
+        raw_text_tmp = agent_dir / f"{cls.subtitle_raw_text_path}.tmp"
+        with open(raw_text_tmp, 'w') as f:
+            f.write(subtitles['text'])
+        raw_text_tmp.replace(agent_dir / cls.subtitle_raw_text_path)
+
+        return cls.open_vector_store(vectorstore_path)
 
-        docs = [Document(page_content=str(segments))]
+    @staticmethod
+    def index_config() -> dict:
+        """Settings the vectors of an index depend on, vectors built with other settings can't be mixed with new ones"""
+        numpy_store = settings.vector_store == 'numpy'
+        return {
+            'embedding_model': settings.embedding_model,
+            'vector_store': settings.vector_store,
+            'dtype': settings.vector_store_dtype if numpy_store else None,
+            'dimensions': settings.vector_store_dimensions if numpy_store else None,
+            'chunk_max_tokens': settings.chunk_max_tokens,
+            'chunk_overlap_tokens': settings.chunk_overlap_tokens,
+        }
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-        splits = text_splitter.split_documents(docs)
-        vectorstore = Chroma.from_documents(
-            documents=splits,
-            embedding=OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY),
-            persist_directory=str(agent_dir / cls.vectorstore_path)
-        )
+    @classmethod
+    def index_config_digest(cls) -> str:
+        """Short hash of the index config, e.g. to key cached indexes"""
+        return hashlib.sha256(json.dumps(cls.index_config(), sort_keys=True).encode()).hexdigest()[:16]
+
+    @classmethod
+    def read_index_config(cls, directory: Path) -> dict | None:
+        """Index config saved in the store directory, None for stores built before the config was saved"""
+        config_path = directory / cls.index_config_path
+        if not config_path.exists():
+            return None
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    @classmethod
+    def write_index_config(cls, directory: Path, config: dict):
+        with open(directory / cls.index_config_path, 'w') as f:
+            json.dump(config, f)
+
+    @classmethod
+    def _is_configured_store(cls, directory: Path) -> bool:
+        """Existing store was built with the current index config, other stores are rebuilt from scratch"""
+        return cls.read_index_config(directory) == cls.index_config()
+
+    @staticmethod
+    def stored_ids(vector_store: VectorStore) -> List[str]:
+        if isinstance(vector_store, NumpyVectorStore):
+            return [document['id'] for document in vector_store.documents]
+        return vector_store.get(include=[])['ids']
+
+    @staticmethod
+    def stored_documents(vector_store: VectorStore) -> List[Document]:
+        if isinstance(vector_store, NumpyVectorStore):
+            return [vector_store._document(i) for i in range(len(vector_store.documents))]
+        content = vector_store.get(include=['documents', 'metadatas'])
+        return [
+            Document(id=id_, page_content=text, metadata=metadata or {})
+            for id_, text, metadata in zip(content['ids'], content['documents'], content['metadatas'])
+        ]
+
+    @classmethod
+    def update_vector_store(cls, vector_store: VectorStore, documents: List[Document]) -> Tuple[int, int]:
+        """
+        Make the store contain exactly the documents, documents are identified by their content hash ids
+        :param vector_store:
+        :param documents:
+        :return: number of added and deleted documents
+        """
+        stored_ids = set(cls.stored_ids(vector_store))
+        new_ids = {document.id for document in documents}
+
+        vanished = list(stored_ids - new_ids)
+        if vanished:
+            vector_store.delete(ids=vanished)
+
+        added = list({document.id: document for document in documents if document.id not in stored_ids}.values())
+        if added:
+            vector_store.add_documents(added, ids=[document.id for document in added])
+        return len(added), len(vanished)
+
+    @staticmethod
+    def staging_directory(target: Path) -> Path:
+        """
+        Unique directory to build a replacement of target in.
+        Chroma caches its client per persist directory, a client cached for a reused staging path
+        would write to the version swapped in by the previous build
+        :param target:
+        :return:
+        """
+        return target.with_name(f"{target.name}.staging-{uuid.uuid4().hex[:12]}")
+
+    @staticmethod
+    def swap_directory(source: Path, target: Path):
+        """
+        Atomically replace target directory with source.
+        Target is a symlink to a versioned directory, the symlink is replaced in one rename.
+        The previous version is kept for agents that still have it open, older versions are removed
+        :param source: complete directory
+        :param target: directory path used by readers
+        :return:
+        """
+        version = target.with_name(f"{target.name}.v-{uuid.uuid4().hex[:12]}")
+        source.rename(version)
+
+        previous = target.resolve() if target.is_symlink() else None
+        if target.exists() and not target.is_symlink():
+            # Directory built before the versioning, a symlink can't replace it in one rename
+            previous = target.with_name(f"{target.name}.v-legacy")
+            shutil.rmtree(previous, ignore_errors=True)
+            target.rename(previous)
+
+        link = target.with_name(f"{target.name}.link")
+        link.unlink(missing_ok=True)
+        link.symlink_to(version.name)
+        os.replace(link, target)
+
+        keep = {version.name, previous.name if previous else None}
+        for path in target.parent.glob(f"{target.name}.v-*"):
+            if path.name not in keep:
+                shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def describe(cls, name: str, video_path: Path, agent_dir: Path):
+        """
+        Generate agent description and save agent metadata, the index should be already built
+        :param name:
+        :param video_path:
+        :param agent_dir:
+        :return:
+        """
+        if not (agent_dir / cls.vectorstore_path).exists():
+            raise FileNotFoundError(f"Agent index not found: {agent_dir}")
 
         llm = ChatOpenAI(model=settings.assistant_model, openai_api_key=settings.OPENAI_API_KEY)
         description = llm.invoke([["human", ProductManager.assistant_description_prompt]]).content
@@ -205,23 +676,50 @@ class LangChanAgent:
                 'video_path': str(video_path)
             }, f)
 
-        with open(agent_dir / cls.subtitle_raw_text_path, 'w') as f:
-            f.write(subtitles['text'])
+        return cls.load(agent_dir)
 
-        return cls(
-            name=name,
-            vector_store=vectorstore,
-            description=description,
-            video_path=video_path,
-            raw_text_path=agent_dir / cls.subtitle_raw_text_path
+    @staticmethod
+    def create_vector_store(documents: List[Document], directory: Path) -> VectorStore:
+        """
+        Create vector store of the configured type
+        :param documents:
+        :param directory: persist directory
+        :return:
+        """
+        if settings.vector_store == 'numpy':
+            # Shortened text-embedding-3 embeddings are truncated full embeddings,
+            # so full embeddings are requested and shared with the cache, then reduced by the store
+            if settings.vector_store_dimensions and not settings.embedding_model.startswith('text-embedding-3'):
+                raise ValueError(f"Reduced dimensions are not supported by {settings.embedding_model}")
+            return NumpyVectorStore.from_documents(
+                documents=documents,
+                embedding=get_embeddings(),
+                directory=directory,
+                dtype=settings.vector_store_dtype,
+                dimensions=settings.vector_store_dimensions,
+                rescore=settings.vector_store_rescore,
+                rescore_candidates=settings.vector_store_rescore_candidates
+            )
+        return Chroma.from_documents(
+            documents=documents,
+            embedding=get_embeddings(),
+            persist_directory=str(directory)
         )
 
+    @staticmethod
+    def open_vector_store(directory: Path) -> VectorStore:
+        """Open existing vector store, the type is detected from the directory content"""
+        if NumpyVectorStore.exists(directory):
+            return NumpyVectorStore(
+                embedding=get_embeddings(),
+                directory=directory,
+                rescore_candidates=settings.vector_store_rescore_candidates
+            )
+        return Chroma(embedding_function=get_embeddings(), persist_directory=str(directory))
+
     @classmethod
     def load(cls, agent_dir: Path):
-        vectorstore = Chroma(
-            embedding_function=OpenAIEmbeddings(openai_api_key=settings.OPENAI_API_KEY),
-            persist_directory=str(agent_dir / cls.vectorstore_path)
-        )
+        vectorstore = cls.open_vector_store(agent_dir / cls.vectorstore_path)
         with open(agent_dir / cls.metadata_path, 'r') as f:
             metadata = json.load(f)
             description = metadata['description']
@@ -233,5 +731,6 @@ class LangChanAgent:
             vector_store=vectorstore,
             description=description,
             video_path=video_path,
-            raw_text_path=agent_dir / cls.subtitle_raw_text_path
+            raw_text_path=agent_dir / cls.subtitle_raw_text_path,
+            agent_dir=agent_dir
         )
@@ -0,0 +1,317 @@
+import os
+import json
+import uuid
+from pathlib import Path
+from typing import List, Tuple, Iterable, Optional, Callable, Any
+import numpy as np
+from langchain_core.documents.base import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+
+VECTOR_DTYPES = ('float32', 'float16', 'int8')
+# Rows of int8 vectors converted to float32 at once when scoring
+SCORE_BLOCK_ROWS = 4096
+
+
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def reduce_dimensions(vectors, dimensions: int = None) -> np.ndarray:
+    """
+    Keep the first dimensions and normalize again.
+    For text-embedding-3 models this is what the API does when fewer dimensions are requested.
+    :param vectors: one vector or a matrix
+    :param dimensions: None to keep all dimensions
+    :return: normalized float32 vectors
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return normalize(vectors[..., :dimensions] if dimensions else vectors)
+
+
+def quantize(vectors: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Convert normalized float32 vectors to the storage dtype
+    :param vectors:
+    :param dtype: float32, float16 or int8, int8 vectors are scaled per vector to use the full range
+    :return: stored vectors and per-vector scales for int8
+    """
+    if dtype != 'int8':
+        return vectors.astype(dtype), None
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales = np.where(scales == 0, 1, scales).astype(np.float32)
+    return np.round(vectors / scales[:, None]).astype(np.int8), scales
+
+
+def dequantize(vectors: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors if scales is None else vectors * scales[:, None]
+
+
+def cosine_scores(vectors: np.ndarray, scales: Optional[np.ndarray], query: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of a normalized query and stored vectors
+    :param vectors: stored vectors, as returned by quantize
+    :param scales: int8 scales, None for float vectors
+    :param query: normalized float32 query
+    :return: float32 scores
+    """
+    if scales is None:
+        return (vectors @ query.astype(vectors.dtype)).astype(np.float32)
+    # int8 @ float32 converts the whole matrix to a float32 copy, blocks are converted one at a time instead
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), SCORE_BLOCK_ROWS):
+        block = np.asarray(vectors[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+        scores[start:start + SCORE_BLOCK_ROWS] = block @ query
+    return scores * scales
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indexes of the k best scores, best first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.array([], dtype=int)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vector store for small per-video corpora.
+    Normalized embeddings are kept in a memory-mapped .npy matrix, documents in a json sidecar,
+    search is an exact cosine top-k over the whole matrix.
+    Vectors may be stored with reduced dimensions and as float16 or int8 with per-vector scales.
+    With rescoring, float32 vectors are stored aside and the best candidates are scored again with them.
+    """
+
+    vectors_file: str = 'vectors.npy'
+    scales_file: str = 'scales.npy'
+    rescore_file: str = 'rescore.npy'
+    documents_file: str = 'documents.json'
+
+    def __init__(
+            self,
+            embedding: Embeddings,
+            directory: Path,
+            dtype: str = 'float32',
+            dimensions: int = None,
+            rescore: bool = False,
+            rescore_candidates: int = 4
+    ):
+        """
+        :param embedding:
+        :param directory: persist directory, settings of an existing store are taken from its files
+        :param dtype: float32, float16 or int8
+        :param dimensions: keep first dimensions of embeddings, None to keep all
+        :param rescore: store float32 vectors to rescore candidates
+        :param rescore_candidates: candidates per requested document to rescore
+        """
+        if dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported vector dtype: {dtype}")
+        self.embedding = embedding
+        self.directory = Path(directory)
+        self.dtype = dtype
+        self.dimensions = dimensions
+        self.rescore = rescore
+        self.rescore_candidates = rescore_candidates
+        self.vectors = None
+        self.scales = None
+        self.rescore_vectors = None
+        self.documents: List[dict] = []
+        if self.exists(self.directory):
+            self._load()
+
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        return (Path(directory) / cls.vectors_file).exists()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def _load(self):
+        self.vectors = np.load(self.directory / self.vectors_file, mmap_mode='r')
+        self.dtype = str(self.vectors.dtype)
+        self.dimensions = self.vectors.shape[1]
+        scales_path = self.directory / self.scales_file
+        self.scales = np.load(scales_path) if scales_path.exists() else None
+        rescore_path = self.directory / self.rescore_file
+        self.rescore = rescore_path.exists()
+        self.rescore_vectors = np.load(rescore_path, mmap_mode='r') if self.rescore else None
+        with open(self.directory / self.documents_file, 'r') as f:
+            self.documents = json.load(f)
+
+    def _full_vectors(self) -> Optional[np.ndarray]:
+        """Stored vectors as float32, exact if rescoring vectors are kept"""
+        if self.vectors is None:
+            return None
+        if self.rescore_vectors is not None:
+            return np.asarray(self.rescore_vectors)
+        return dequantize(self.vectors, self.scales)
+
+    def _save(self, vectors: np.ndarray, documents: List[dict]):
+        """
+        Persist vectors and documents
+        :param vectors: normalized float32 vectors
+        :param documents:
+        :return:
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        stored, scales = quantize(vectors, self.dtype)
+        files = {self.vectors_file: stored, self.scales_file: scales, self.rescore_file: vectors if self.rescore else None}
+
+        # Write next to the target and rename, readers never see a partially written file
+        for name, array in files.items():
+            if array is None:
+                continue
+            with open(self.directory / f"{name}.tmp", 'wb') as f:
+                np.save(f, array)
+        with open(self.directory / f"{self.documents_file}.tmp", 'w') as f:
+            json.dump(documents, f)
+
+        for name, array in files.items():
+            if array is None:
+                (self.directory / name).unlink(missing_ok=True)
+            else:
+                os.replace(self.directory / f"{name}.tmp", self.directory / name)
+        os.replace(self.directory / f"{self.documents_file}.tmp", self.directory / self.documents_file)
+        self._load()
+
+    def add_embeddings(
+            self,
+            texts: List[str],
+            embeddings: List[List[float]],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None
+    ) -> List[str]:
+        """
+        Add precomputed embeddings
+        :param texts:
+        :param embeddings:
+        :param metadatas:
+        :param ids: generated if not provided
+        :return: ids of added documents
+        """
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        documents = self.documents + [
+            {'id': id_, 'page_content': text, 'metadata': metadata}
+            for id_, text, metadata in zip(ids, texts, metadatas)
+        ]
+        new_vectors = reduce_dimensions(embeddings, self.dimensions)
+        vectors = new_vectors if self.vectors is None else np.concatenate([self._full_vectors(), new_vectors])
+        self._save(vectors, documents)
+        return ids
+
+    def add_texts(
+            self,
+            texts: Iterable[str],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any
+    ) -> List[str]:
+        texts = list(texts)
+        return self.add_embeddings(texts, self.embedding.embed_documents(texts), metadatas, ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids or self.vectors is None:
+            return False
+        ids = set(ids)
+        keep = [i for i, document in enumerate(self.documents) if document['id'] not in ids]
+        self._save(self._full_vectors()[keep], [self.documents[i] for i in keep])
+        return True
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        ids = set(ids)
+        return [self._document(i) for i, document in enumerate(self.documents) if document['id'] in ids]
+
+    def _document(self, index: int) -> Document:
+        document = self.documents[index]
+        return Document(id=document['id'], page_content=document['page_content'], metadata=document['metadata'])
+
+    def _matches(self, index: int, filter: Optional[dict]) -> bool:
+        metadata = self.documents[index]['metadata']
+        return all(metadata.get(key) == value for key, value in filter.items())
+
+    def similarity_search_with_score_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        """
+        Cosine top-k over all stored vectors, candidates are rescored with float32 vectors if they are kept
+        :param embedding: query embedding
+        :param k:
+        :param filter: metadata values the documents must have
+        :return: documents with cosine similarity, most similar first
+        """
+        if self.vectors is None or not self.documents:
+            return []
+        query = reduce_dimensions(embedding, self.dimensions)
+        scores = cosine_scores(self.vectors, self.scales, query)
+        if filter:
+            mask = np.array([self._matches(i, filter) for i in range(len(self.documents))])
+            scores = np.where(mask, scores, -np.inf)
+
+        if self.rescore_vectors is None:
+            top = top_k(scores, k)
+        else:
+            candidates = top_k(scores, k * self.rescore_candidates)
+            candidates = candidates[scores[candidates] != -np.inf]
+            rescored = np.asarray(self.rescore_vectors[np.sort(candidates)]) @ query
+            scores[np.sort(candidates)] = rescored
+            top = candidates[np.argsort(-scores[candidates])][:k]
+        return [(self._document(i), float(scores[i])) for i in top if scores[i] != -np.inf]
+
+    def similarity_search_with_score(
+            self,
+            query: str,
+            k: int = 4,
+            filter: Optional[dict] = None,
+            **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, filter)
+
+    def similarity_search_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[dict] = None,
+            **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, filter)]
+
+    def similarity_search(
+            self,
+            query: str,
+            k: int = 4,
+            filter: Optional[dict] = None,
+            **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Cosine similarity in [-1, 1] to relevance in [0, 1]
+        return lambda score: (score + 1) / 2
+
+    @classmethod
+    def from_texts(
+            cls,
+            texts: List[str],
+            embedding: Embeddings,
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            directory: Path = None,
+            **kwargs: Any
+    ) -> 'NumpyVectorStore':
+        if directory is None:
+            raise ValueError("NumpyVectorStore requires a directory")
+        store = cls(embedding=embedding, directory=directory, **kwargs)
+        store.add_texts(texts, metadatas, ids)
+        return store
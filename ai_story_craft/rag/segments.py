@@ -0,0 +1,99 @@
+import re
+import ast
+import json
+from typing import List
+from langchain_core.documents.base import Document
+
+SEGMENT_RE = re.compile(
+    r"\{'id': (?P<id>\d+), 'start': (?P<start>\d+(?:\.\d+)?), 'end': (?P<end>\d+(?:\.\d+)?), "
+    r"'text': (?P<text>'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")\}"
+)
+WORD_RE = re.compile(r"\w+")
+SLUG_RE = re.compile(r"[^a-z0-9]+")
+TIMESTAMP_RE = re.compile(r"^\s*(?:(?:(?P<hours>\d+):)?(?P<minutes>\d{1,2}):)?(?P<seconds>\d+(?:\.\d+)?)s?\s*$")
+STOP_WORDS = {
+    'a', 'an', 'the', 'and', 'or', 'of', 'to', 'in', 'on', 'at', 'for', 'with', 'is', 'are', 'was', 'be',
+    'this', 'that', 'it', 'as', 'by', 'from', 'where', 'when', 'what', 'which', 'how', 'show', 'me',
+    'screenshot', 'image', 'picture', 'frame', 'moment', 'video', 'shows', 'showing',
+}
+
+
+def segments_from_documents(docs: List[Document]) -> List[dict]:
+    """
+    Extract subtitle segments from retrieved documents.
+    Segments are taken from the segment offsets of chunks, document metadata if present,
+    otherwise parsed from the serialized segment list
+    :param docs: documents in retrieval order
+    :return: segments with id, start, end, text and rank of the document they were found in
+    """
+    segments = []
+    for rank, doc in enumerate(docs):
+        if 'segments' in doc.metadata:
+            # Chunk of several segments, each segment keeps its own timestamps
+            offsets = json.loads(doc.metadata['segments'])
+            for i, (segment_id, start, end, offset) in enumerate(offsets):
+                next_offset = offsets[i + 1][3] if i + 1 < len(offsets) else len(doc.page_content)
+                segments.append({
+                    'id': segment_id,
+                    'start': float(start),
+                    'end': float(end),
+                    'text': doc.page_content[offset:next_offset].strip(),
+                    'rank': rank,
+                })
+            continue
+        if 'start' in doc.metadata and 'end' in doc.metadata:
+            segments.append({
+                'id': doc.metadata.get('segment_id', doc.metadata.get('first_segment_id')),
+                'start': float(doc.metadata['start']),
+                'end': float(doc.metadata['end']),
+                'text': doc.page_content,
+                'rank': rank,
+            })
+            continue
+        for match in SEGMENT_RE.finditer(doc.page_content):
+            segments.append({
+                'id': int(match['id']),
+                'start': float(match['start']),
+                'end': float(match['end']),
+                'text': ast.literal_eval(match['text']),
+                'rank': rank,
+            })
+    return segments
+
+
+def _words(text: str) -> set:
+    return {word for word in WORD_RE.findall(text.lower()) if word not in STOP_WORDS}
+
+
+def rank_segments(query: str, segments: List[dict]) -> List[dict]:
+    """
+    Rank segments by the share of query words they contain, ties are broken by the retrieval rank
+    :param query:
+    :param segments: segments returned by segments_from_documents
+    :return: segments sorted from the best match
+    """
+    query_words = _words(query)
+
+    def score(segment: dict):
+        overlap = len(query_words & _words(segment['text'])) / len(query_words) if query_words else 0.0
+        return -overlap, segment['rank'], segment['start']
+
+    return sorted(segments, key=score)
+
+
+def slugify(text: str, max_length: int = 100) -> str:
+    """Deterministic file name from the text"""
+    slug = SLUG_RE.sub('_', text.lower()).strip('_')[:max_length].rstrip('_')
+    return slug or 'screenshot'
+
+
+def parse_timestamp(text: str) -> float | None:
+    """
+    Parse timestamp given as seconds, mm:ss or hh:mm:ss
+    :param text:
+    :return: seconds, None if the text is not a timestamp
+    """
+    match = TIMESTAMP_RE.match(text)
+    if match is None:
+        return None
+    return int(match['hours'] or 0) * 3600 + int(match['minutes'] or 0) * 60 + float(match['seconds'])
@@ -0,0 +1,78 @@
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from langchain_openai import OpenAIEmbeddings
+from rag.batch_embedding import BatchedEmbeddings
+
+
+class FakeEmbeddingHandler(BaseHTTPRequestHandler):
+    """OpenAI compatible /embeddings endpoint with fixed latency and random rate limit errors."""
+    latency: float = 0.3
+    rate_limit_ratio: float = 0.05
+    dimensions: int = 1536
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        time.sleep(self.latency)
+        if random.random() < self.rate_limit_ratio:
+            self._respond(429, {'error': {'message': 'Rate limit reached', 'type': 'requests', 'code': 'rate_limit'}})
+            return
+        inputs = body['input'] if isinstance(body['input'], list) else [body['input']]
+        self._respond(200, {
+            'object': 'list',
+            'model': body['model'],
+            'data': [
+                {'object': 'embedding', 'index': i, 'embedding': [random.random() for _ in range(self.dimensions)]}
+                for i in range(len(inputs))
+            ],
+            'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+        })
+
+    def _respond(self, status: int, payload: dict):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def benchmark(texts, base_url: str, **kwargs) -> float:
+    client = OpenAIEmbeddings(openai_api_key='fake', openai_api_base=base_url, max_retries=0)
+    embeddings = BatchedEmbeddings(client, **kwargs)
+    start = time.time()
+    embeddings.embed_documents(texts)
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark batched embedding against a local fake embedding server")
+    parser.add_argument("--chunks", type=int, default=300)
+    parser.add_argument("--chunk-words", type=int, default=150)
+    parser.add_argument("--latency", type=float, default=0.3)
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.05)
+    args = parser.parse_args()
+
+    FakeEmbeddingHandler.latency = args.latency
+    FakeEmbeddingHandler.rate_limit_ratio = args.rate_limit_ratio
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeEmbeddingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}/v1'
+
+    texts = [f"chunk {i} " + " ".join(random.choice(['product', 'feature', 'price', 'user', 'story'])
+                                        for _ in range(args.chunk_words)) for i in range(args.chunks)]
+
+    print(f"One chunk per request, sequential: "
+          f"{benchmark(texts, base_url, batch_size=1, max_workers=1, max_retries=10):.2f}s")
+    print(f"Token budgeted batches, concurrent: {benchmark(texts, base_url, max_retries=10):.2f}s")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
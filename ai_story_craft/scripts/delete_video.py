@@ -25,6 +25,11 @@ def delete_video(video_hash: str):
         if audio_path.exists():
             audio_path.unlink()
 
+    if video.proxy_path:
+        proxy_path = Path(video.proxy_path)
+        if proxy_path.exists():
+            proxy_path.unlink()
+
     # Find and delete associated agent
     agent = AgentCRUD().get_by_name(video.title)
     if agent:
@@ -0,0 +1,70 @@
+import shutil
+import argparse
+from pathlib import Path
+from typing import List
+from langchain_chroma import Chroma
+from core.settings import settings
+from db.models_crud import AgentCRUD
+from rag.embedding_cache import get_embeddings
+from rag.langchain_agent import LangChanAgent
+from rag.numpy_store import NumpyVectorStore
+
+
+def agent_directories() -> List[Path]:
+    """Directories of all agents in the database"""
+    directories, page_number = [], 0
+    while agents := AgentCRUD().get_list(page_number=page_number, page_size=100):
+        directories += [Path(agent.agent_dir) for agent in agents]
+        page_number += 1
+    return directories
+
+
+def migrate_vector_store(agent_dir: Path, dtype: str, keep_backup: bool = True) -> bool:
+    """
+    Convert Chroma vector store of an agent into NumpyVectorStore, embeddings are copied, not recomputed.
+    The new store is built next to the old one and swapped in atomically.
+    :param agent_dir:
+    :param dtype: float32 or float16
+    :param keep_backup: keep the Chroma store as vectorstore.chroma
+    :return: False if there is nothing to migrate
+    """
+    vectorstore_path = agent_dir / LangChanAgent.vectorstore_path
+    if not vectorstore_path.exists() or NumpyVectorStore.exists(vectorstore_path):
+        return False
+
+    content = Chroma(persist_directory=str(vectorstore_path)).get(
+        include=['embeddings', 'documents', 'metadatas']
+    )
+
+    migrated_path = vectorstore_path.with_name(f"{vectorstore_path.name}.numpy")
+    shutil.rmtree(migrated_path, ignore_errors=True)
+    NumpyVectorStore(embedding=get_embeddings(), directory=migrated_path, dtype=dtype).add_embeddings(
+        texts=content['documents'],
+        embeddings=content['embeddings'],
+        metadatas=content['metadatas'],
+        ids=content['ids']
+    )
+
+    # Embeddings are copied, so the model and chunking of the Chroma store are kept
+    config = LangChanAgent.read_index_config(vectorstore_path)
+    if config is not None:
+        LangChanAgent.write_index_config(migrated_path, {**config, 'vector_store': 'numpy', 'dtype': dtype})
+
+    if keep_backup:
+        backup_path = vectorstore_path.with_name(f"{vectorstore_path.name}.chroma")
+        shutil.rmtree(backup_path, ignore_errors=True)
+        shutil.copytree(vectorstore_path, backup_path)
+    LangChanAgent.swap_directory(migrated_path, vectorstore_path)
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert Chroma vector stores of agents into numpy vector stores')
+    parser.add_argument('agent_dirs', type=Path, nargs='*', help='Agent directories, all agents if omitted')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default=settings.vector_store_dtype)
+    parser.add_argument('--delete-backup', action='store_true', help='Remove Chroma stores after migration')
+    args = parser.parse_args()
+
+    for directory in args.agent_dirs or agent_directories():
+        migrated = migrate_vector_store(directory, args.dtype, keep_backup=not args.delete_backup)
+        print(f"{directory}: {'migrated' if migrated else 'skipped'}")
@@ -0,0 +1,106 @@
+import argparse
+from pathlib import Path
+from typing import List, Tuple
+import numpy as np
+from langchain_chroma import Chroma
+from core.settings import settings
+from rag.embedding_cache import get_embeddings
+from rag.langchain_agent import LangChanAgent
+from rag.numpy_store import NumpyVectorStore, reduce_dimensions, quantize, cosine_scores, top_k
+from scripts.migrate_vector_stores import agent_directories
+
+
+def exact_vectors(agent_dir: Path) -> np.ndarray | None:
+    """Full precision embeddings of an agent index, None if the index is not exact"""
+    vectorstore_path = agent_dir / LangChanAgent.vectorstore_path
+    if NumpyVectorStore.exists(vectorstore_path):
+        store = NumpyVectorStore(embedding=None, directory=vectorstore_path)
+        if store.dtype != 'float32' and not store.rescore:
+            return None
+        return store._full_vectors()
+    if vectorstore_path.exists():
+        content = Chroma(persist_directory=str(vectorstore_path)).get(include=['embeddings'])
+        return np.asarray(content['embeddings'], dtype=np.float32)
+    return None
+
+
+def recall(vectors: np.ndarray, queries: np.ndarray, k: int, exclude_self: bool, **options) -> float:
+    """
+    Share of the exact top-k found by the quantized, dimension reduced index
+    :param vectors: exact vectors
+    :param queries: query vectors
+    :param k:
+    :param exclude_self: queries are the indexed vectors, the query itself is not counted
+    :param options: dimensions, dtype, rescore and rescore_candidates
+    :return:
+    """
+    exact = reduce_dimensions(vectors)
+    reduced = reduce_dimensions(vectors, options['dimensions'])
+    stored, scales = quantize(reduced, options['dtype'])
+    found = 0
+    for i, query in enumerate(queries):
+        exact_scores = exact @ reduce_dimensions(query)
+        scores = cosine_scores(stored, scales, reduce_dimensions(query, options['dimensions']))
+        if exclude_self:
+            exact_scores[i] = scores[i] = -np.inf
+        expected = set(top_k(exact_scores, k))
+        if options['rescore']:
+            candidates = top_k(scores, k * options['rescore_candidates'])
+            candidates = candidates[scores[candidates] != -np.inf]
+            candidates = candidates[np.argsort(-(reduced[candidates] @ reduce_dimensions(query, options['dimensions'])))]
+            predicted = set(candidates[:k])
+        else:
+            predicted = set(top_k(scores, k))
+        found += len(expected & predicted)
+    return found / (len(queries) * k)
+
+
+def bytes_per_vector(dimensions: int, dtype: str, rescore: bool) -> int:
+    size = dimensions * np.dtype(dtype).itemsize + (4 if dtype == 'int8' else 0)
+    return size + (dimensions * 4 if rescore else 0)
+
+
+def variants(full_dimensions: int, dimensions: List[int]) -> List[Tuple[int, str, bool]]:
+    result = []
+    for dims in [full_dimensions] + [d for d in dimensions if d < full_dimensions]:
+        for dtype in ('float32', 'float16', 'int8'):
+            result.append((dims, dtype, False))
+            if dtype != 'float32':
+                result.append((dims, dtype, True))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Recall and size of quantized, dimension reduced vector stores')
+    parser.add_argument('agent_dirs', type=Path, nargs='*', help='Agent directories, all agents if omitted')
+    parser.add_argument('--k', type=int, default=4)
+    parser.add_argument('--dimensions', type=int, nargs='*', default=[1024, 512, 256])
+    parser.add_argument('--rescore-candidates', type=int, default=settings.vector_store_rescore_candidates)
+    parser.add_argument('--queries', type=Path, help='Questions, one per line, indexed chunks are used if omitted')
+    args = parser.parse_args()
+
+    if not settings.embedding_model.startswith('text-embedding-3'):
+        print(f"Reduced dimensions are not supported by {settings.embedding_model}, ignore those rows")
+
+    query_vectors = None
+    if args.queries:
+        questions = [line.strip() for line in args.queries.read_text().splitlines() if line.strip()]
+        query_vectors = np.asarray(get_embeddings().embed_documents(questions), dtype=np.float32)
+
+    corpora = [vectors for vectors in map(exact_vectors, args.agent_dirs or agent_directories()) if vectors is not None]
+    if not corpora:
+        raise SystemExit("No exact indexes found")
+    documents = sum(len(vectors) for vectors in corpora)
+    full_dimensions = corpora[0].shape[1]
+
+    print(f"{documents} documents in {len(corpora)} indexes, recall@{args.k} against exact float32 search")
+    print(f"{'dims':>6} {'dtype':>8} {'rescore':>8} {'recall':>8} {'bytes/vector':>13} {'total MB':>9}")
+    for dims, dtype, rescore in variants(full_dimensions, args.dimensions):
+        options = dict(dimensions=dims, dtype=dtype, rescore=rescore, rescore_candidates=args.rescore_candidates)
+        recalls = [
+            recall(vectors, vectors if query_vectors is None else query_vectors, args.k, query_vectors is None, **options)
+            for vectors in corpora if len(vectors) > args.k
+        ]
+        size = bytes_per_vector(dims, dtype, rescore)
+        print(f"{dims:>6} {dtype:>8} {str(rescore):>8} {np.mean(recalls):>8.3f} {size:>13} "
+              f"{size * documents / 1024 / 1024:>9.1f}")
@@ -1,9 +1,14 @@
 import argparse
+import shutil
 from pathlib import Path
 from rag.langchain_agent import LangChanAgent
-from subtitles_extractor import extract_subtitles
+from subtitles_extractor import extract_subtitles, extract_audio, audio_envelope, audio_fingerprint, envelopes_match
+from core.settings import settings
+from utils.content_cache import ContentCache
+from video_processing.keyframes import extract_keyframes
+from video_processing.youtube_video_processor import YoutubeVideoProcessor
 from db.models_crud import AgentCRUD, AgentAccessCRUD, ChatCRUD, VideoCRUD
-from db.models import Agent, Video
+from db.models import Agent, Video, VideoType
 
 
 class StoryCraft:
@@ -25,6 +30,14 @@ class StoryCraft:
 
         self.work_directory.mkdir(exist_ok=True)
 
+    @property
+    def subtitles_path(self) -> Path:
+        return self.work_directory / 'subtitles.json'
+
+    @property
+    def agent_dir(self) -> Path:
+        return self.work_directory / 'agent'
+
     def evaluate(
             self,
             external_chat_id: str,
@@ -37,45 +50,176 @@ class StoryCraft:
 
         assistant_name = assistant_name or self.video_path.stem
 
-        # Get or create chat
-        chat = ChatCRUD().get_by_external_id(external_chat_id)
-        if chat is None:
-            chat = ChatCRUD().create(chat_id=external_chat_id)
-
         # Check if agent already exists
         existing_agent = AgentCRUD().get_by_name(assistant_name)
         if existing_agent:
             # Grant access to existing agent
-            AgentAccessCRUD().grant_access(chat.id, existing_agent.id)
+            self.grant_access(external_chat_id, existing_agent)
             return existing_agent
 
-        subtitles_path = self.work_directory / 'subtitles.json'
-        if not subtitles_path.exists():
-            extract_subtitles(
-                self.video_path,
-                subtitles_path,
-                audio_path=self.audio_path
-            )
+        self.transcribe()
+        self.index(overwrite=overwrite)
+        created_agent = self.describe(assistant_name)
+        self.grant_access(external_chat_id, created_agent)
+
+        return created_agent
+
+    def extract_audio(self) -> Path:
+        """
+        Extract audio track for transcription into the work directory
+        :return: path to the extracted audio
+        """
+        if self.video.extracted_audio_path and Path(self.video.extracted_audio_path).exists():
+            return Path(self.video.extracted_audio_path)
+
+        audio_path = extract_audio(self.video_path, self.work_directory, self.audio_path)
+        self.video = VideoCRUD().update(self.video.id, extracted_audio_path=str(audio_path))
+        return audio_path
+
+    @property
+    def transcription_audio_path(self) -> Path | None:
+        if self.video.extracted_audio_path:
+            return Path(self.video.extracted_audio_path)
+        return self.audio_path
+
+    def fingerprint(self) -> str | None:
+        """
+        Audio fingerprint used as the content cache key.
+        Envelopes of cached audio are kept in the cache metadata, audio matching a cached envelope within
+        the tolerance gets the key of the cached entry, even if its quantized envelope differs
+        :return: None if the audio is too short or too flat to be cached
+        """
+        if self.video.audio_fingerprint is None:
+            audio_path = self.transcription_audio_path
+            audio_path = audio_path if audio_path and audio_path.exists() else self.video_path
+            envelope = audio_envelope(audio_path)
+            key = audio_fingerprint(envelope)
+            if key and settings.content_cache:
+                cache = ContentCache()
+                if 'envelope' not in cache.get_meta(key):
+                    similar = cache.find(lambda meta: 'envelope' in meta and envelopes_match(envelope, meta['envelope']))
+                    if similar:
+                        key = similar
+                    else:
+                        cache.put_meta(key, envelope=[round(float(value), 1) for value in envelope])
+            # Empty fingerprint marks audio which is not cached, so it is not computed again
+            self.video = VideoCRUD().update(self.video.id, audio_fingerprint=key or '')
+        return self.video.audio_fingerprint or None
+
+    def transcribe(self) -> Path:
+        """
+        Create subtitles file, skipped if it already exists.
+        Subtitles of the same audio are taken from the content cache
+        :return: path to the subtitles
+        """
+        if self.subtitles_path.exists():
+            return self.subtitles_path
+
+        if settings.content_cache and self.fingerprint():
+            cached_path = ContentCache().get(self.fingerprint(), 'subtitles.json')
+            if cached_path:
+                shutil.copy2(cached_path, self.subtitles_path)
+                subtitles_source = ContentCache().get_meta(self.fingerprint()).get('subtitles_source')
+                self.video = VideoCRUD().update(self.video.id, subtitles_source=subtitles_source)
+                return self.subtitles_path
+
+        audio_path = self.transcription_audio_path
+        # Write to a temporary file, so the interrupted transcription is not taken as completed
+        temp_path = self.subtitles_path.with_suffix('.tmp')
+        subtitles_source = extract_subtitles(
+            self.video_path,
+            temp_path,
+            audio_path=audio_path,
+            video_url=self.video.url if self.video.video_type == VideoType.youtube else None
+        )
+        temp_path.replace(self.subtitles_path)
+        self.video = VideoCRUD().update(self.video.id, subtitles_source=subtitles_source)
+
+        if settings.content_cache and self.fingerprint():
+            ContentCache().put(self.fingerprint(), 'subtitles.json', self.subtitles_path)
+            ContentCache().put_meta(self.fingerprint(), subtitles_source=subtitles_source.value)
+        return self.subtitles_path
+
+    def index(self, overwrite: bool = False):
+        """Build agent vector store from the subtitles, the vector store of the same audio is taken from the cache"""
+        vectorstore_path = self.agent_dir / LangChanAgent.vectorstore_path
+        raw_text_path = self.agent_dir / LangChanAgent.subtitle_raw_text_path
 
-        agent_dir = self.work_directory / 'agent'
+        # Cached subtitles depend only on the audio, cached indexes also on the embedding and store settings
+        cached_vectorstore_name = f"{LangChanAgent.vectorstore_path}-{LangChanAgent.index_config_digest()}"
 
-        agent = LangChanAgent.create(
+        if settings.content_cache and self.fingerprint():
+            cache = ContentCache()
+            cached_vectorstore = cache.get(self.fingerprint(), cached_vectorstore_name)
+            cached_raw_text = cache.get(self.fingerprint(), LangChanAgent.subtitle_raw_text_path)
+            if cached_vectorstore and cached_raw_text:
+                if vectorstore_path.exists() and not overwrite:
+                    raise FileExistsError(f"Agent folder already exists: {self.agent_dir}")
+                self.agent_dir.mkdir(parents=True, exist_ok=True)
+                staging_path = LangChanAgent.staging_directory(vectorstore_path)
+                shutil.copytree(cached_vectorstore, staging_path)
+                LangChanAgent.swap_directory(staging_path, vectorstore_path)
+                shutil.copy2(cached_raw_text, raw_text_path)
+                return
+
+        LangChanAgent.build_index(
+            subtitle_file_path=self.subtitles_path,
+            agent_dir=self.agent_dir,
+            overwrite=overwrite
+        )
+
+        if settings.content_cache and self.fingerprint():
+            ContentCache().put(self.fingerprint(), cached_vectorstore_name, vectorstore_path)
+            ContentCache().put(self.fingerprint(), LangChanAgent.subtitle_raw_text_path, raw_text_path)
+
+    def describe(self, assistant_name: str = None) -> Agent:
+        """
+        Generate agent description and create agent record, skipped if the agent already exists
+        :param assistant_name:
+        :return:
+        """
+        assistant_name = assistant_name or self.video_path.stem
+        existing_agent = AgentCRUD().get_by_name(assistant_name)
+        if existing_agent:
+            return existing_agent
+
+        agent = LangChanAgent.describe(
             name=assistant_name,
             video_path=self.video_path,
-            subtitle_file_path=subtitles_path,
-            agent_dir=agent_dir,
-            overwrite=overwrite
+            agent_dir=self.agent_dir
         )
-        
-        # Create agent and grant access
-        created_agent = AgentCRUD().create(
+
+        # Agent may be created concurrently outside the single-flight lock
+        return AgentCRUD().get_or_create(
             name=agent.name,
             description=agent.description,
-            agent_dir=str(agent_dir)
+            agent_dir=str(self.agent_dir)
         )
-        AgentAccessCRUD().grant_access(chat.id, created_agent.id)
-        
-        return created_agent
+
+    def extract_keyframes(self) -> list:
+        """
+        Extract scene change keyframes into the agent directory, used for instant screenshots
+        :return: keyframe timestamps
+        """
+        # Scene detection decodes the whole video, the proxy is much faster to decode
+        seek_path = YoutubeVideoProcessor.ensure_video(self.video_path, prefer_proxy=True)
+        return extract_keyframes(
+            seek_path,
+            self.agent_dir / LangChanAgent.keyframes_path,
+            scene_threshold=settings.keyframe_scene_threshold,
+            max_interval=settings.keyframe_max_interval,
+            extension=LangChanAgent.screenshot_extension
+        )
+
+    @staticmethod
+    def grant_access(external_chat_id: str, agent: Agent):
+        """Give the chat access to the agent, chat is created if needed"""
+        chat = ChatCRUD().get_by_external_id(external_chat_id)
+        if chat is None:
+            chat = ChatCRUD().create(chat_id=external_chat_id)
+
+        if not AgentAccessCRUD().has_access(chat.id, agent.id):
+            AgentAccessCRUD().grant_access(chat.id, agent.id)
 
 
 if __name__ == '__main__':
@@ -1,49 +1,626 @@
+import io
+import re
+import hashlib
+import queue
+import wave
+import bisect
+import threading
 import ffmpeg
 import tempfile
 import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from openai import OpenAI
-from typing import Iterator, TextIO
+from typing import Iterator, TextIO, List, Tuple
 from pathlib import Path
 from core.settings import settings
-import whisper
+from whisper_pool import WhisperModelPool
+from integrations.youtube import fetch_captions
+from db.models import SubtitlesSource
+
+
+CAPTION_NOISE_RE = re.compile(r"^\s*[\[(][^\])]*[\])]\s*$")
+SILENCE_START_RE = re.compile(r"silence_start: (-?\d+(?:\.\d+)?)")
+SILENCE_END_RE = re.compile(r"silence_end: (-?\d+(?:\.\d+)?)")
+
+# Audio codecs accepted by the transcription API and containers to copy them into without re-encoding
+API_AUDIO_CONTAINERS = {'aac': 'm4a', 'mp3': 'mp3', 'opus': 'ogg', 'vorbis': 'ogg', 'flac': 'flac'}
+# ffprobe format names accepted by the transcription API and file extensions the API recognizes them by
+API_AUDIO_FORMATS = {
+    'mov,mp4,m4a,3gp,3g2,mj2': {'.m4a', '.mp4'},
+    'mp3': {'.mp3', '.mpga', '.mpeg'},
+    'ogg': {'.ogg', '.oga'},
+    'flac': {'.flac'},
+    'matroska,webm': {'.webm'},
+}
+API_MAX_FILE_SIZE = 25 * 1024 * 1024
+
+STREAM_SAMPLE_RATE = 16000  # whisper works with 16kHz mono audio
+STREAM_SAMPLE_WIDTH = 2  # 16-bit PCM
+
+
+def get_audio_duration(audio_path: Path) -> float:
+    """Get the duration of a media file in seconds"""
+    return float(ffmpeg.probe(str(audio_path))['format']['duration'])
+
+
+def audio_envelope(audio_path: Path, sample_rate: int = 4000) -> np.ndarray:
+    """
+    Loudness envelope of the audio content, independent of the container, codec and bitrate
+    :param audio_path: audio or video file
+    :param sample_rate: decoding sample rate, low rate is enough for the envelope
+    :return: loudness of every second in dB
+    """
+    stdout, _ = (
+        ffmpeg
+        .input(str(audio_path))
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+        .run(capture_stdout=True, quiet=True)
+    )
+    samples = np.frombuffer(stdout, dtype=np.int16).astype(np.float32)
+    seconds = len(samples) // sample_rate
+    rms = np.sqrt(np.mean(samples[:seconds * sample_rate].reshape(seconds, sample_rate) ** 2, axis=1))
+    return (20 * np.log10(rms + 1.0)).astype(np.float32)
+
+
+def audio_fingerprint(envelope: np.ndarray, step_db: float = 3.0) -> str | None:
+    """
+    Key of the audio content built from its loudness envelope quantized to step_db steps.
+    Encodings of the same audio may differ by a step in some seconds, the envelopes are compared by envelopes_match
+    :param envelope: loudness envelope returned by audio_envelope
+    :param step_db: loudness quantization step
+    :return: hex digest, None if the audio is too short or too flat to tell it from other audio
+    """
+    if len(envelope) < settings.fingerprint_min_duration or np.std(envelope) < settings.fingerprint_min_dynamics_db:
+        return None
+    loudness = np.round(envelope / step_db).astype(np.int8)
+    return hashlib.sha256(loudness.tobytes()).hexdigest()
+
+
+def envelopes_match(first: np.ndarray, second: np.ndarray, tolerance_db: float = None, max_offset: int = None) -> bool:
+    """
+    Check if two loudness envelopes belong to the same audio.
+    Envelopes are compared at offsets up to max_offset seconds, after removing the difference in the overall gain
+    :param first:
+    :param second:
+    :param tolerance_db: max mean absolute difference of the loudness
+    :param max_offset: max shift between the envelopes in seconds
+    :return:
+    """
+    tolerance_db = settings.fingerprint_tolerance_db if tolerance_db is None else tolerance_db
+    max_offset = settings.fingerprint_max_offset if max_offset is None else max_offset
+    if abs(len(first) - len(second)) > max_offset:
+        return False
+
+    first, second = np.asarray(first, dtype=np.float32), np.asarray(second, dtype=np.float32)
+    for offset in range(-max_offset, max_offset + 1):
+        a, b = (first[offset:], second) if offset >= 0 else (first, second[-offset:])
+        length = min(len(a), len(b))
+        if length < settings.fingerprint_min_duration:
+            continue
+        difference = a[:length] - b[:length]
+        if np.mean(np.abs(difference - np.median(difference))) <= tolerance_db:
+            return True
+    return False
+
+
+def detect_silences(
+        audio_path: Path,
+        threshold_db: int = None,
+        min_duration: float = None
+) -> List[Tuple[float, float]]:
+    """
+    Detect silent intervals with ffmpeg silencedetect filter
+    :param audio_path:
+    :param threshold_db: noise level below which audio is considered silent
+    :param min_duration: minimal silence duration in seconds
+    :return: list of (start, end) intervals in seconds
+    """
+    threshold_db = settings.silence_threshold_db if threshold_db is None else threshold_db
+    min_duration = settings.silence_min_duration if min_duration is None else min_duration
+
+    _, stderr = (
+        ffmpeg
+        .input(str(audio_path))
+        .filter('silencedetect', noise=f'{threshold_db}dB', d=min_duration)
+        .output('-', format='null')
+        .run(capture_stderr=True)
+    )
+    log = stderr.decode('utf-8', errors='ignore')
+
+    starts = [max(float(value), 0.0) for value in SILENCE_START_RE.findall(log)]
+    ends = [float(value) for value in SILENCE_END_RE.findall(log)]
+    # silence lasting until the end of the file has no silence_end marker
+    if len(ends) < len(starts):
+        ends.append(get_audio_duration(audio_path))
+    return list(zip(starts, ends))
+
+
+def split_at_silences(
+        duration: float,
+        silences: List[Tuple[float, float]],
+        max_chunk_duration: float
+) -> List[Tuple[float, float]]:
+    """
+    Split audio into chunks no longer than max_chunk_duration, cutting in the middle of silences when possible
+    :param duration: total audio duration in seconds
+    :param silences: silent intervals returned by detect_silences
+    :param max_chunk_duration:
+    :return: list of (start, end) chunk boundaries in seconds
+    """
+    cut_candidates = sorted((start + end) / 2 for start, end in silences)
+
+    chunks = []
+    chunk_start = 0.0
+    while duration - chunk_start > max_chunk_duration:
+        limit = chunk_start + max_chunk_duration
+        cuts = [cut for cut in cut_candidates if chunk_start < cut <= limit]
+        # No silence inside the window, cut hard at the limit
+        chunk_end = cuts[-1] if cuts else limit
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+    chunks.append((chunk_start, duration))
+    return chunks
+
+
+@dataclass
+class TimeMap:
+    """
+    Piecewise mapping between preprocessed audio time and original video time.
+    Each piece is (output_start, source_start, source_end), output pieces are contiguous and sorted.
+    """
+    pieces: List[Tuple[float, float, float]] = field(default_factory=list)
+    speed: float = 1.0
+
+    def to_source(self, timestamp: float) -> float:
+        """Convert preprocessed audio timestamp to the original video timestamp"""
+        if not self.pieces:
+            return timestamp * self.speed
+        output_starts = [piece[0] for piece in self.pieces]
+        index = max(bisect.bisect_right(output_starts, timestamp) - 1, 0)
+        output_start, source_start, source_end = self.pieces[index]
+        return min(source_start + (timestamp - output_start) * self.speed, source_end)
+
+    def to_dict(self) -> dict:
+        return {'pieces': self.pieces, 'speed': self.speed}
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(pieces=[tuple(piece) for piece in data['pieces']], speed=data['speed'])
+
+
+def build_time_map(
+        duration: float,
+        silences: List[Tuple[float, float]],
+        padding: float = 0.0,
+        speed: float = 1.0
+) -> TimeMap:
+    """
+    Build time map of the audio parts that remain after silence removal
+    :param duration: original audio duration in seconds
+    :param silences: silent intervals returned by detect_silences
+    :param padding: seconds of silence kept on both sides of the speech
+    :param speed: speed up factor applied after silence removal
+    :return:
+    """
+    kept = []
+    position = 0.0
+    for start, end in sorted(silences):
+        start, end = start + padding, end - padding
+        if end <= start:
+            continue
+        if start > position:
+            kept.append((position, min(start, duration)))
+        position = max(position, end)
+    if position < duration:
+        kept.append((position, duration))
+
+    pieces = []
+    output_position = 0.0
+    for source_start, source_end in kept:
+        pieces.append((output_position, source_start, source_end))
+        output_position += (source_end - source_start) / speed
+    return TimeMap(pieces=pieces, speed=speed)
+
+
+def preprocess_audio(
+        audio_path: Path,
+        output_path: Path,
+        remove_silence: bool = None,
+        speed: float = None
+) -> TimeMap:
+    """
+    Remove silence and speed up the audio to reduce the amount of transcribed audio
+    :param audio_path:
+    :param output_path: path to save processed audio
+    :param remove_silence: defaults to settings.remove_silence
+    :param speed: defaults to settings.audio_speedup
+    :return: time map to convert processed audio timestamps to the original ones
+    """
+    remove_silence = settings.remove_silence if remove_silence is None else remove_silence
+    speed = speed or settings.audio_speedup
+
+    duration = get_audio_duration(audio_path)
+    silences = detect_silences(audio_path) if remove_silence else []
+    time_map = build_time_map(duration, silences, settings.silence_padding, speed)
+
+    stream = ffmpeg.input(str(audio_path)).audio
+    if remove_silence:
+        selection = '+'.join(f'between(t,{start:.3f},{end:.3f})' for _, start, end in time_map.pieces)
+        stream = stream.filter('aselect', selection or '0').filter('asetpts', 'N/SR/TB')
+    # atempo supports factors up to 2.0, chain it for bigger speed ups
+    remaining_speed = speed
+    while remaining_speed > 2.0:
+        stream = stream.filter('atempo', 2.0)
+        remaining_speed /= 2.0
+    if remaining_speed != 1.0:
+        stream = stream.filter('atempo', remaining_speed)
+
+    stream.output(
+        str(output_path),
+        acodec="libmp3lame", ab="32k", ac=1, ar="8k"
+    ).run(quiet=True, overwrite_output=True)
+
+    return time_map
+
+
+def remap_transcription(transcription: dict, time_map: TimeMap) -> dict:
+    """Convert segment timestamps of transcription made on preprocessed audio to original video time"""
+    segments = []
+    for segment in transcription.get('segments') or []:
+        segment = dict(segment)
+        segment['start'] = time_map.to_source(segment['start'])
+        segment['end'] = time_map.to_source(segment['end'])
+        if segment.get('words'):
+            segment['words'] = [
+                {**word, 'start': time_map.to_source(word['start']), 'end': time_map.to_source(word['end'])}
+                for word in segment['words']
+            ]
+        segments.append(segment)
+
+    return {**transcription, 'segments': segments, 'time_map': time_map.to_dict()}
+
+
+def _needs_preprocessing() -> bool:
+    return settings.remove_silence or settings.audio_speedup != 1.0
+
+
+def merge_transcriptions(transcriptions: List[Tuple[float, dict]]) -> dict:
+    """
+    Stitch chunk transcriptions into a single verbose_json transcription
+    :param transcriptions: list of (chunk offset in seconds, chunk transcription)
+    :return: transcription with offset-corrected segments
+    """
+    segments = []
+    texts = []
+    language = None
+    duration = 0.0
+    for offset, transcription in sorted(transcriptions, key=lambda item: item[0]):
+        language = language or transcription.get('language')
+        texts.append(transcription.get('text', '').strip())
+        for segment in transcription.get('segments') or []:
+            segment = dict(segment)
+            segment['id'] = len(segments)
+            segment['start'] = segment['start'] + offset
+            segment['end'] = segment['end'] + offset
+            segments.append(segment)
+        duration = max(duration, offset + float(transcription.get('duration') or 0))
+
+    return {
+        'task': 'transcribe',
+        'language': language,
+        'duration': duration,
+        'text': ' '.join(text for text in texts if text),
+        'segments': segments,
+    }
+
+
+def _transcribe_api(client: OpenAI, audio) -> dict:
+    """
+    :param client:
+    :param audio: path to the audio file or (file name, file content) tuple
+    :return: verbose_json transcription
+    """
+    if isinstance(audio, Path):
+        with open(audio, "rb") as audio_file:
+            return _transcribe_api(client, audio_file)
+
+    transcription = client.audio.transcriptions.create(
+        model=settings.whisper_api_model,
+        file=audio,
+        response_format="verbose_json",
+        timestamp_granularities=["segment"]
+    )
+    return dict(transcription)
+
+
+def transcribe_api_chunked(
+        client: OpenAI,
+        audio_path: Path,
+        temp_dir: Path,
+        max_chunk_duration: float = None,
+        max_workers: int = None
+) -> dict:
+    """
+    Split audio at silences and transcribe chunks concurrently
+    :param client:
+    :param audio_path:
+    :param temp_dir: directory to store chunk files
+    :param max_chunk_duration: max chunk length in seconds
+    :param max_workers: number of concurrent API requests
+    :return: merged verbose_json transcription
+    """
+    max_chunk_duration = max_chunk_duration or settings.whisper_api_chunk_duration
+    max_workers = max_workers or settings.whisper_api_max_workers
+
+    duration = get_audio_duration(audio_path)
+    chunks = split_at_silences(duration, detect_silences(audio_path), max_chunk_duration)
+
+    def transcribe_chunk(index: int, start: float, end: float) -> Tuple[float, dict]:
+        chunk_path = Path(temp_dir, f"chunk_{index:04d}.mp3")
+        ffmpeg.input(str(audio_path), ss=start, t=end - start).output(
+            str(chunk_path),
+            acodec="libmp3lame", ab="32k", ac=1, ar="8k"
+        ).run(quiet=True, overwrite_output=True)
+        return start, _transcribe_api(client, chunk_path)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(transcribe_chunk, i, start, end) for i, (start, end) in enumerate(chunks)]
+        transcriptions = [future.result() for future in futures]
+
+    return merge_transcriptions(transcriptions)
+
+
+def extract_audio(video_path: Path, temp_dir: Path, audio_path: Path = None) -> Path:
+    """
+    Prepare audio file for transcription.
+    If the audio track is already in a codec accepted by the API, it is stream copied without re-encoding,
+    otherwise it is transcoded to low bitrate mp3.
+    :param video_path:
+    :param temp_dir: directory to store extracted audio
+    :param audio_path: separately downloaded audio track, used instead of the video if given
+    :return: path to the audio file
+    """
+    source_path = audio_path or video_path
+    probe = ffmpeg.probe(str(source_path))
+    audio_streams = [stream for stream in probe['streams'] if stream.get('codec_type') == 'audio']
+    codec = audio_streams[0].get('codec_name') if audio_streams else None
+
+    container = API_AUDIO_CONTAINERS.get(codec)
+    bitrate = audio_streams[0].get('bit_rate') or probe['format'].get('bit_rate') if audio_streams else None
+    duration = probe['format'].get('duration')
+    # Without bitrate or duration the size can't be estimated, transcoding keeps the file under the limit
+    estimated_size = int(bitrate) / 8 * float(duration) if bitrate and duration else None
+
+    if container and estimated_size is not None and estimated_size <= API_MAX_FILE_SIZE:
+        # The file is sent as is only if its real format matches its extension,
+        # e.g. older downloads were saved as .wav whatever the codec was
+        extensions = API_AUDIO_FORMATS.get(probe['format'].get('format_name'), set())
+        if audio_path and audio_path.suffix.lower() in extensions and len(probe['streams']) == 1:
+            return audio_path
+        output_path = Path(temp_dir, f"{video_path.stem}.{container}")
+        ffmpeg.input(str(source_path)).output(
+            str(output_path), vn=None, acodec='copy'
+        ).run(quiet=True, overwrite_output=True)
+        return output_path
+
+    output_path = Path(temp_dir, video_path.stem + '.mp3')
+    ffmpeg.input(str(source_path)).output(
+        str(output_path),
+        acodec="libmp3lame", ab="32k", ac=1, ar="8k"
+    ).run(quiet=True, overwrite_output=True)
+    return output_path
+
+
+def _find_cut(samples: np.ndarray, search_samples: int, frame_samples: int) -> int:
+    """Find the quietest frame in the tail of the samples to cut the audio there"""
+    tail_start = max(len(samples) - search_samples, 0)
+    tail = samples[tail_start:]
+    frames = len(tail) // frame_samples
+    if frames == 0:
+        return len(samples)
+    energy = np.abs(tail[:frames * frame_samples].astype(np.float32)).reshape(frames, frame_samples).mean(axis=1)
+    return tail_start + int(np.argmin(energy)) * frame_samples + frame_samples // 2
+
+
+def stream_audio(
+        source_path: Path,
+        chunk_duration: float,
+        sample_rate: int = STREAM_SAMPLE_RATE,
+        cut_search_duration: float = 5.0
+) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    Decode audio with ffmpeg into a pipe and yield chunks as soon as they are decoded.
+    Chunks are cut at the quietest point of their last seconds, nothing is written to disk.
+    :param source_path: video or audio file
+    :param chunk_duration: max chunk length in seconds
+    :param sample_rate:
+    :param cut_search_duration: length of the chunk tail searched for a cut point in seconds
+    :return: iterator of (chunk offset in seconds, 16-bit mono PCM samples)
+    """
+    process = (
+        ffmpeg
+        .input(str(source_path))
+        .output('pipe:', format='s16le', acodec='pcm_s16le', ac=1, ar=sample_rate)
+        .global_args('-nostats', '-loglevel', 'error')
+        .run_async(pipe_stdout=True)
+    )
+
+    chunk_samples = int(chunk_duration * sample_rate)
+    read_size = sample_rate * STREAM_SAMPLE_WIDTH  # one second of audio
+    buffer = np.empty(0, dtype=np.int16)
+    offset = 0
+    pending = b''
+    try:
+        while True:
+            data = process.stdout.read(read_size)
+            if not data:
+                break
+            data = pending + data
+            # keep an odd trailing byte for the next read
+            usable = len(data) - len(data) % STREAM_SAMPLE_WIDTH
+            pending = data[usable:]
+            buffer = np.concatenate([buffer, np.frombuffer(data[:usable], dtype=np.int16)])
+
+            while len(buffer) >= chunk_samples:
+                cut = _find_cut(buffer[:chunk_samples], int(cut_search_duration * sample_rate), sample_rate // 10)
+                yield offset / sample_rate, buffer[:cut]
+                offset += cut
+                buffer = buffer[cut:]
+    finally:
+        process.stdout.close()
+        return_code = process.wait()
+
+    if return_code != 0:
+        raise RuntimeError(f"ffmpeg failed to decode audio: {source_path}")
+    if len(buffer):
+        yield offset / sample_rate, buffer
+
+
+def _prefetch(iterator: Iterator, size: int = 2) -> Iterator:
+    """Run iterator in a background thread so producing next items overlaps with consuming them"""
+    items = queue.Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterator:
+                items.put(item)
+        except Exception as e:
+            items.put(e)
+        items.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = items.get()
+        if item is done:
+            return
+        if isinstance(item, Exception):
+            raise item
+        yield item
+
+
+def _to_wav(samples: np.ndarray, sample_rate: int) -> bytes:
+    with io.BytesIO() as buffer:
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(STREAM_SAMPLE_WIDTH)
+            wav.setframerate(sample_rate)
+            wav.writeframes(samples.tobytes())
+        return buffer.getvalue()
+
+
+def transcribe_api_streamed(
+        client: OpenAI,
+        source_path: Path,
+        max_chunk_duration: float = None,
+        max_workers: int = None
+) -> dict:
+    """
+    Transcribe audio decoded by ffmpeg into a pipe. Each chunk is uploaded as soon as it is decoded,
+    so transcription overlaps with decoding.
+    :param client:
+    :param source_path: video or audio file
+    :param max_chunk_duration: max chunk length in seconds, limited by the API file size
+    :param max_workers: number of concurrent API requests
+    :return: merged verbose_json transcription
+    """
+    max_chunk_duration = min(
+        max_chunk_duration or settings.whisper_api_chunk_duration,
+        API_MAX_FILE_SIZE // (STREAM_SAMPLE_RATE * STREAM_SAMPLE_WIDTH) - 1
+    )
+    max_workers = max_workers or settings.whisper_api_max_workers
+
+    def transcribe_chunk(index: int, offset: float, samples: np.ndarray) -> Tuple[float, dict]:
+        audio_file = (f"chunk_{index:04d}.wav", _to_wav(samples, STREAM_SAMPLE_RATE))
+        return offset, _transcribe_api(client, audio_file)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(transcribe_chunk, i, offset, samples)
+            for i, (offset, samples) in enumerate(stream_audio(source_path, max_chunk_duration))
+        ]
+        transcriptions = [future.result() for future in futures]
+
+    return merge_transcriptions(transcriptions)
+
+
+def transcribe_local_streamed(model, source_path: Path, chunk_duration: float = None) -> dict:
+    """
+    Transcribe audio decoded by ffmpeg into a pipe with a local model,
+    next chunk is decoded while the current one is transcribed.
+    :param model: loaded whisper model
+    :param source_path: video or audio file
+    :param chunk_duration: chunk length in seconds
+    :return: merged transcription
+    """
+    chunk_duration = chunk_duration or settings.whisper_api_chunk_duration
+
+    transcriptions = []
+    for offset, samples in _prefetch(stream_audio(source_path, chunk_duration)):
+        result = model.transcribe(samples.astype(np.float32) / 32768.0)
+        result['duration'] = len(samples) / STREAM_SAMPLE_RATE
+        transcriptions.append((offset, result))
+
+    return merge_transcriptions(transcriptions)
 
 
 def extract_subtitles_api(
         video_path: Path,
         output_path: Path,
-        audio_path: Path = None
+        audio_path: Path = None,
+        chunked: bool = None,
+        streaming: bool = None
 ):
-    """Extract subtitles using OpenAI's Whisper API"""
-    if not video_path.exists():
-        raise FileNotFoundError(f"Video file not found: {video_path}")
+    """
+    Extract subtitles using OpenAI's Whisper API
+    :param video_path:
+    :param output_path:
+    :param audio_path:
+    :param chunked: split audio at silences and transcribe chunks concurrently,
+        defaults to settings.whisper_api_chunked
+    :param streaming: pipe decoded audio straight to the API without intermediate files,
+        defaults to settings.audio_streaming. Silence removal is not applied in this mode
+    :return:
+    """
+    if not (audio_path or video_path).exists():
+        raise FileNotFoundError(f"Video file not found: {audio_path or video_path}")
 
+    chunked = settings.whisper_api_chunked if chunked is None else chunked
+    streaming = settings.audio_streaming if streaming is None else streaming
     client = OpenAI(api_key=settings.OPENAI_API_KEY)
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        if not audio_path:
-            audio_path = Path(temp_dir, video_path.stem + '.mp3')
-            ffmpeg.input(str(video_path)).output(
-                str(audio_path),
-                acodec="libmp3lame", ab="32k", ac=1, ar="8k"
-            ).run(quiet=True, overwrite_output=True)
-        
-        with open(audio_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-                model=settings.whisper_api_model,
-                file=audio_file,
-                response_format="verbose_json",
-                timestamp_granularities=["segment"]
-            )
-
-        with open(output_path, "w", encoding="utf-8") as srt:
-            json.dump(dict(transcription), srt)
+    if streaming:
+        transcription = transcribe_api_streamed(client, audio_path or video_path)
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            audio_path = extract_audio(video_path, Path(temp_dir), audio_path)
+
+            time_map = None
+            if _needs_preprocessing():
+                processed_path = Path(temp_dir, video_path.stem + '_processed.mp3')
+                time_map = preprocess_audio(audio_path, processed_path)
+                audio_path = processed_path
+
+            if chunked:
+                transcription = transcribe_api_chunked(client, audio_path, Path(temp_dir))
+            else:
+                transcription = _transcribe_api(client, audio_path)
+
+            if time_map:
+                transcription = remap_transcription(transcription, time_map)
+
+    with open(output_path, "w", encoding="utf-8") as srt:
+        json.dump(transcription, srt)
 
 
 def extract_subtitles_local(
         video_path: Path,
         output_path: Path,
         model_name: str = "base",
-        audio_path: Path = None
+        audio_path: Path = None,
+        streaming: bool = None
 ):
     """
     Extract subtitles using local Whisper model
@@ -51,39 +628,139 @@ def extract_subtitles_local(
     :param output_path:
     :param model_name:
     :param audio_path:
+    :param streaming: decode audio into memory chunk by chunk while transcribing,
+        defaults to settings.audio_streaming. Silence removal is not applied in this mode
+    :return:
+    """
+    if not (audio_path or video_path).exists():
+        raise FileNotFoundError(f"Video file not found: {audio_path or video_path}")
+
+    streaming = settings.audio_streaming if streaming is None else streaming
+
+    # Reuse the model resident in this process
+    model = WhisperModelPool().get(model_name)
+
+    if streaming:
+        result = transcribe_local_streamed(model, audio_path or video_path)
+    else:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            if not audio_path:
+                audio_path = Path(temp_dir, video_path.stem + '.mp3')
+                ffmpeg.input(str(video_path)).output(
+                    str(audio_path),
+                    acodec="libmp3lame", ab="32k", ac=1, ar="8k"
+                ).run(quiet=True, overwrite_output=True)
+
+            time_map = None
+            if _needs_preprocessing():
+                processed_path = Path(temp_dir, video_path.stem + '_processed.mp3')
+                time_map = preprocess_audio(audio_path, processed_path)
+                audio_path = processed_path
+
+            # Perform transcription
+            result = model.transcribe(str(audio_path))
+
+            if time_map:
+                result = remap_transcription(result, time_map)
+
+    with open(output_path, "w", encoding="utf-8") as srt:
+        json.dump(result, srt)
+
+
+def captions_to_transcription(captions: dict) -> dict:
+    """Convert YouTube caption entries to the whisper verbose_json format"""
+    segments = []
+    for entry in captions['entries']:
+        text = entry['text'].replace('\n', ' ').strip()
+        if not text:
+            continue
+        segments.append({
+            'id': len(segments),
+            'start': entry['start'],
+            'end': entry['start'] + entry['duration'],
+            'text': ' ' + text,
+        })
+
+    return {
+        'task': 'transcribe',
+        'language': captions['language'],
+        'duration': segments[-1]['end'] if segments else 0.0,
+        'text': ''.join(segment['text'] for segment in segments).strip(),
+        'segments': segments,
+        'is_generated': captions['is_generated'],
+    }
+
+
+def is_low_quality(transcription: dict, duration: float = None) -> bool:
+    """
+    Check if captions are good enough to be used instead of whisper transcription
+    :param transcription: transcription created by captions_to_transcription
+    :param duration: video duration in seconds, coverage is not checked if not given
     :return:
     """
-    if not video_path.exists():
-        raise FileNotFoundError(f"Video file not found: {video_path}")
+    segments = transcription['segments']
+    if not segments:
+        return True
 
-    # Load the Whisper model
-    model = whisper.load_model(model_name)
+    noise = sum(1 for segment in segments if CAPTION_NOISE_RE.match(segment['text']))
+    if noise / len(segments) > settings.captions_max_noise_ratio:
+        return True
 
-    with tempfile.TemporaryDirectory() as temp_dir:
-        if not audio_path:
-            audio_path = Path(temp_dir, video_path.stem + '.mp3')
-            ffmpeg.input(str(video_path)).output(
-                str(audio_path),
-                acodec="libmp3lame", ab="32k", ac=1, ar="8k"
-            ).run(quiet=True, overwrite_output=True)
-        
-        # Perform transcription
-        result = model.transcribe(str(audio_path))
+    if duration:
+        covered = sum(segment['end'] - segment['start'] for segment in segments)
+        if covered / duration < settings.captions_min_coverage:
+            return True
+    return False
 
-        with open(output_path, "w", encoding="utf-8") as srt:
-            json.dump(result, srt)
+
+def extract_subtitles_youtube(video_url: str, output_path: Path, duration: float = None) -> bool:
+    """
+    Save existing YouTube captions in the whisper verbose_json format
+    :param video_url:
+    :param output_path:
+    :param duration: video duration in seconds, used for the quality check
+    :return: True if captions were found and are good enough, False otherwise
+    """
+    captions = fetch_captions(
+        video_url,
+        allow_generated=settings.captions_allow_generated,
+        languages=settings.captions_languages
+    )
+    if captions is None:
+        return False
+
+    transcription = captions_to_transcription(captions)
+    if is_low_quality(transcription, duration):
+        return False
+
+    with open(output_path, "w", encoding="utf-8") as srt:
+        json.dump(transcription, srt)
+    return True
 
 
 def extract_subtitles(
         video_path: Path,
         output_path: Path,
-        audio_path: Path = None
-):
-    """Main function to extract subtitles using either API or local model based on settings"""
+        audio_path: Path = None,
+        video_url: str = None
+) -> SubtitlesSource:
+    """
+    Main function to extract subtitles.
+    Existing YouTube captions are used if available, otherwise either API or local model based on settings
+    :return: source of the subtitles
+    """
+    if video_url and settings.use_youtube_captions:
+        media_path = audio_path or video_path
+        duration = get_audio_duration(media_path) if media_path.exists() else None
+        if extract_subtitles_youtube(video_url, output_path, duration):
+            return SubtitlesSource.youtube_captions
+
     if settings.whisper_use_api:
-        return extract_subtitles_api(video_path, output_path, audio_path)
+        extract_subtitles_api(video_path, output_path, audio_path)
+        return SubtitlesSource.whisper_api
     else:
-        return extract_subtitles_local(video_path, output_path, settings.whisper_model, audio_path)
+        extract_subtitles_local(video_path, output_path, settings.whisper_model, audio_path)
+        return SubtitlesSource.whisper_local
 
 
 def write_srt(transcript: Iterator[dict], file: TextIO):
@@ -1,5 +1,6 @@
+import asyncio
 from core.settings import settings
-from telegram import Update, BotCommand
+from telegram import Update, BotCommand, InputMediaDocument
 from telegram.ext import (
     Application,
     ContextTypes,
@@ -7,8 +8,7 @@ from telegram.ext import (
     CommandHandler,
     filters,
 )
-from typing import Union
-from pathlib import Path
+from typing import Union, Tuple, List
 import openai
 # from langfuse.openai import openai
 # from langfuse.decorators import observe
@@ -17,8 +17,12 @@ from db.models_crud import AgentCRUD, ActiveAgentCRUD, ChatCRUD, AgentAccessCRUD
 from agent_manager import AgentManager
 from rag.langchain_agent import LangChanAgent
 from celery_app import process_youtube_video
+from integrations.screenshots import screenshot_error
 from integrations.messenger_sender import TelegramMessageSender
 
+# Max items of a telegram media group
+MEDIA_GROUP_SIZE = 10
+
 # Conversation history dictionary
 conversation_history = defaultdict(lambda: deque(maxlen=10))
 
@@ -37,7 +41,8 @@ async def retrieve_active_agent(update: Update) -> Union[None, LangChanAgent]:
         await update.message.reply_text("No video is currently selected. Please select a video first.")
         return
 
-    agent = AgentManager().get(active_agent.agent_id)
+    # Loading an agent reads its index from disk, keep the event loop free meanwhile
+    agent = await asyncio.to_thread(AgentManager().get, active_agent.agent_id)
     return agent
 
 
@@ -50,7 +55,7 @@ async def answer(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     question = update.message.text
 
-    reply = agent.answer(question, conversation_history[update.message.chat_id])
+    reply = await agent.aanswer(question, conversation_history[update.message.chat_id])
 
     conversation_history[update.message.chat_id].append({'question': question, 'answer': reply})
 
@@ -62,12 +67,17 @@ async def get_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if agent is None:
         return
 
-    description = context.args[0]
+    description = ' '.join(context.args).strip()
     if not description:
         await update.message.reply_text("Please provide Screenshot description")
         return
 
-    image_bytes, image_name, readable_timestamp = agent.get_image(update.message.text)
+    try:
+        image_bytes, image_name, readable_timestamp = await agent.aget_image(description)
+    except ValueError as e:
+        await update.message.reply_text(screenshot_error(e))
+        return
+
     await update.message.reply_document(
         document=image_bytes,
         write_timeout=500,
@@ -77,6 +87,71 @@ async def get_screenshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def get_screenshots(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Several screenshots in one request: /screenshots <description or timestamp>; <...>; format=jpeg; width=640
+    """
+    agent = await retrieve_active_agent(update)
+    if agent is None:
+        return
+
+    requests, options = parse_screenshot_requests(update.message.text.partition(' ')[2])
+    if not requests:
+        await update.message.reply_text("Please provide Screenshot descriptions separated by ';'")
+        return
+    if len(requests) > settings.max_screenshots:
+        await update.message.reply_text(f"Maximum {settings.max_screenshots} screenshots per request")
+        return
+
+    try:
+        images = await agent.aget_images(requests, options.get('format'), options.get('width'))
+    except ValueError as e:
+        await update.message.reply_text(screenshot_error(e))
+        return
+
+    # A media group holds 2 to 10 items, a single image is sent as a document
+    for start in range(0, len(images), MEDIA_GROUP_SIZE):
+        group = images[start:start + MEDIA_GROUP_SIZE]
+        if len(group) == 1:
+            image_bytes, image_name, readable_timestamp = group[0]
+            await update.message.reply_document(
+                document=image_bytes,
+                write_timeout=500,
+                filename=image_name,
+                reply_to_message_id=update.message.id,
+                caption=f"Timestamp: {readable_timestamp}"
+            )
+            continue
+        await update.message.reply_media_group(
+            media=[
+                InputMediaDocument(media=image_bytes, filename=image_name, caption=f"Timestamp: {readable_timestamp}")
+                for image_bytes, image_name, readable_timestamp in group
+            ],
+            write_timeout=500,
+            reply_to_message_id=update.message.id
+        )
+
+
+def parse_screenshot_requests(text: str) -> Tuple[List[str], dict]:
+    """
+    Split screenshot requests separated by ';', format=<png|jpeg|webp> and width=<pixels> items are options
+    :param text:
+    :return: requests, options
+    """
+    requests, options = [], {}
+    for item in (item.strip() for item in text.split(';')):
+        if not item:
+            continue
+        key, _, value = item.partition('=')
+        if key == 'format' and value:
+            options['format'] = value.lower()
+        elif key == 'width' and value.isdigit():
+            options['width'] = int(value)
+        else:
+            requests.append(item)
+    return requests, options
+
+
 async def get_agents(update: Update, context: ContextTypes.DEFAULT_TYPE):
     accessible_agents = AgentAccessCRUD().get_chat_accessible_agents(update.message.chat_id)
     agents = AgentCRUD().get_list()
@@ -125,6 +200,8 @@ async def activate_agent(update: Update, context: ContextTypes.DEFAULT_TYPE):
     active_agent = ActiveAgentCRUD().activate_agent(chat.id, agent.id)
 
     if active_agent:
+        # Agents are loaded lazily, start loading while the user types the first question
+        AgentManager().prefetch(agent.id)
         await update.message.reply_text(f"Video {agent_name} Selected.")
     else:
         await update.message.reply_text(f"Error activating video {agent_name}.")
@@ -135,8 +212,8 @@ async def create_story_map(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if agent is None:
         return
 
-    story_map = agent.create_user_story_map()
-    story_map = agent.apply_telegram_formating(story_map)[:4096]
+    story_map = await agent.acreate_user_story_map()
+    story_map = (await agent.aapply_telegram_formating(story_map))[:4096]
     await update.message.reply_text(story_map, parse_mode="HTML")
 
 
@@ -155,26 +232,27 @@ async def post_init(application: Application):
         BotCommand("/select", "Select a video for analysis"),
         BotCommand("/selected", "Get selected for analysis video"),
         BotCommand("/screenshot", "Get screenshot of the video"),
+        BotCommand("/screenshots", "Get several screenshots, separated by ';'"),
         BotCommand("/story_map", "Create a user story map for selected video"),
         BotCommand("/add_video", "Adds a video")
 
     ])
-    load_agents()
-
-
-def load_agents():
-    agents = AgentCRUD().get_list()
-    for agent in agents:
-        AgentManager().add(agent.id, LangChanAgent.load(Path(agent.agent_dir)))
 
 
 def main():
-    application = Application.builder().token(settings.telegram_bot_token).post_init(post_init).build()
+    application = (
+        Application.builder()
+        .token(settings.telegram_bot_token)
+        .concurrent_updates(settings.telegram_concurrent_updates)
+        .post_init(post_init)
+        .build()
+    )
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, answer))
     application.add_handler(CommandHandler("videos", get_agents, has_args=False))
     application.add_handler(CommandHandler("select", activate_agent, has_args=True))
     application.add_handler(CommandHandler("selected", get_active_agent, has_args=False))
     application.add_handler(CommandHandler("screenshot", get_screenshot, has_args=True))
+    application.add_handler(CommandHandler("screenshots", get_screenshots, has_args=True))
     application.add_handler(CommandHandler("story_map", create_story_map, has_args=False))
     application.add_handler(CommandHandler("add_video", add_video, has_args=True))
     application.run_polling()
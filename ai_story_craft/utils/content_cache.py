@@ -0,0 +1,139 @@
+"""Content-addressed cache of ingestion artifacts."""
+import os
+import json
+import shutil
+import threading
+from pathlib import Path
+from typing import Callable
+from core.settings import settings
+from utils.singleton import Singleton
+
+
+class ContentCache(metaclass=Singleton):
+    """
+    Content-addressed cache of ingestion artifacts (subtitles, vector stores), keyed by audio fingerprint.
+    Every key has its own directory, least recently used keys are evicted when the cache exceeds max_size bytes.
+    """
+
+    access_file: str = '.last_access'
+    meta_file: str = 'meta.json'
+
+    def __init__(self, directory: Path = None, max_size: int = None):
+        self.directory = Path(directory or settings.content_cache_directory or
+                              Path(settings.working_directory) / 'cache')
+        self.max_size = max_size or settings.content_cache_max_size
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.directory / key
+
+    def _touch(self, key: str):
+        (self._entry_dir(key) / self.access_file).touch()
+
+    def get(self, key: str, name: str) -> Path | None:
+        """
+        Get cached file or directory
+        :param key: content key
+        :param name: artifact name
+        :return: path to the cached artifact, None if not cached
+        """
+        path = self._entry_dir(key) / name
+        if not path.exists():
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(key)
+        return path
+
+    def put(self, key: str, name: str, source: Path) -> Path:
+        """
+        Copy file or directory into the cache
+        :param key: content key
+        :param name: artifact name
+        :param source: file or directory to copy
+        :return: path to the cached artifact
+        """
+        entry_dir = self._entry_dir(key)
+        entry_dir.mkdir(parents=True, exist_ok=True)
+        path = entry_dir / name
+        temp_path = entry_dir / f'.{name}.tmp'
+
+        if temp_path.exists():
+            shutil.rmtree(temp_path) if temp_path.is_dir() else temp_path.unlink()
+        if source.is_dir():
+            shutil.copytree(source, temp_path)
+        else:
+            shutil.copy2(source, temp_path)
+        # Readers never see partially copied artifacts
+        if path.is_dir():
+            shutil.rmtree(path)
+        os.replace(temp_path, path)
+
+        self._touch(key)
+        self.evict()
+        return path
+
+    def get_meta(self, key: str) -> dict:
+        meta_path = self._entry_dir(key) / self.meta_file
+        if not meta_path.exists():
+            return {}
+        with open(meta_path, 'r') as f:
+            return json.load(f)
+
+    def put_meta(self, key: str, **kwargs):
+        self._entry_dir(key).mkdir(parents=True, exist_ok=True)
+        meta = {**self.get_meta(key), **kwargs}
+        with open(self._entry_dir(key) / self.meta_file, 'w') as f:
+            json.dump(meta, f)
+
+    def find(self, predicate: Callable[[dict], bool]) -> str | None:
+        """
+        Find an entry by its metadata
+        :param predicate: called with the metadata of every entry
+        :return: key of the most recently used matching entry, None if no entry matches
+        """
+        if not self.directory.exists():
+            return None
+        entries = []
+        for entry_dir in self.directory.iterdir():
+            access_path = entry_dir / self.access_file
+            if entry_dir.is_dir() and (entry_dir / self.meta_file).exists():
+                entries.append((access_path.stat().st_mtime if access_path.exists() else 0, entry_dir.name))
+        for _, key in sorted(entries, reverse=True):
+            if predicate(self.get_meta(key)):
+                return key
+        return None
+
+    @staticmethod
+    def _size(path: Path) -> int:
+        return sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits into max_size"""
+        with self.lock:
+            if not self.directory.exists():
+                return
+            entries = []
+            for entry_dir in self.directory.iterdir():
+                if not entry_dir.is_dir():
+                    continue
+                access_path = entry_dir / self.access_file
+                last_access = access_path.stat().st_mtime if access_path.exists() else 0
+                entries.append((last_access, entry_dir, self._size(entry_dir)))
+
+            total_size = sum(size for _, _, size in entries)
+            for _, entry_dir, size in sorted(entries, key=lambda entry: entry[0]):
+                if total_size <= self.max_size:
+                    break
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                total_size -= size
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,132 @@
+"""Shared LRU cache of extracted video frames."""
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Tuple
+from core.settings import settings
+from utils.singleton import Singleton
+
+# (video hash, quantized timestamp, image format, max width)
+FrameKey = Tuple[str, float, str, int]
+
+
+class FrameCache(metaclass=Singleton):
+    """
+    Byte-size bounded LRU cache of video frames shared by all agents of the process.
+    Frames evicted from memory are spilled to disk if a spill directory is given,
+    spilled files are bounded by disk_max_size and removed in LRU order as well.
+    Files spilled before a restart are indexed by modification time on first use of their spill directory.
+    """
+
+    def __init__(self, max_size: int = None, disk_max_size: int = None, quantum: float = None):
+        self.max_size = settings.frame_cache_max_size if max_size is None else max_size
+        self.disk_max_size = settings.frame_cache_disk_max_size if disk_max_size is None else disk_max_size
+        self.quantum = quantum or settings.frame_cache_quantum
+
+        self.frames: OrderedDict[FrameKey, Tuple[bytes, Path | None]] = OrderedDict()
+        self.spilled: OrderedDict[Path, int] = OrderedDict()
+        self.indexed_spill_dirs: set[Path] = set()
+        self.size = 0
+        self.disk_size = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def quantize(self, timestamp: float) -> float:
+        """Round timestamp, so requests for nearly the same moment share the frame"""
+        return round(round(timestamp / self.quantum) * self.quantum, 3)
+
+    def key(self, video_hash: str, timestamp: float, image_format: str, max_width: int) -> FrameKey:
+        return video_hash, self.quantize(timestamp), image_format, max_width or 0
+
+    @staticmethod
+    def _spill_path(key: FrameKey, spill_dir: Path) -> Path:
+        video_hash, timestamp, image_format, max_width = key
+        return spill_dir / f"{video_hash}_{timestamp:.3f}_{max_width}.{image_format}"
+
+    def get(self, key: FrameKey, spill_dir: Path = None) -> bytes | None:
+        with self.lock:
+            if key in self.frames:
+                self.frames.move_to_end(key)
+                self.hits += 1
+                return self.frames[key][0]
+
+            if spill_dir:
+                self._index_spill_dir(spill_dir)
+            spill_path = self._spill_path(key, spill_dir) if spill_dir else None
+            if spill_path and spill_path in self.spilled and spill_path.exists():
+                image_bytes = spill_path.read_bytes()
+                self._remove_spilled(spill_path)
+                spill_path.unlink(missing_ok=True)
+                self._put(key, image_bytes, spill_dir)
+                self.disk_hits += 1
+                return image_bytes
+
+            self.misses += 1
+            return None
+
+    def put(self, key: FrameKey, image_bytes: bytes, spill_dir: Path = None):
+        with self.lock:
+            if key in self.frames:
+                self.size -= len(self.frames.pop(key)[0])
+            self._put(key, image_bytes, spill_dir)
+
+    def _put(self, key: FrameKey, image_bytes: bytes, spill_dir: Path | None):
+        if len(image_bytes) > self.max_size:
+            return
+        self.frames[key] = (image_bytes, spill_dir)
+        self.size += len(image_bytes)
+        while self.size > self.max_size:
+            evicted_key, (evicted_bytes, evicted_spill_dir) = self.frames.popitem(last=False)
+            self.size -= len(evicted_bytes)
+            if evicted_spill_dir and self.disk_max_size:
+                self._index_spill_dir(evicted_spill_dir)
+                self._spill(self._spill_path(evicted_key, evicted_spill_dir), evicted_bytes)
+
+    def _spill(self, spill_path: Path, image_bytes: bytes):
+        spill_path.parent.mkdir(parents=True, exist_ok=True)
+        spill_path.write_bytes(image_bytes)
+        if spill_path in self.spilled:
+            self.disk_size -= self.spilled.pop(spill_path)
+        self.spilled[spill_path] = len(image_bytes)
+        self.disk_size += len(image_bytes)
+        self._trim_spilled()
+
+    def _index_spill_dir(self, spill_dir: Path):
+        """Add files spilled by previous runs, otherwise they are never read nor removed"""
+        if spill_dir in self.indexed_spill_dirs:
+            return
+        self.indexed_spill_dirs.add(spill_dir)
+        if not spill_dir.is_dir():
+            return
+        files = [(path, path.stat()) for path in spill_dir.iterdir() if path.is_file()]
+        # Files of previous runs are older than the ones spilled by this run, they are evicted first
+        for path, stat in sorted(files, key=lambda item: item[1].st_mtime, reverse=True):
+            self.spilled[path] = stat.st_size
+            self.spilled.move_to_end(path, last=False)
+            self.disk_size += stat.st_size
+        self._trim_spilled()
+
+    def _trim_spilled(self):
+        while self.disk_size > self.disk_max_size and self.spilled:
+            oldest_path = next(iter(self.spilled))
+            self._remove_spilled(oldest_path)
+            oldest_path.unlink(missing_ok=True)
+
+    def _remove_spilled(self, spill_path: Path):
+        self.disk_size -= self.spilled.pop(spill_path)
+
+    def stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / total if total else 0.0,
+                'frames': len(self.frames),
+                'size': self.size,
+                'disk_size': self.disk_size,
+            }
@@ -0,0 +1,97 @@
+"""Distributed single-flight lock."""
+import json
+import redis
+import threading
+from contextlib import contextmanager
+from typing import List
+from core.settings import settings
+
+
+class SingleFlight:
+    """
+    Redis backed single-flight lock.
+    The first caller acquires the lock and does the work, later callers for the same key are attached
+    as subscribers and receive the progress and the result of the running job.
+    Acquiring and finishing are atomic, so a subscriber can't be attached to a job which has already finished.
+    """
+
+    # KEYS[1] - lock key, KEYS[2] - subscribers key, ARGV[1] - owner, ARGV[2] - ttl, ARGV[3] - subscriber
+    _join_script = """
+        if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'EX', ARGV[2]) then
+            return 1
+        end
+        redis.call('RPUSH', KEYS[2], ARGV[3])
+        redis.call('EXPIRE', KEYS[2], ARGV[2])
+        return 0
+    """
+    # KEYS[1] - lock key, KEYS[2] - subscribers key
+    _finish_script = """
+        local subscribers = redis.call('LRANGE', KEYS[2], 0, -1)
+        redis.call('DEL', KEYS[1], KEYS[2])
+        return subscribers
+    """
+
+    def __init__(self, client: redis.Redis = None, prefix: str = 'single_flight', ttl: int = None):
+        self.client = client or redis.Redis.from_url(settings.REDIS_URL)
+        self.prefix = prefix
+        self.ttl = ttl or settings.single_flight_ttl
+        self._join = self.client.register_script(self._join_script)
+        self._finish = self.client.register_script(self._finish_script)
+
+    def _lock_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}:lock"
+
+    def _subscribers_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}:subscribers"
+
+    def join(self, key: str, owner: str, subscriber: dict) -> bool:
+        """
+        Acquire the lock or attach to the running job
+        :param key: job key
+        :param owner: id of the lock owner
+        :param subscriber: data stored for the subscriber if the lock is already taken
+        :return: True if the lock was acquired and the caller should do the work
+        """
+        return bool(self._join(
+            keys=[self._lock_key(key), self._subscribers_key(key)],
+            args=[owner, self.ttl, json.dumps(subscriber)]
+        ))
+
+    def refresh(self, key: str):
+        """Extend the lock ttl for long running jobs"""
+        self.client.expire(self._lock_key(key), self.ttl)
+        self.client.expire(self._subscribers_key(key), self.ttl)
+
+    def is_locked(self, key: str) -> bool:
+        """Check if a job holds the lock, the lock of a crashed job expires after ttl"""
+        return bool(self.client.exists(self._lock_key(key)))
+
+    @contextmanager
+    def heartbeat(self, key: str):
+        """Keep refreshing the lock ttl while the block runs, so a short ttl detects crashed jobs early"""
+        stopped = threading.Event()
+
+        def refresh():
+            while not stopped.wait(self.ttl / 3):
+                self.refresh(key)
+
+        thread = threading.Thread(target=refresh, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stopped.set()
+            thread.join()
+
+    def subscribers(self, key: str) -> List[dict]:
+        """Subscribers attached to the running job"""
+        return [json.loads(item) for item in self.client.lrange(self._subscribers_key(key), 0, -1)]
+
+    def finish(self, key: str) -> List[dict]:
+        """
+        Release the lock
+        :param key:
+        :return: subscribers attached to the job
+        """
+        subscribers = self._finish(keys=[self._lock_key(key), self._subscribers_key(key)])
+        return [json.loads(item) for item in subscribers]
@@ -1,4 +1,5 @@
 """Singleton meta-class."""
+from abc import ABCMeta
 
 
 class Singleton(type):
@@ -14,3 +15,7 @@ class Singleton(type):
     def clear(cls):
         """Clear singleton instances."""
         cls._instances = {}
+
+
+class AbstractSingleton(Singleton, ABCMeta):
+    """Singleton meta-class for implementations of abstract base classes."""
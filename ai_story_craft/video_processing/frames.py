@@ -0,0 +1,143 @@
+import asyncio
+import ffmpeg
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import List
+
+# image format -> (file extension, ffmpeg encoder options)
+IMAGE_FORMATS = {
+    'png': ('png', {'vcodec': 'png'}),
+    'jpeg': ('jpg', {'vcodec': 'mjpeg', 'q:v': 3}),
+    'webp': ('webp', {'vcodec': 'libwebp', 'quality': 80}),
+}
+
+
+def image_extension(image_format: str) -> str:
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(f"Unsupported image format: {image_format}. Use one of {', '.join(IMAGE_FORMATS)}")
+    return IMAGE_FORMATS[image_format][0]
+
+
+@lru_cache(maxsize=256)
+def _probe_duration(video_path: str, mtime: float) -> float:
+    return float(ffmpeg.probe(video_path)['format']['duration'])
+
+
+def video_duration(video_path: Path) -> float:
+    """Duration in seconds, probed once per file version"""
+    return _probe_duration(str(video_path), video_path.stat().st_mtime)
+
+
+def check_timestamps(video_path: Path, timestamps: List[float]):
+    """
+    Raise ValueError for timestamps ffmpeg can't take a frame at
+    :param video_path:
+    :param timestamps: seconds
+    :return:
+    """
+    duration = video_duration(video_path)
+    for timestamp in timestamps:
+        if timestamp < 0 or timestamp >= duration:
+            raise ValueError(
+                f"Timestamp {int(timestamp) // 60:02d}:{int(timestamp) % 60:02d} is outside of the video, "
+                f"it is {int(duration) // 60:02d}:{int(duration) % 60:02d} long"
+            )
+
+
+def build_frames_command(
+        video_path: Path,
+        timestamps: List[float],
+        output_pattern: str,
+        image_format: str = 'png',
+        max_width: int = 0
+):
+    """
+    Build ffmpeg command extracting frames at all timestamps in one process.
+    Every timestamp is a separate input with fast seek, one frame is taken from each of them
+    and all frames are written by a single encoder
+    :param video_path:
+    :param timestamps: seconds
+    :param output_pattern: output file pattern, e.g. /tmp/%03d.png
+    :param image_format: png, jpeg or webp
+    :param max_width: downscale frames wider than max_width, 0 to keep the original size
+    :return: ffmpeg-python output stream
+    """
+    image_extension(image_format)
+    frames = [
+        ffmpeg.input(str(video_path), ss=timestamp).video.trim(end_frame=1).setpts('PTS-STARTPTS')
+        for timestamp in timestamps
+    ]
+    stream = ffmpeg.concat(*frames, v=1, a=0) if len(frames) > 1 else frames[0]
+    if max_width:
+        stream = stream.filter('scale', f'min(iw,{max_width})', -2)
+
+    return stream.output(output_pattern, vsync='passthrough', **IMAGE_FORMATS[image_format][1])
+
+
+def extract_frames(
+        video_path: Path,
+        timestamps: List[float],
+        image_format: str = 'png',
+        max_width: int = 0
+) -> List[bytes]:
+    """
+    Extract frames at the timestamps with a single ffmpeg invocation
+    :param video_path:
+    :param timestamps: seconds
+    :param image_format: png, jpeg or webp
+    :param max_width: downscale frames wider than max_width, 0 to keep the original size
+    :return: images in the order of timestamps
+    """
+    if not timestamps:
+        return []
+
+    extension = image_extension(image_format)
+    check_timestamps(video_path, timestamps)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_pattern = str(Path(temp_dir, f'%03d.{extension}'))
+        build_frames_command(video_path, timestamps, output_pattern, image_format, max_width).run(
+            quiet=True, overwrite_output=True
+        )
+        return _read_frames(temp_dir, extension, len(timestamps))
+
+
+async def aextract_frames(
+        video_path: Path,
+        timestamps: List[float],
+        image_format: str = 'png',
+        max_width: int = 0
+) -> List[bytes]:
+    """
+    Extract frames at the timestamps with a single ffmpeg subprocess, the event loop is not blocked while it runs
+    :param video_path:
+    :param timestamps: seconds
+    :param image_format: png, jpeg or webp
+    :param max_width: downscale frames wider than max_width, 0 to keep the original size
+    :return: images in the order of timestamps
+    """
+    if not timestamps:
+        return []
+
+    extension = image_extension(image_format)
+    await asyncio.to_thread(check_timestamps, video_path, timestamps)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_pattern = str(Path(temp_dir, f'%03d.{extension}'))
+        command = build_frames_command(
+            video_path, timestamps, output_pattern, image_format, max_width
+        ).overwrite_output().compile()
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            raise ffmpeg.Error('ffmpeg', None, stderr)
+        return _read_frames(temp_dir, extension, len(timestamps))
+
+
+def _read_frames(directory: str, extension: str, count: int) -> List[bytes]:
+    paths = [Path(directory, f'{i:03d}.{extension}') for i in range(1, count + 1)]
+    # ffmpeg writes fewer frames if it could not decode a frame at some timestamp, e.g. at the very end
+    if not all(path.exists() for path in paths):
+        raise ValueError("Unable to extract frames at some of the requested timestamps")
+    return [path.read_bytes() for path in paths]
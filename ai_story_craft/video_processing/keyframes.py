@@ -0,0 +1,103 @@
+import re
+import json
+import bisect
+import ffmpeg
+import shutil
+from pathlib import Path
+from typing import List, Tuple
+
+PTS_TIME_RE = re.compile(r"\bn:\s*\d+.*?pts_time:(\d+(?:\.\d+)?)")
+
+
+def extract_keyframes(
+        video_path: Path,
+        output_dir: Path,
+        scene_threshold: float,
+        max_interval: float,
+        extension: str = 'png'
+) -> List[float]:
+    """
+    Extract frames at scene changes in one decoder pass and save them with the timestamp index.
+    A frame is also taken if there was no scene change for max_interval seconds.
+    :param video_path:
+    :param output_dir: directory for frames and index, replaced if exists
+    :param scene_threshold: scene change score in range 0-1
+    :param max_interval: max seconds between extracted frames
+    :param extension: frame image format
+    :return: sorted frame timestamps
+    """
+    temp_dir = output_dir.with_name(output_dir.name + '.tmp')
+    if temp_dir.exists():
+        shutil.rmtree(temp_dir)
+    temp_dir.mkdir(parents=True)
+
+    select = f'gt(scene,{scene_threshold})+isnan(prev_selected_t)+gte(t-prev_selected_t,{max_interval})'
+    _, stderr = (
+        ffmpeg
+        .input(str(video_path))
+        .video
+        .filter('select', select)
+        .filter('showinfo')
+        .output(str(temp_dir / f'%06d.{extension}'), vsync='vfr')
+        .run(capture_stderr=True, overwrite_output=True)
+    )
+    timestamps = [float(value) for value in PTS_TIME_RE.findall(stderr.decode('utf-8', errors='ignore'))]
+
+    frames = []
+    for i, timestamp in enumerate(timestamps, start=1):
+        frame_name = f'{i:06d}.{extension}'
+        if (temp_dir / frame_name).exists():
+            frames.append({'timestamp': timestamp, 'file': frame_name})
+
+    with open(temp_dir / KeyframeIndex.index_file, 'w') as f:
+        json.dump(sorted(frames, key=lambda frame: frame['timestamp']), f)
+
+    # Swap the whole directory, so agents never read a partially written index
+    if output_dir.exists():
+        shutil.rmtree(output_dir)
+    temp_dir.rename(output_dir)
+    return [frame['timestamp'] for frame in frames]
+
+
+class KeyframeIndex:
+    """
+    Sorted timestamp index of extracted keyframes.
+    The index is reloaded when the file changes, so agents loaded before the extraction pick it up.
+    """
+
+    index_file: str = 'index.json'
+
+    def __init__(self, directory: Path):
+        self.directory = directory
+        self.timestamps: List[float] = []
+        self.files: List[str] = []
+        self._mtime = None
+
+    def _reload(self):
+        index_path = self.directory / self.index_file
+        if not index_path.exists():
+            self.timestamps, self.files, self._mtime = [], [], None
+            return
+        mtime = index_path.stat().st_mtime
+        if mtime == self._mtime:
+            return
+        with open(index_path, 'r') as f:
+            frames = json.load(f)
+        self.timestamps = [frame['timestamp'] for frame in frames]
+        self.files = [frame['file'] for frame in frames]
+        self._mtime = mtime
+
+    def find(self, timestamp: float, max_distance: float) -> Tuple[Path, float] | None:
+        """
+        Find keyframe showing the video at the timestamp.
+        The last keyframe before the timestamp is taken, as it starts the current scene
+        :param timestamp: seconds
+        :param max_distance: max seconds between the timestamp and the keyframe
+        :return: path to the frame and its timestamp, None if there is no keyframe close enough
+        """
+        self._reload()
+        index = bisect.bisect_right(self.timestamps, timestamp) - 1
+        if index < 0 or timestamp - self.timestamps[index] > max_distance:
+            return None
+        path = self.directory / self.files[index]
+        return (path, self.timestamps[index]) if path.exists() else None
@@ -0,0 +1,44 @@
+import ffmpeg
+from pathlib import Path
+
+
+def get_proxy_path(video_path: Path) -> Path:
+    """Path of the low resolution proxy for the given video"""
+    return video_path.with_name(f"{video_path.stem}_proxy.mp4")
+
+
+def create_proxy(
+        video_path: Path,
+        proxy_path: Path,
+        resolution: int,
+        keyframe_interval: float
+) -> Path:
+    """
+    Create low resolution copy of the video with frequent keyframes,
+    seeking in it requires decoding only a few small frames.
+    :param video_path:
+    :param proxy_path: path to save the proxy
+    :param resolution: proxy height in pixels
+    :param keyframe_interval: seconds between keyframes
+    :return: proxy path
+    """
+    temp_path = proxy_path.with_name(f"{proxy_path.stem}.tmp{proxy_path.suffix}")
+    (
+        ffmpeg
+        .input(str(video_path))
+        .video
+        # never upscale, width is kept even as required by libx264
+        .filter('scale', -2, f'min({resolution},ih)')
+        .output(
+            str(temp_path),
+            vcodec='libx264',
+            preset='veryfast',
+            crf=28,
+            force_key_frames=f'expr:gte(t,n_forced*{keyframe_interval})',
+            movflags='+faststart',
+        )
+        .run(quiet=True, overwrite_output=True)
+    )
+    # Rename only finished proxy, so a partially encoded file is never used for screenshots
+    temp_path.replace(proxy_path)
+    return proxy_path
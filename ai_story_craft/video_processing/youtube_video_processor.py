@@ -1,61 +1,216 @@
+import time
+import uuid
 import hashlib
 from pytubefix import YouTube
 from pathlib import Path
 from core.settings import settings
-from urllib.parse import parse_qs, urlparse
-from integrations.youtube import download_video, download_audio
+from integrations.youtube import download_video, download_audio, get_video_id, canonical_url
+from integrations.range_downloader import ProgressCallback
+from video_processing.video_proxy import create_proxy, get_proxy_path
 from db.models_crud import VideoCRUD
-from db.models import Video
+from db.models import Video, DownloadStatus
+from utils.single_flight import SingleFlight
+
+
+class VideoNotReadyError(ValueError):
+    """Video file is not downloaded yet, the download should be enqueued"""
+
+    def __init__(self, video_id: int, message: str = "The video is being fetched, please try again in a few minutes"):
+        super().__init__(message)
+        self.video_id = video_id
 
 
 class YoutubeVideoProcessor:
     """
     Processes a YouTube video:
-    - Downloads the video stream with the highest resolution
+    - Downloads the video stream with the highest resolution within settings.max_video_resolution
+    - Creates low resolution proxy for screenshots
     - Downloads the audio stream if it is not included in the video stream
     - If the video was already downloaded, it skips the download process
+
+    In audio first mode only the audio stream is downloaded by process_audio,
+    the video is fetched later by process_video.
     """
 
-    def __init__(self, video_record: Video):
+    def __init__(self, video_record: Video, progress_callback: ProgressCallback = None):
+        """
+
+        :param video_record:
+        :param progress_callback: called with downloaded bytes, total bytes and throughput in bytes per second
+        """
         self.video_record = video_record
+        self.progress_callback = progress_callback
 
     def process(self) -> Video:
 
         if self.video_record.is_downloaded:
             return self.video_record
 
-        parsed_url = urlparse(self.video_record.url)
-        query_params = parse_qs(parsed_url.query)
-
-        v_param = query_params.get('v', None)
-        if not v_param:
-            raise ValueError("Invalid YouTube URL: missing video ID")
+        get_video_id(self.video_record.url)
 
         video_path = Path(self.video_record.video_path)
 
-        # Edge case not covered:
-        # if the video without audio was downloaded and the process was interrupted
-        # when the audio was being downloaded
-        if not video_path.exists():
-            has_audio = download_video(Path(self.video_record.url), video_path)
-            if not has_audio:
-                audio_path = Path(settings.videos_directory, f"{self.video_record.hash_sum}.wav")
-                download_audio(Path(self.video_record.url), audio_path)
-                self.video_record = VideoCRUD().update(
-                    id=self.video_record.id,
-                    audio_path=str(audio_path),
-                    has_audio=False
-                )
+        # Interrupted downloads are resumed from their .part files.
+        # has_audio is saved as soon as the video is downloaded, so a retry after an interrupted
+        # audio download finds the video file and still downloads the audio
+        if not self.has_video_file(video_path):
+            self._download_video()
+        if not self.video_record.has_audio and self.video_record.audio_status != DownloadStatus.downloaded:
+            self.process_audio()
 
         self.video_record = VideoCRUD().update(id=self.video_record.id, is_downloaded=True)
         return self.video_record
 
+    def process_audio(self) -> Video:
+        """
+        Download only the audio stream, it is enough to build an agent
+        :return:
+        """
+        if self.video_record.audio_status == DownloadStatus.downloaded:
+            return self.video_record
+
+        get_video_id(self.video_record.url)
+
+        audio_path = Path(settings.videos_directory, f"{self.video_record.hash_sum}.m4a")
+        self._update(audio_status=DownloadStatus.downloading)
+        try:
+            if not audio_path.exists():
+                download_audio(Path(self.video_record.url), audio_path, self.progress_callback)
+        except Exception:
+            self._update(audio_status=DownloadStatus.failed)
+            raise
+
+        return self._update(
+            audio_path=str(audio_path),
+            has_audio=False,
+            audio_status=DownloadStatus.downloaded
+        )
+
+    def process_video(self, wait: bool = True) -> Video:
+        """
+        Download the video stream after the agent was built from the audio.
+        The download is claimed with a Redis lock kept alive by a heartbeat, the claim of a crashed process
+        expires and the next call resumes the download from its .part file
+        :param wait: wait for the download claimed by another process, otherwise return immediately
+        :return:
+        """
+        video_path = Path(self.video_record.video_path)
+        if self.video_record.video_status == DownloadStatus.downloaded and self.has_video_file(video_path):
+            return self.video_record
+
+        claim = self._download_claim()
+        if not claim.join(self.video_record.hash_sum, str(uuid.uuid4()), {}):
+            return self._wait_for_video(claim) if wait else self.video_record
+
+        try:
+            with claim.heartbeat(self.video_record.hash_sum):
+                if not self.has_video_file(video_path):
+                    self._download_video()
+        finally:
+            claim.finish(self.video_record.hash_sum)
+
+        return self._update(is_downloaded=True, video_status=DownloadStatus.downloaded)
+
+    @staticmethod
+    def _download_claim() -> SingleFlight:
+        return SingleFlight(prefix='video_download', ttl=settings.video_download_claim_ttl)
+
+    def _download_video(self) -> bool:
+        self._update(video_status=DownloadStatus.downloading)
+        try:
+            has_audio = download_video(
+                Path(self.video_record.url),
+                Path(self.video_record.video_path),
+                max_resolution=settings.max_video_resolution,
+                progress_callback=self.progress_callback
+            )
+            self._update(has_audio=has_audio)
+            if settings.screenshot_proxy:
+                self.create_proxy()
+        except Exception:
+            self._update(video_status=DownloadStatus.failed)
+            raise
+        self._update(video_status=DownloadStatus.downloaded)
+        return has_audio
+
+    def create_proxy(self) -> Video:
+        """
+        Create low resolution proxy with short keyframe interval used for screenshots.
+        The full resolution video is removed afterwards if settings.keep_full_video is False
+        :return:
+        """
+        video_path = Path(self.video_record.video_path)
+        proxy_path = create_proxy(
+            video_path,
+            get_proxy_path(video_path),
+            resolution=settings.proxy_resolution,
+            keyframe_interval=settings.proxy_keyframe_interval
+        )
+        if not settings.keep_full_video:
+            video_path.unlink()
+        return self._update(proxy_path=str(proxy_path))
+
+    def _wait_for_video(self, claim: SingleFlight) -> Video:
+        deadline = time.monotonic() + settings.video_download_wait_timeout
+        while time.monotonic() < deadline:
+            self.video_record = VideoCRUD().read(self.video_record.id)
+            if self.video_record.video_status == DownloadStatus.downloaded:
+                return self.video_record
+            if not claim.is_locked(self.video_record.hash_sum):
+                # The downloading process finished with an error or crashed, take over and resume
+                return self.process_video()
+            time.sleep(1)
+        raise TimeoutError(f"Video download is taking too long: {self.video_record.url}")
+
+    def _update(self, **kwargs) -> Video:
+        self.video_record = VideoCRUD().update(id=self.video_record.id, **kwargs)
+        return self.video_record
+
+    @staticmethod
+    def has_video_file(video_path: Path) -> bool:
+        """Check if the video or its screenshot proxy is downloaded"""
+        return video_path.exists() or get_proxy_path(video_path).exists()
+
+    @classmethod
+    def ensure_video(cls, video_path: Path, prefer_proxy: bool = False) -> Path:
+        """
+        Make sure the video file is downloaded.
+        The download and the proxy transcode are too slow for a request, they are left to a background task
+        :param video_path:
+        :param prefer_proxy: take the low resolution proxy if it exists, where decoding speed matters more
+            than resolution, e.g. scanning the whole video. Otherwise the full video is taken if it was kept
+        :return: path of the file to take frames from
+        :raises FileNotFoundError: if video is not known
+        :raises VideoNotReadyError: if the video is not downloaded yet, the caller should enqueue the download
+        """
+        if not cls.has_video_file(video_path):
+            video_record = VideoCRUD().get_by_video_path(str(video_path))
+            if video_record is None:
+                raise FileNotFoundError(f"Video file not found: {video_path}")
+            raise VideoNotReadyError(video_record.id)
+
+        proxy_path = get_proxy_path(video_path)
+        if not proxy_path.exists() or (video_path.exists() and not prefer_proxy):
+            return video_path
+        return proxy_path
+
     @staticmethod
     def hash_url(video_url: str) -> str:
+        """Hash of the canonical url, so all urls of the same video have the same hash"""
+        return hashlib.md5(canonical_url(video_url).encode()).hexdigest()
+
+    @staticmethod
+    def legacy_hash_url(video_url: str) -> str:
+        """Hash of the url as it was given, videos added before the urls were canonicalized have it"""
         return hashlib.md5(video_url.encode()).hexdigest()
 
+    @classmethod
+    def find_video(cls, video_url: str) -> Video | None:
+        """Video of the url, including videos added before the urls were canonicalized"""
+        return VideoCRUD().get_by_hash(cls.hash_url(video_url)) or VideoCRUD().get_by_hash(cls.legacy_hash_url(video_url))
+
     def is_processed(self, video_url: str):
-        video_record = VideoCRUD().get_by_hash(self.hash_url(video_url))
+        video_record = self.find_video(video_url)
         return video_record.is_downloaded
 
     @staticmethod
@@ -78,20 +233,24 @@ class YoutubeVideoProcessor:
             raise ValueError(e)
 
     @classmethod
-    def from_url(cls, video_url: str):
+    def from_url(cls, video_url: str, progress_callback: ProgressCallback = None):
 
+        # Rows of videos added before the urls were canonicalized keep their hash, their files are named by it
+        video_record = cls.find_video(video_url)
+
+        video_url = canonical_url(video_url)
         yt = YouTube(video_url)
         yt.check_availability()
 
+        if video_record is not None:
+            return cls(video_record, progress_callback)
+
         url_hash = cls.hash_url(video_url)
-        if not VideoCRUD().get_by_hash(url_hash):
-            video_record = VideoCRUD().create(
-                url=video_url,
-                hash_sum=url_hash,
-                video_type='youtube',
-                title=yt.title,
-                video_path=str(Path(settings.videos_directory) / f"{url_hash}.mp4"),
-            )
-        else:
-            video_record = VideoCRUD().get_by_hash(url_hash)
-        return cls(video_record)
\ No newline at end of file
+        video_record = VideoCRUD().create(
+            url=video_url,
+            hash_sum=url_hash,
+            video_type='youtube',
+            title=yt.title,
+            video_path=str(Path(settings.videos_directory) / f"{url_hash}.mp4"),
+        )
+        return cls(video_record, progress_callback)
\ No newline at end of file
@@ -0,0 +1,83 @@
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict
+import whisper
+from utils.singleton import Singleton
+from core.settings import settings
+
+
+@dataclass
+class PooledModel:
+    """Loaded whisper model with its load statistics."""
+    model: Any
+    load_time: float
+    memory_bytes: int
+    uses: int = 0
+
+
+def model_memory(model) -> int:
+    """Resident memory of model parameters and buffers in bytes"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(tensor.numel() * tensor.element_size() for tensor in tensors)
+
+
+class WhisperModelPool(metaclass=Singleton):
+    """
+    Process-resident pool of loaded whisper models.
+    Models are kept in memory between transcriptions, least recently used model is evicted
+    when the pool exceeds max_models.
+    """
+
+    def __init__(self, max_models: int = None):
+        self.max_models = max_models or settings.whisper_pool_size
+        self.models: OrderedDict[str, PooledModel] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, model_name: str):
+        """Get model from the pool, loading it if needed."""
+        with self.lock:
+            if model_name not in self.models:
+                self._load(model_name)
+            self.models.move_to_end(model_name)
+            pooled = self.models[model_name]
+            pooled.uses += 1
+            return pooled.model
+
+    def preload(self, model_name: str):
+        """Load model into the pool without using it."""
+        with self.lock:
+            if model_name not in self.models:
+                self._load(model_name)
+
+    def evict(self, model_name: str) -> bool:
+        """Remove model from the pool."""
+        with self.lock:
+            return self.models.pop(model_name, None) is not None
+
+    def stats(self) -> Dict[str, dict]:
+        """Load time in seconds, resident memory in bytes and number of uses per model."""
+        with self.lock:
+            return {
+                name: {
+                    'load_time': pooled.load_time,
+                    'memory_bytes': pooled.memory_bytes,
+                    'uses': pooled.uses,
+                } for name, pooled in self.models.items()
+            }
+
+    def _load(self, model_name: str):
+        # Evict before loading so two large models are never resident at once
+        while len(self.models) >= self.max_models:
+            self.models.popitem(last=False)
+
+        start = time.perf_counter()
+        model = whisper.load_model(model_name)
+        load_time = time.perf_counter() - start
+
+        self.models[model_name] = PooledModel(
+            model=model,
+            load_time=load_time,
+            memory_bytes=model_memory(model),
+        )